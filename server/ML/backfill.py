@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+backfill.py - score past streams offline
+Run with:  python -m backfill vods/ --out output/highlights.jsonl
+
+Every input VOD is split into fixed windows that are analysed on a pool of
+processes (each loads the models once). Finished windows are appended to a
+checkpoint file, so an interrupted run picks up where it stopped, and at the
+end all windows are written to one highlights file ranked by score.
+"""
+import os
+import json
+import time
+import queue
+import logging
+import argparse
+import tempfile
+import subprocess
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from services.models import get_registry
+from services.executor import analyze_clip, transcribe_segment
+from services.transcript import IncrementalTranscriber
+from services.clip_processor import ClipEvents, Emotion, VIRAL_SCORE, score_emotions
+
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.ts', '.flv', '.mov', '.webm')
+SPEECH_WPS = 2.5       # words per second that counts as fully talkative
+
+# per-process scratch directory for window cuts, set by _init_worker
+_scratch = None
+
+
+def find_videos(inputs: list) -> list:
+    """Expand files and directories (recursively) into a sorted list of videos"""
+    out = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                out += [os.path.join(root, f) for f in files if f.lower().endswith(VIDEO_EXTENSIONS)]
+        elif os.path.isfile(path):
+            out.append(path)
+    return sorted(set(out))
+
+
+def probe_duration(path: str) -> float:
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path]
+    try:
+        return float(subprocess.run(cmd, capture_output=True, text=True, check=True).stdout.strip())
+    except (subprocess.CalledProcessError, ValueError):
+        return 0.0
+
+
+def plan_windows(videos: list, window: float) -> list:
+    """(vod, start, end) for every window of every video"""
+    tasks = []
+    for vod in videos:
+        duration = probe_duration(vod)
+        if duration <= 0:
+            logging.getLogger('main').warning(f"Cannot read duration of {vod}, skipping")
+            continue
+        start = 0.0
+        while start < duration - 0.5:
+            tasks.append((vod, start, min(start + window, duration)))
+            start += window
+    return tasks
+
+
+def window_key(vod: str, start: float) -> str:
+    return f"{os.path.abspath(vod)}@{start:.2f}"
+
+
+def score_window(events: list, duration: float) -> dict:
+    """Emotion, transcript and scene summary of one window plus its highlight score"""
+    clip = ClipEvents()
+    transcript, scenes = [], []
+    for evt in events:
+        if evt['type'] == 'emotion':
+            emotion = Emotion.parse(evt['emotion'])
+            if emotion is not None:
+                clip.add_emotion(emotion, evt.get('video_time', 0.0), evt.get('scores'))
+        elif evt['type'] == 'transcript':
+            transcript.append(evt['text'])
+        elif evt['type'] == 'scene':
+            scenes.append(evt['description'])
+
+    # every sampled frame is reported, so expressiveness is the share that was not neutral
+    total = clip.total
+    emotional = total - clip.counts[Emotion.NEUTRAL]
+    emotion_ratio = clip.dominant_count / emotional if emotional else 0.0
+    expressive = emotional / total if total else 0.0
+    times, probs = clip.emotion_series()
+    scored = score_emotions(times, probs, 0.0, duration) if total else None
+    emotion_score = scored['score'] if scored else 0.0
+    text = " ".join(transcript)
+    speech = min(1.0, len(text.split()) / (SPEECH_WPS * duration)) if duration > 0 else 0.0
+    return {
+        "score": round(0.5 * emotion_ratio * expressive + 0.3 * expressive + 0.2 * speech, 4),
+        "viral": emotion_score >= VIRAL_SCORE,
+        "emotion": clip.dominant.label if clip.dominant is not None else "neutral",
+        "emotion_ratio": round(emotion_ratio, 3),
+        "emotion_score": round(emotion_score, 3),
+        "peak_time": round(scored['peak_time'], 2) if scored else None,
+        "emotions": {e.label: clip.counts[e] for e in Emotion if clip.counts[e]},
+        "transcript": text,
+        "scenes": scenes,
+    }
+
+
+def _init_worker(warmup: bool):
+    global _scratch
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    _scratch = tempfile.mkdtemp(prefix='backfill_')
+    get_registry().load(warmup=warmup)
+
+
+def analyze_window(vod: str, start: float, end: float, timeout: float = 600.0,
+                   transcriber: IncrementalTranscriber = None) -> dict:
+    """
+    Cut one window and run every analyzer on it. The cut is re-encoded so it
+    starts exactly at `start` (a stream copy snaps to the keyframe before it);
+    `transcriber` carries the context of the previous window of the same VOD.
+    """
+    began = time.perf_counter()
+    scratch = _scratch or tempfile.gettempdir()
+    cut = os.path.join(scratch, f"window_{os.getpid()}.mp4")
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-ss', f"{start:.3f}", '-i', vod, '-t', f"{end - start:.3f}",
+           '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', cut]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    events = queue.Queue()
+    analyze_clip(cut, window_key(vod, start), timeout=timeout, event_q=events)
+    transcribe_segment(cut, window_key(vod, start), transcriber or IncrementalTranscriber(), timeout=timeout,
+                       event_q=events, start=start)
+    collected = []
+    while not events.empty():
+        evt = events.get()
+        if evt['type'] != 'done':
+            collected.append(evt)
+    os.remove(cut)
+
+    record = {"vod": vod, "start": round(start, 2), "end": round(end, 2)}
+    record.update(score_window(collected, end - start))
+    record["elapsed"] = round(time.perf_counter() - began, 2)
+    return record
+
+
+def load_checkpoint(path: str) -> dict:
+    """window key -> record for every window already finished"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn last line of an interrupted run
+            done[window_key(record["vod"], record["start"])] = record
+    return done
+
+
+def write_highlights(records: list, out: str, fmt: str = 'jsonl'):
+    ranked = sorted(records, key=lambda r: r["score"], reverse=True)
+    for rank, record in enumerate(ranked, 1):
+        record["rank"] = rank
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    if fmt == 'parquet':
+        try:
+            import pandas as pd
+        except ImportError:
+            raise SystemExit("Parquet output needs pandas and pyarrow: pip install pandas pyarrow")
+        pd.DataFrame(ranked).to_parquet(out, index=False)
+    else:
+        tmp = out + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for record in ranked:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp, out)
+    return ranked
+
+
+def backfill(inputs: list, out: str, window: float = 6.0, workers: int = None, warmup: bool = True,
+             fmt: str = 'jsonl', checkpoint: str = None, chunksize: int = 8) -> list:
+    logger = logging.getLogger('main')
+    checkpoint = checkpoint or out + '.progress.jsonl'
+    videos = find_videos(inputs)
+    tasks = plan_windows(videos, window)
+    done = load_checkpoint(checkpoint)
+    todo = [t for t in tasks if window_key(t[0], t[1]) not in done]
+    logger.info(f"{len(videos)} videos, {len(tasks)} windows, {len(tasks) - len(todo)} already done")
+
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    if todo:
+        # contiguous runs per submission keep neighbouring windows in one process
+        batches = [todo[i:i + chunksize] for i in range(0, len(todo), chunksize)]
+        ctx = mp.get_context('spawn')  # TensorFlow and torch are not fork-safe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(warmup,)) as pool, \
+                open(checkpoint, 'a', encoding='utf-8') as progress:
+            futures = [pool.submit(_analyze_batch, batch) for batch in batches]
+            finished = 0
+            for fut in as_completed(futures):
+                try:
+                    records = fut.result()
+                except Exception as e:
+                    logger.error(f"Backfill batch failed: {e}")
+                    continue
+                for record in records:
+                    progress.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    done[window_key(record["vod"], record["start"])] = record
+                progress.flush()
+                finished += len(records)
+                rate = finished / (time.perf_counter() - started)
+                logger.info(f"{finished}/{len(todo)} windows ({rate:.2f}/s, "
+                            f"~{(len(todo) - finished) / rate / 60 if rate else 0:.0f} min left)")
+
+    ranked = write_highlights([done[k] for k in (window_key(t[0], t[1]) for t in tasks) if k in done], out, fmt)
+    logger.info(f"Wrote {len(ranked)} ranked windows to {out} in {time.perf_counter() - started:.0f}s")
+    return ranked
+
+
+def _analyze_batch(batch: list) -> list:
+    # a batch is a contiguous run of windows; each VOD in it gets a fresh transcriber
+    records, transcribers = [], {}
+    for vod, start, end in batch:
+        if vod not in transcribers:
+            transcribers[vod] = IncrementalTranscriber()
+        try:
+            records.append(analyze_window(vod, start, end, transcriber=transcribers[vod]))
+        except Exception as e:
+            logging.getLogger('main').error(f"Window {vod}@{start:.1f} failed: {e}")
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score VODs offline into a ranked highlights file")
+    parser.add_argument("inputs", nargs="+", help="VOD files and/or directories of VODs")
+    parser.add_argument("--out", default="output/highlights.jsonl", help="Ranked highlights file")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl")
+    parser.add_argument("--window", type=float, default=6.0, help="Window length in seconds")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--checkpoint", default=None, help="Progress file (default: <out>.progress.jsonl)")
+    parser.add_argument("--no_warmup", action="store_true", help="Skip the dummy warm-up inference")
+    parser.add_argument("--top", type=int, default=10, help="Print the N best windows when done")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ranked = backfill(args.inputs, args.out, window=args.window, workers=args.workers,
+                      warmup=not args.no_warmup, fmt=args.format, checkpoint=args.checkpoint)
+    for record in ranked[:args.top]:
+        print(f"#{record['rank']:<3} {record['score']:.3f}  {os.path.basename(record['vod'])} "
+              f"{record['start']:>8.1f}s  {record['emotion']:<8} {record['transcript'][:60]}")
@@ -0,0 +1,180 @@
+"""
+Local IRC server that replays recorded (or synthetic) Twitch chat, for load
+testing the chat client without a Twitch connection.
+
+    python -m bench.fake_irc [recording.txt] --rate 10000 --seconds 5
+
+A recording is a text file of raw IRC lines (with or without @tags); only the
+PRIVMSGs are replayed, re-targeted at whichever channels the client joined.
+Writes are cut at random byte offsets so line framing is exercised too.
+"""
+import time
+import random
+import asyncio
+import argparse
+import logging
+
+
+def synthetic_chat(n: int = 1000, seed: int = 0) -> list:
+    """Tagged PRIVMSG lines with escaped tag values, emoji and long messages"""
+    rng = random.Random(seed)
+    words = ["LUL", "PogChamp", "KEKW", "W", "no way", "clip it", "🔥🔥", "ñandú", "that was insane", "OMEGALUL"]
+    lines = []
+    for i in range(n):
+        nick = f"viewer{rng.randrange(5000)}"
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(1, 12)))
+        tags = (f"@badge-info=;color=#1E90FF;display-name={nick};emotes=;id=msg-{i};"
+                f"system-msg=a\\shello\\:\\sworld;tmi-sent-ts={1700000000000 + i}")
+        lines.append(f"{tags} :{nick}!{nick}@{nick}.tmi.twitch.tv PRIVMSG #channel :{text}")
+    return lines
+
+
+def load_recording(path: str) -> list:
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return [l.rstrip('\r\n') for l in f if ' PRIVMSG ' in l]
+
+
+class FakeIrcServer:
+    """Accepts clients, answers the login handshake, then floods joined channels at `rate` msgs/s"""
+
+    def __init__(self, lines: list, rate: float = 10000, total: int = None, ping_every: float = 1.0,
+                 reconnect_after: int = None, chunking: bool = True):
+        self.lines = lines
+        self.rate = rate
+        self.total = total
+        self.ping_every = ping_every
+        self.reconnect_after = reconnect_after
+        self.chunking = chunking
+        self.sent = 0
+        self.pongs = 0
+        self.connections = 0
+        self.server = None
+
+    async def _reader(self, reader, writer, joined: set, ready: asyncio.Event):
+        nick = None
+        while True:
+            raw = await reader.readline()
+            if not raw:
+                return
+            line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+            cmd, _, rest = line.partition(' ')
+            if cmd == 'NICK':
+                nick = rest
+                writer.write(f":tmi.twitch.tv 001 {nick} :Welcome, GLHF!\r\n".encode())
+            elif cmd == 'JOIN':
+                for channel in rest.split(','):
+                    joined.add(channel)
+                    writer.write(f":{nick}!{nick}@{nick}.tmi.twitch.tv JOIN {channel}\r\n".encode())
+                ready.set()
+            elif cmd == 'PART':
+                joined.discard(rest)
+            elif cmd == 'PONG':
+                self.pongs += 1
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        joined, ready = set(), asyncio.Event()
+        reader_task = asyncio.create_task(self._reader(reader, writer, joined, ready))
+        try:
+            await asyncio.wait_for(ready.wait(), 10)
+            await self._replay(writer, joined)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            reader_task.cancel()
+            writer.close()
+
+    async def _replay(self, writer, joined: set):
+        batch = max(1, int(self.rate / 100))  # ~10 ms worth of chat per write
+        start = time.perf_counter()
+        last_ping = start
+        i = sent_here = 0
+        while self.total is None or self.sent < self.total:
+            out = []
+            for _ in range(batch):
+                channel = sorted(joined)[i % len(joined)] if joined else '#channel'
+                line = self.lines[i % len(self.lines)]
+                head, sep, text = line.partition(' PRIVMSG ')
+                target, _, message = text.partition(' ')
+                out.append(f"{head} PRIVMSG {channel} {message}\r\n")
+                i += 1
+            data = ''.join(out).encode('utf-8')
+            if self.chunking:
+                # split at arbitrary byte offsets, mid-line and mid-UTF-8 sequence
+                pos = 0
+                while pos < len(data):
+                    step = random.randint(1, 4096)
+                    writer.write(data[pos:pos + step])
+                    pos += step
+            else:
+                writer.write(data)
+            await writer.drain()
+            self.sent += batch
+            sent_here += batch
+            now = time.perf_counter()
+            if now - last_ping >= self.ping_every:
+                writer.write(b"PING :tmi.twitch.tv\r\n")
+                last_ping = now
+            if self.reconnect_after and sent_here >= self.reconnect_after:
+                writer.write(b":tmi.twitch.tv RECONNECT\r\n")
+                await writer.drain()
+                return
+            ahead = sent_here / self.rate - (now - start)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    def close(self):
+        if self.server:
+            self.server.close()
+
+
+async def _bench(lines, rate, seconds, channels, reconnect_after):
+    from services.irc import IrcClient
+
+    server = FakeIrcServer(lines, rate=rate, total=int(rate * seconds), reconnect_after=reconnect_after)
+    port = await server.start()
+    client = IrcClient(channels, host='127.0.0.1', port=port, token=None, nick='bench', backoff=0.1)
+    task = asyncio.create_task(client.run())
+
+    expected = {l.rpartition(' :')[2] for l in lines}
+    received, bad, per_channel = 0, 0, {}
+    start = time.perf_counter()
+    try:
+        while received < server.total:
+            msg = await asyncio.wait_for(client.messages.get(), 5)
+            received += 1
+            per_channel[msg.channel] = per_channel.get(msg.channel, 0) + 1
+            if msg.text not in expected:
+                bad += 1
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    client.stop()
+    task.cancel()
+    server.close()
+    print(f"received {received}/{server.total} in {elapsed:.2f}s ({received / elapsed:,.0f} msgs/s)")
+    print(f"corrupted {bad}, dropped {client.dropped}, connections {server.connections}, "
+          f"pongs {server.pongs}, per channel {per_channel}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay chat through a fake IRC server")
+    parser.add_argument("recording", nargs="?", help="raw IRC log; synthetic chat if omitted")
+    parser.add_argument("--rate", type=float, default=10000)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--channels", default="#one,#two,#three")
+    parser.add_argument("--reconnect_after", type=int, default=None,
+                        help="send RECONNECT after this many messages per connection")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    lines = load_recording(args.recording) if args.recording else synthetic_chat()
+    asyncio.run(_bench(lines, args.rate, args.seconds, args.channels.split(','), args.reconnect_after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Local OpenAI-compatible chat-completions server for exercising the scene client
+without the real vision LLM.
+
+    python -m bench.mock_openai [video] --latency 0.4 --fail_rate 0.1 --images_per_request 4
+"""
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class MockState:
+    def __init__(self, latency: float, fail_rate: float, fail_first: int = 0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.fail_first = fail_first  # the first N requests fail, for deterministic retry tests
+        self.requests = 0
+        self.failures = 0
+        self.images = 0
+        self.bytes_in = 0
+        self.lock = threading.Lock()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "images": self.images,
+                "bytes_in": self.bytes_in,
+                "latency": self.latency,
+            }
+
+
+def _make_handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _json(self, code: int, payload: dict):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip('/').endswith('/stats'):
+                self._json(200, state.snapshot())
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self._json(404, {"error": "not found"})
+                return
+            req = json.loads(raw or b"{}")
+            images = [
+                part["image_url"]["url"]
+                for msg in req.get("messages", [])
+                if isinstance(msg.get("content"), list)
+                for part in msg["content"]
+                if part.get("type") == "image_url"
+            ]
+            time.sleep(state.latency)
+            with state.lock:
+                state.requests += 1
+                state.images += len(images)
+                state.bytes_in += len(raw)
+                fail = state.requests <= state.fail_first or random.random() < state.fail_rate
+                if fail:
+                    state.failures += 1
+            if fail:
+                self._json(429, {"error": {"message": "rate limited (mock)", "type": "rate_limit"}})
+                return
+            # deterministic "description" per image so cached answers can be checked
+            tags = [hashlib.md5(url.encode()).hexdigest()[:6] for url in images]
+            if len(tags) > 1:
+                content = json.dumps([f"scene {t}" for t in tags])
+            else:
+                content = f"scene {tags[0] if tags else 'empty'}"
+            self._json(200, {
+                "id": f"mock-{state.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": req.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+    return Handler
+
+
+def serve(port: int = 0, latency: float = 0.3, fail_rate: float = 0.0, fail_first: int = 0):
+    """Start the mock in a background thread; returns (server, state, base_url)"""
+    state = MockState(latency, fail_rate, fail_first)
+    server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    import cv2
+    from services.scene_client import SceneClient
+
+    parser = argparse.ArgumentParser(description="Scene client against a mock OpenAI server")
+    parser.add_argument("video", nargs="?", default="../captions/videoplayback.mp4")
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--fail_rate", type=float, default=0.0)
+    parser.add_argument("--seconds", type=int, default=30)
+    parser.add_argument("--images_per_request", type=int, default=1)
+    args = parser.parse_args()
+
+    server, state, base_url = serve(latency=args.latency, fail_rate=args.fail_rate)
+    cap = cv2.VideoCapture(args.video)
+    fps = int(round(cap.get(cv2.CAP_PROP_FPS) or 30))
+    frames, idx = [], 0
+    while len(frames) < args.seconds and cap.grab():
+        if idx % fps == 0:
+            ok, frame = cap.retrieve()
+            if ok:
+                frames.append(frame)
+        idx += 1
+    cap.release()
+
+    client = SceneClient(base_url, "mock-key")
+    n = max(1, args.images_per_request)
+    for label in ("cold", "warm"):
+        start = time.perf_counter()
+        if n == 1:
+            client.describe_frames(frames)
+        else:
+            futures = [client.submit_batch(frames[i:i + n]) for i in range(0, len(frames), n)]
+            [f.result() for f in futures]
+        print(f"{label}: {len(frames)} frames in {time.perf_counter() - start:.2f}s")
+    print("client:", client.stats())
+    print("server:", state.snapshot())
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
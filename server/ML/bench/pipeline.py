@@ -0,0 +1,331 @@
+"""
+End-to-end benchmark of the clip pipeline on fixed fixtures.
+
+    python -m bench.pipeline                       # all stages, 5 runs each
+    python -m bench.pipeline --stages decode,emotion --repeat 10
+    python -m bench.pipeline --stages frames,frames_cv  # ffmpeg vs OpenCV frame delivery
+    python -m bench.pipeline --save_baseline       # record bench/baseline.json
+
+Each stage runs once untimed (model graphs, ffmpeg caches), then `repeat`
+times. Results (throughput, p50/p95/p99 latency, CPU utilisation, RSS) go to
+a JSON file and are compared with the stored baseline; a stage whose p50 got
+slower than the tolerance is reported as a regression. Scene descriptions
+use the local mock LLM so numbers do not depend on a remote API, and the
+analysis cache is off so every run does the work.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURE = os.path.normpath(os.path.join(HERE, '..', '..', 'captions', 'videoplayback.mp4'))
+DEFAULT_BASELINE = os.path.join(HERE, 'baseline.json')
+DEFAULT_OUT = os.path.join(HERE, 'results', 'latest.json')
+STAGES = ('decode', 'frames', 'frames_cv', 'emotion', 'transcript', 'scene', 'concat', 'captions', 'e2e')
+
+
+def _ffmpeg(*args):
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', *args], check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_fixtures(fixture: str, workdir: str, seconds: float = 6.0) -> dict:
+    """A segment cut from the real fixture plus two synthetic (deterministic) clips"""
+    segment = os.path.join(workdir, 'segment.mp4')
+    _ffmpeg('-i', fixture, '-t', str(seconds), '-c', 'copy', segment)
+    synthetic = []
+    for i, freq in enumerate((440, 660)):
+        path = os.path.join(workdir, f'synthetic_{i}.mp4')
+        _ffmpeg('-f', 'lavfi', '-i', f'testsrc2=size=640x360:rate=30:duration={seconds}',
+                '-f', 'lavfi', '-i', f'sine=frequency={freq}:duration={seconds}',
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '30', '-c:a', 'aac', '-shortest', path)
+        synthetic.append(path)
+    srt = os.path.join(workdir, 'captions.srt')
+    with open(srt, 'w', encoding='utf-8') as f:
+        for i in range(int(seconds)):
+            f.write(f"{i + 1}\n00:00:{i:02d},000 --> 00:00:{i:02d},900\nbenchmark caption line {i + 1}\n\n")
+    return {'fixture': fixture, 'segment': segment, 'synthetic': synthetic, 'srt': srt}
+
+
+def _cpu_seconds() -> float:
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(max(own, children), 1)
+
+
+def _percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def measure(name: str, run, repeat: int, unit: str) -> dict:
+    """Time `run()` (which returns how many `unit`s it processed) `repeat` times"""
+    from services.models import current_rss_mb
+
+    run()  # untimed warm-up
+    latencies, items = [], 0
+    rss_before = current_rss_mb()
+    cpu0, wall0 = _cpu_seconds(), time.perf_counter()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items += run()
+        latencies.append(time.perf_counter() - start)
+    wall, cpu = time.perf_counter() - wall0, _cpu_seconds() - cpu0
+    result = {
+        'runs': repeat,
+        'unit': unit,
+        'items_per_run': items / repeat if repeat else 0,
+        'throughput': round(items / wall, 2) if wall else 0.0,
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 1),
+        'cpu_percent': round(100 * cpu / wall, 1) if wall else 0.0,
+        'rss_mb': round(current_rss_mb(), 1),
+        'rss_delta_mb': round(current_rss_mb() - rss_before, 1),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+    print(f"  {name:<11} p50 {result['p50_ms']:>9.1f} ms  p95 {result['p95_ms']:>9.1f} ms  "
+          f"{result['throughput']:>9.2f} {unit}/s  cpu {result['cpu_percent']:>6.1f}%")
+    return result
+
+
+# ── stages ────────────────────────────────────────────────────────────────────
+def stage_decode(fx):
+    from services.frame_bus import FrameBus, SamplingPolicy
+
+    def run():
+        bus = FrameBus(fx['fixture'])
+        frames = bus.subscribe('bench', SamplingPolicy.every(1))
+        bus.start()
+        return sum(1 for _ in frames)
+    return run, 'frames'
+
+
+def _analyzer_frames(fx, backend=None):
+    # the subscriptions the executor opens: emotion and scene frames at their own size
+    from services.frame_bus import FrameBus
+    from services.intern import INTERN_FRAMES, INTERN_SAMPLING
+    from services.analyzers import EMOTION_SAMPLING, emotion_frames
+
+    def run():
+        bus = FrameBus(fx['fixture'], backend=backend)
+        subs = [bus.subscribe('emotion', EMOTION_SAMPLING, emotion_frames()),
+                bus.subscribe('intern', INTERN_SAMPLING, INTERN_FRAMES)]
+        bus.start()
+        counts = [0] * len(subs)
+
+        def drain(k):
+            counts[k] = sum(1 for _ in subs[k])
+        readers = [threading.Thread(target=drain, args=(k,)) for k in range(len(subs))]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        return sum(counts)
+    return run, 'frames'
+
+
+def stage_frames(fx):
+    return _analyzer_frames(fx)
+
+
+def stage_frames_cv(fx):
+    return _analyzer_frames(fx, backend='opencv')
+
+
+def stage_emotion(fx):
+    from services.frame_bus import FrameBus
+    from services.emotion_engine import EmotionEngine
+    from services.analyzers import EMOTION_SAMPLING, emotion_frames
+    engine = EmotionEngine()
+
+    def run():
+        bus = FrameBus(fx['fixture'])
+        frames = bus.subscribe('emotion', EMOTION_SAMPLING, emotion_frames())
+        bus.start()
+        return sum(1 for _ in engine.iter_batches(frames))
+    return run, 'frames'
+
+
+def stage_transcript(fx):
+    from services.transcript import IncrementalTranscriber, extract_audio, transcribe_audio, AUDIO_RATE
+
+    def run():
+        audio = extract_audio(fx['segment'])
+        transcribe_audio(audio, 0.0, queue.Queue(), IncrementalTranscriber(vad=False))
+        return len(audio) / AUDIO_RATE
+    return run, 'audio_s'
+
+
+def stage_scene(fx):
+    from services.intern import process_video
+    from services.scene_client import SceneClient
+
+    def run():
+        # fresh client each run: the perceptual cache would otherwise answer everything
+        client = SceneClient(os.environ['INTERN_BASE_URL'], 'bench')
+        try:
+            return len(process_video(fx['segment'], queue.Queue(), client=client))
+        finally:
+            client.close()
+    return run, 'descriptions'
+
+
+def stage_concat(fx):
+    from services.highlights import HighlightAssembler
+    out = os.path.join(os.path.dirname(fx['segment']), 'concat.mp4')
+    assembler = HighlightAssembler(workers=1)
+
+    def run():
+        job = assembler.submit_clips(fx['synthetic'], out).future.result()
+        if not job.ok:
+            raise RuntimeError(f"concat failed: {job.error}")
+        return 1
+    return run, 'clips'
+
+
+def stage_captions(fx):
+    out = os.path.join(os.path.dirname(fx['segment']), 'captioned.mp4')
+
+    def run():
+        # the burn step of services/captions.py, on a fixed SRT
+        from services.captions import burn_captions
+        burn_captions(fx['segment'], fx['srt'], out)
+        return 1
+    return run, 'clips'
+
+
+def stage_e2e(fx):
+    import main
+    from services.clip_processor import ClipProcessor
+    from services.executor import ClipExecutor
+    from services.models import get_registry
+
+    processor = ClipProcessor()
+    executor = ClipExecutor('thread', workers=1, warmup=False)
+    executor.start(processor)
+    counter = iter(range(1 << 30))
+
+    def run():
+        get_registry().scene_client().cache.clear()
+        main.process_single_clip(fx['segment'], processor, f"bench_{next(counter)}", executor)
+        return 1
+    return run, 'clips'
+
+
+# ── reporting ─────────────────────────────────────────────────────────────────
+def _environment(fixture: str) -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=HERE).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'commit': commit,
+        'fixture': os.path.relpath(fixture, os.path.join(HERE, '..')),
+        'fixture_bytes': os.path.getsize(fixture),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Stages whose p50 latency grew by more than `tolerance` over the baseline"""
+    regressions = []
+    print(f"\n  {'stage':<11} {'p50 now':>10} {'baseline':>10} {'change':>8}")
+    for name, now in results['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if not base or 'p50_ms' not in now or 'p50_ms' not in base or not base['p50_ms']:
+            continue
+        change = now['p50_ms'] / base['p50_ms'] - 1
+        flag = '  REGRESSION' if change > tolerance else ''
+        print(f"  {name:<11} {now['p50_ms']:>8.1f}ms {base['p50_ms']:>8.1f}ms {change:>+7.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the clip pipeline")
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE)
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma list out of {','.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save_baseline", action="store_true", help="write these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed p50 slowdown before flagging")
+    parser.add_argument("--llm_latency", type=float, default=0.3, help="mock LLM response time in seconds")
+    args = parser.parse_args()
+
+    from bench.mock_openai import serve
+    server, llm_state, base_url = serve(latency=args.llm_latency)
+    # before any service module is imported, so the registry picks them up
+    os.environ['INTERN_BASE_URL'] = base_url
+    os.environ['INTERN_API_KEY'] = 'bench'
+    os.environ['ANALYSIS_CACHE'] = 'off'
+
+    from services.models import get_registry
+    registry = get_registry().load(warmup=True)
+
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    results = {'environment': _environment(args.fixture), 'models': registry.report(), 'stages': {}}
+    try:
+        fx = make_fixtures(args.fixture, workdir)
+        print(f"Benchmarking on {args.fixture} ({args.repeat} runs per stage)")
+        for name in [s for s in args.stages.split(',') if s]:
+            if name not in STAGES:
+                raise SystemExit(f"Unknown stage {name!r}; choose from {', '.join(STAGES)}")
+            try:
+                run, unit = globals()[f'stage_{name}'](fx)
+                results['stages'][name] = measure(name, run, args.repeat, unit)
+            except Exception as e:
+                print(f"  {name:<11} failed: {e}")
+                results['stages'][name] = {'error': str(e)}
+        results['mock_llm'] = llm_state.snapshot()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        server.shutdown()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.out}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        print(f"No baseline at {args.baseline}; run with --save_baseline to create one")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,311 +12,439 @@ import threading
 import time
 import os
 import glob
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import RotatingFileHandler
 
-from deepface import DeepFace
-from services.intern import process_video
-from services.transcript import transcribe_video
+import cv2
 from services.clip_processor import ClipProcessor
-
+from services.models import get_registry
+from services.executor import ClipExecutor, EXECUTOR_MODES
+from services.emotion_engine import FACE_MODES
+from services.frame_bus import FRAME_BACKENDS
+from services.scheduler import ClipScheduler
+from services.triage import SegmentTriage
+from services.watcher import ClipWatcher
+from services.stream import StreamIngest
+from services.preroll import PacketRingBuffer
+from services.highlights import HighlightAssembler, SegmentIndex
+from services.captions import Captioner, TranscriptLog
+from services.transcript import IncrementalTranscriber
+from services.analyzers import analyze_stream_window, analyzer_versions, describe_clip
+from services.analysis_cache import get_cache
+from services.irc import ChatStream, IrcClient
+from services.hype import HypeDetector
+from services.metrics import CHAT_MESSAGES, CLIPS, CLIP_LAG, get_metrics, span
+from services.metrics import serve as serve_metrics
 
 
 ###############################################################################
-# ---------------------------  Emotion Worker  --------------------------------
+# ---------------------------  Logging  ---------------------------------------
 ###############################################################################
-def emotion_worker(video_path: str, event_q: queue.Queue, sample_every=10):
-    cap = cv2.VideoCapture(video_path if video_path else 0)  # 0 == webcam
-    frame_idx = 0
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    print(f"[Emotion] Worker started - FPS: {fps}")
+def setup_logging(log_dir='logs'):
+    os.makedirs(log_dir, exist_ok=True)
+    fmt = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    out = {}
+    for name in ('main', 'chat', 'emotion', 'intern', 'transcript'):
+        lg = logging.getLogger(name)
+        lg.setLevel(logging.INFO)
+        if not lg.handlers:
+            handler = RotatingFileHandler(os.path.join(log_dir, f'{name}.log'),
+                                          maxBytes=5 * 1024 * 1024, backupCount=3)
+            handler.setFormatter(fmt)
+            lg.addHandler(handler)
+        out[name] = lg
+    return out
 
-    try:
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret or frame is None:
-                logger.debug(f"End of video or invalid frame at {idx}")
-                break
-                
-            if idx % sample_every == 0:
-                try:
-                    res = DeepFace.analyze(frame, actions=['emotion'], enforce_detection=False)
-                    dom = res[0]['dominant_emotion']
-                    if dom.lower() != 'neutral':
-                        event_q.put({
-                            'type': 'emotion',
-                            'timestamp': datetime.now(),
-                            'video_time': idx / fps,
-                            'emotion': dom
-                        })
-                        logger.debug(f"Detected {dom} at {idx/fps:.1f}s")
-                except Exception as e:
-                    logger.error(f"Frame {idx} emotion analysis error: {e}")
-            idx += 1
 
-        cap.release()
-        logger.info(f"Emotion worker finished - processed {idx} frames")
-        
-    except Exception as e:
-        logger.error(f"Emotion worker failed: {e}")
-    finally:
-        # Clean up safe copy
-        if safe_path != video_path and os.path.exists(safe_path):
-            try:
-                os.remove(safe_path)
-                logger.debug(f"Cleaned up safe copy: {safe_path}")
-            except Exception as e:
-                logger.warning(f"Could not remove safe copy {safe_path}: {e}")
+loggers = setup_logging()
 
 
-def chat_worker(_unused_q, processor: ClipProcessor):
-    logger = loggers['chat']
-    HOST, PORT = "irc.chat.twitch.tv", 6667
-    NICK = "flaccdo"
-    TOKEN = "oauth:5hat2rxorg0y8j0ti7gt13rdtztadj"
-    CHANNEL = "#kvinhe"
+###############################################################################
+# ---------------------------  File Helpers  ----------------------------------
+###############################################################################
+def is_video_file_complete_and_valid(path):
+    """Cheap sanity check: the container opens and the first frame decodes"""
+    logger = loggers['main']
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            logger.warning(f"Cannot open video: {path}")
+            return False
+        ret, _ = cap.read()
+        return bool(ret)
+    finally:
+        cap.release()
 
-    WINDOW, THRESH, COOLDOWN = 20, 10, 10
-    
+
+###############################################################################
+# ---------------------------  Chat Worker  -----------------------------------
+###############################################################################
+def describe_hype_context(logger, clips_dir='clips'):
+    """Describe the newest clip for context; runs off the chat thread"""
+    clips = glob.glob(os.path.join(clips_dir, '*.mp4'))
+    if not clips:
+        return
+    latest_clip = max(clips, key=os.path.getmtime)
     try:
-        sock = socket.socket()
-        sock.settimeout(30)  # Add timeout to prevent hanging
-        sock.connect((HOST, PORT))
-        sock.send(f"PASS {TOKEN}\r\n".encode())
-        sock.send(f"NICK {NICK}\r\n".encode())
-        sock.send(f"JOIN {CHANNEL}\r\n".encode())
-        logger.info(f"Connected to {CHANNEL}")
+        # Process latest clip with intern to understand what's happening
+        logger.info(f"Analyzing hype moment in {os.path.basename(latest_clip)}")
+        description = describe_clip(latest_clip, cache=get_cache())
+        if description:
+            logger.info(f"🎥 Hype context: {description}")
     except Exception as e:
-        logger.error(f"Failed to connect to Twitch IRC: {e}")
-        return
+        logger.error(f"Failed to analyze hype clip: {e}")
 
-    times = deque()
-    in_peak = False
-    last_peak = None
+
+def chat_worker(_unused_q, processor: ClipProcessor, channels=None, routes: dict = None, clips_dir='clips'):
+    """
+    Watch chat and drive hype moments. By default every channel drives
+    `processor`; `routes` maps channels to their own (processor, clips_dir)
+    when several streams share this thread.
+    """
+    logger = loggers['chat']
+    routes = {IrcClient._norm(ch): route for ch, route in (routes or {}).items()}
+    channels = channels or (list(routes) if routes else None)
+    stream = ChatStream(channels).start()
+    detector = HypeDetector()
+    metrics = get_metrics()
+    metrics.gauge('clippy_chat_rate', 'Chat messages per second over the shortest window', ('channel',),
+                  fn=lambda: {(ch,): st.messages.rates()[0] for ch, st in list(detector.channels.items())})
+    metrics.gauge('clippy_hype_active', '1 while a channel is in a hype moment', ('channel',),
+                  fn=lambda: {(ch,): int(st.in_peak) for ch, st in list(detector.channels.items())})
+    # hype context is slow (vision LLM); keep it off the chat path, one at a time per stream
+    context_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hype-context")
+    contexts = {}
+    hyped = {}  # processor -> channels currently in hype; channels without a route share `processor`
+    last_tick = time.monotonic()
 
     try:
         while True:
-            data = sock.recv(2048).decode(errors='ignore')
-            for line in data.split('\r\n'):
-                if line.startswith('PING'):
-                    sock.send('PONG :tmi.twitch.tv\r\n'.encode())
-                    continue
-                if 'PRIVMSG' not in line:
+            msg = stream.get(timeout=1.0)
+            now = time.monotonic()
+            if msg is None and not stream.running:
+                break
+            events = []
+            if msg is not None:
+                CHAT_MESSAGES.inc(channel=msg.channel)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"[{msg.channel}] {msg.nick}: {msg.text}")
+                events += detector.feed(msg.channel, msg.text, now)
+            if now - last_tick >= 1.0:  # lets quiet channels cool down
+                events += detector.tick(now)
+                last_tick = now
+
+            for evt in events:
+                ts = evt['timestamp']
+                target, target_dir = routes.get(evt['channel'], (processor, clips_dir))
+                if target is None:
                     continue
+                channels_hyped = hyped.setdefault(target, set())
+                if evt['type'] == 'hype_start':
+                    if not channels_hyped:
+                        target.start_hype_moment()
+                        context = contexts.get(target)
+                        if context is None or context.done():
+                            contexts[target] = context_pool.submit(describe_hype_context, logger, target_dir)
+                    channels_hyped.add(evt['channel'])
+                    logger.info(f"🔥 HYPE start {ts:%H:%M:%S} in {evt['channel']} ({evt['reason']}, "
+                                f"{evt['rates']} msg/s vs baseline {evt['baseline']}, z={evt['z']})")
+                    print(f"🔥 HYPE START at {ts:%H:%M:%S} in {evt['channel']} 🔥", flush=True)
+                else:
+                    channels_hyped.discard(evt['channel'])
+                    if not channels_hyped:
+                        target.end_hype_moment()
+                    logger.info(f"📉 HYPE end {ts:%H:%M:%S} in {evt['channel']} after {evt['duration']}s "
+                                f"(peak {evt['peak_rate']} msg/s)")
+                    print(f"📉 HYPE END at {ts:%H:%M:%S} in {evt['channel']} 📉", flush=True)
 
-                msg = line.split('PRIVMSG',1)[1].split(':',1)[1].strip()
-                now = datetime.now()
-                print(f"[{now:%H:%M:%S}] {msg}", flush=True)
-
-                times.append(now)
-                while times and (now - times[0]).total_seconds() > WINDOW:
-                    times.popleft()
-                count = len(times)
-
-                if not in_peak and count > THRESH:
-                    in_peak = True
-                    last_peak = now
-                    processor.start_hype_moment()
-                    
-                    # Start intern analysis of current clips
-                    clips = glob.glob(os.path.join('clips', '*.mp4'))
-                    if clips:
-                        latest_clip = max(clips, key=os.path.getmtime)
-                        try:
-                            # Process latest clip with intern to understand what's happening
-                            logger.info(f"Analyzing hype moment in {os.path.basename(latest_clip)}")
-                            description = process_video(latest_clip)
-                            if description:
-                                logger.info(f"🎥 Hype context: {description}")
-                                print(f"🎥 {description}", flush=True)
-                        except Exception as e:
-                            logger.error(f"Failed to analyze hype clip: {e}")
-                    
-                    logger.info(f"🔥 HYPE start {now:%H:%M:%S}")
-                    print(f"🔥 HYPE START at {now:%H:%M:%S} 🔥", flush=True)
-
-                if in_peak and count < THRESH and (now - last_peak).total_seconds() >= COOLDOWN:
-                    in_peak = False
-                    processor.end_hype_moment()
-                    logger.info(f"📉 HYPE end {now:%H:%M:%S}")
-                    print(f"📉 HYPE END at {now:%H:%M:%S} 📉", flush=True)
-                    
     except Exception as e:
         logger.error(f"Chat worker error: {e}")
     finally:
-        try:
-            sock.close()
-        except:
-            pass
-
+        stream.stop()
+        context_pool.shutdown(wait=False)
 
-def intern_worker(video_path, event_q: queue.Queue):
-    logger = loggers['intern']
-    logger.info(f"Intern worker waiting for file: {video_path}")
-    
-    # Wait for file to be ready before processing
-    if not wait_for_file_stability(video_path, max_wait=10.0):
-        logger.warning(f"Video file not ready for intern processing: {video_path}")
-        return
-    
-    # Additional safety wait
-    time.sleep(1.0)
-        
-    try:
-        logger.info("Intern worker started processing")
-        process_video(video_path)
-        logger.info("Intern worker finished successfully")
-    except Exception as e:
-        logger.error(f"Intern error: {e}")
 
-
-def transcript_worker(video_path, event_q: queue.Queue):
-    logger = loggers['transcript']
-    logger.info(f"Transcript worker waiting for file: {video_path}")
-    
-    # Wait for file to be ready before processing
-    if not wait_for_file_stability(video_path, max_wait=10.0):
-        logger.warning(f"Video file not ready for transcript processing: {video_path}")
-        return
-    
-    # Additional safety wait
-    time.sleep(1.0)
-        
+# ── Clip Processing ────────────────────────────────────────────────────────────
+def print_event(evt: dict):
+    if evt["type"] == "emotion" and evt["emotion"].lower() != "neutral":
+        ts = evt["timestamp"].strftime("%H:%M:%S")
+        print(f"[Event] 😃 Emotion: '{evt['emotion']}' at {ts}")
+    elif evt["type"] == "scene":
+        print(f"[Event] 🎥 Frame {evt['frame']}: {evt['description']}")
+    elif evt["type"] == "transcript":
+        print(f"[Event] 💬 {evt['video_timestamp']}s: {evt['text']}")
+
+
+def finalize_clip(path, processor: ClipProcessor, clip_id: str, flagged: bool = False, start: float = None):
+    """Decide virality once every event of the clip has been delivered"""
     try:
-        logger.info("Transcript worker started processing")
-        transcribe_video(video_path, event_q)
-        logger.info("Transcript worker finished successfully")
-    except Exception as e:
-        logger.error(f"Transcript error: {e}")
+        with span('finalize', clip_id):
+            # segment files close when they end; live windows already carry stream time
+            if start is None:
+                start = os.path.getmtime(path) - SEGMENT_SECONDS if path else 0.0
+            processor.place_clip(clip_id, start)
+            dominant_emotion, count = processor.get_dominant_emotion(clip_id)
+            if dominant_emotion == "neutral":
+                print(f"[Main] 😐 Clip {clip_id} is mostly neutral, skipping...")
+                CLIPS.inc(outcome='neutral')
+                return False, None, None
+
+            print(f"[Main] 🎭 Dominant emotion in {clip_id}: {dominant_emotion}")
+            result = processor.check_viral_status(clip_id, path, flagged=flagged)
+            CLIPS.inc(outcome='viral' if result[0] else 'not_viral')
+            return result
+    finally:
+        processor.finish_clip(clip_id)
 
 
-# ── Clip Processing ────────────────────────────────────────────────────────────
-def process_single_clip(path, processor: ClipProcessor, clip_id: str):
+def process_single_clip(path, processor: ClipProcessor, clip_id: str, executor: ClipExecutor):
     logger = loggers['main']
     
     # First validate the clip before processing
     if not is_video_file_complete_and_valid(path):
         logger.warning(f"Skipping invalid/incomplete clip: {clip_id}")
+        CLIPS.inc(outcome='invalid')
         return False, None, None
     
-    events = queue.Queue()
     logger.info(f"Processing {clip_id}")
+    executor.submit(path, clip_id)
+    executor.wait(clip_id)
+    print(f"[Main] Finished processing clip: {path}")
+    return finalize_clip(path, processor, clip_id)
+
+
+SEGMENT_SECONDS = 6.0
+PRE_ROLL = 10.0   # seconds of context kept before the hype trigger
+POST_ROLL = 4.0   # seconds kept after the emotional peak
 
-    threads = [
-        threading.Thread(target=emotion_worker,  args=(path, events), daemon=True),
-        threading.Thread(target=intern_worker,   args=(path, events), daemon=True),
-        threading.Thread(target=transcript_worker,args=(path, events), daemon=True),
-    ]
-    
-    for worker in workers:
-        worker.start()
-    
-    try:
-        # Process events with timeout
-        start_time = time.time()
-        while any(t.is_alive() for t in workers):
-            if time.time() - start_time > 6.0:  # Match clip length (6 seconds)
-                print(f"[Main] Finished processing clip: {clip_path}")
-                break
-            try:
-                evt = events.get(timeout=0.1)  # Shorter timeout for faster processing
-                processor.add_event(clip_id, evt)
-                
-                # Print event
-                if evt["type"] == "emotion":
-                    ts = evt["timestamp"].strftime("%H:%M:%S")
-                    print(f"[Event] 😃 Emotion: '{evt['emotion']}' at {ts}")
-                elif evt["type"] == "scene":
-                    ts = evt["timestamp"].strftime("%H:%M:%S")
-                    print(f"[Event] 🎥 Frame {evt['frame']}: {evt['description']}")
-                elif evt["type"] == "transcript":
-                    print(f"[Event] 💬 {evt['video_timestamp']}s: {evt['text']}")
-            except queue.Empty:
-                continue
-                
-    except KeyboardInterrupt:
-        print("\n[Main] Shutting down...")
-    
-    # Get dominant emotion and determine if viral
-    dominant_emotion, count = processor.get_dominant_emotion(clip_id)
-    if dominant_emotion == "neutral":
-        print(f"[Main] 😐 Clip {clip_id} is mostly neutral, skipping...")
-        return False
-        
-    print(f"[Main] 🎭 Dominant emotion in {clip_id}: {dominant_emotion}")
-    is_viral = processor.check_viral_status(clip_id)
-    return is_viral
 
-def run(clips_dir: str):
+def _on_highlight_ready(out, ok, t0=None, t1=None, captioner: Captioner = None, sources: list = None,
+                        transcripts: TranscriptLog = None):
+    logger = loggers['main']
+    if not ok:
+        logger.error(f"Failed to extract hype clip {out}")
+        return
+    logger.info(f"🎬 Created hype clip: {out}")
+    try:
+        cache = get_cache()
+        if cache is not None and t0 is not None:
+            # the cut spans segments that were just analysed: reuse their descriptions
+            cache.register_range(out, t0, t1, sources=sources)
+        describe_clip(out, cache=cache)
+    except Exception as e:
+        logger.error(f"Error processing hype clip: {e}")
+    if captioner is not None:
+        captioner.submit(out, t0, t1, log=transcripts)
+
+
+def highlight_path(output_dir: str, clip_id: str, start: float) -> str:
+    """One file per clip and start: several clips can finish within the same second"""
+    stem = os.path.splitext(os.path.basename(clip_id))[0]
+    return os.path.join(output_dir, f"hype_{stem}_{int(start)}.mp4")
+
+
+def extract_highlight(preroll: PacketRingBuffer, processor: ClipProcessor, peak_wall: float,
+                      clip_id: str, desc: str, pre_roll=PRE_ROLL, post_roll=POST_ROLL,
+                      captioner: Captioner = None):
+    """Cut [hype_start - pre_roll, peak + post_roll] from the rolling buffer"""
+    hype_start = processor.hype_start_time.timestamp() if processor.hype_start_time else peak_wall
+    start = min(hype_start, peak_wall) - pre_roll
+    end = peak_wall + post_roll
+    oldest, _ = preroll.span()
+    start = max(start, oldest)
+    out = highlight_path('output', clip_id, start)
+    loggers['main'].info(f"🎯 Viral clip {clip_id}: {desc} → extracting {end - start:.1f}s")
+    # the cut comes back starting on the keyframe at or before `start`
+    preroll.extract_later(start, end, out,
+                          on_done=lambda path, t0: _on_highlight_ready(path, t0 is not None,
+                                                                       start if t0 is None else t0, end, captioner))
+
+
+def handle_viral_clip(assembler: HighlightAssembler, processor: ClipProcessor, clip, clip_id, desc, peak_time,
+                      pre_roll=PRE_ROLL, captioner: Captioner = None, output_dir='output',
+                      index: SegmentIndex = None, transcripts: TranscriptLog = None):
+    """
+    Cut [peak - pre_roll, end of clip] out of the watched segments in the
+    background. One of several streams passes its own segment `index`,
+    `output_dir` and `transcripts`.
+    """
+    # segment files close when they end, so mtime marks the clip's last second
+    end = os.path.getmtime(clip)
+    peak_wall = end - SEGMENT_SECONDS + (peak_time or 0.0)
+    hype_start = processor.hype_start_time.timestamp() if processor.hype_start_time else peak_wall
+    start = min(hype_start, peak_wall) - pre_roll
+    out = highlight_path(output_dir, clip_id, start)
+    loggers['main'].info(f"🎯 Viral clip {clip_id} @ {peak_time:.1f}s: {desc} → assembling {end - start:.1f}s")
+
+    def on_done(job):
+        # t0 comes back snapped to the keyframe the cut really starts on
+        sources = [path for path, _ in index.covering(job.t0, job.t1)] if index is not None else None
+        _on_highlight_ready(job.output, job.ok, job.t0, job.t1, captioner, sources, transcripts)
+    assembler.submit_range(start, end, out, on_done=on_done, index=index)
+
+
+def run(clips_dir: str, warmup: bool = True, executor_mode: str = 'thread', workers: int = 2,
+        segment_list: str = None, preroll_source: str = None, preroll_minutes: float = 5.0,
+        channels: list = None, budget: float = None, max_backlog: int = None, triage: bool = True,
+        lookback: int = 1, exact_cuts: bool = False, highlight_workers: int = 2, captions: bool = False):
     logger = loggers['main']
     processor = ClipProcessor()
-    processed = {}
-    prev_clip = None
+
+    # load every model once up front instead of per clip / per thread
+    # (pool processes load their own copy in their initializer)
+    if executor_mode == 'thread':
+        get_registry().load(warmup=warmup)
+    cache = get_cache()
+    if cache is not None:
+        cache.prune_versions(analyzer_versions())
+    executor = ClipExecutor(executor_mode, workers=workers, warmup=warmup)
+    # captions reuse the pipeline's transcript instead of running Whisper again
+    transcripts = TranscriptLog() if captions else None
+    captioner = Captioner(log=transcripts) if captions else None
+
+    def on_event(evt):
+        print_event(evt)
+        if transcripts is not None:
+            transcripts.add_event(evt)
+
+    executor.start(processor, on_event=on_event)
+    # bounded, deadline-driven admission; degrades analysis instead of drifting behind live
+    scheduler = ClipScheduler(executor, segment_seconds=SEGMENT_SECONDS, budget=budget,
+                              max_backlog=max_backlog, in_hype=lambda: processor.in_hype_moment,
+                              transcriber=IncrementalTranscriber())
+    # cheap loudness / motion / chat tier; the models only see segments it flags
+    gate = SegmentTriage(lookback=lookback, in_hype=lambda: processor.in_hype_moment) if triage else None
+    # highlights are cut from the segments off the main loop
+    assembler = HighlightAssembler(workers=highlight_workers, exact=exact_cuts,
+                                   index=SegmentIndex(segment_seconds=SEGMENT_SECONDS))
 
     # Create temp directory for safe copies
     os.makedirs('temp_processing', exist_ok=True)
     
     # start one global chat thread
-    chat_thread = threading.Thread(target=chat_worker, args=(None, processor), daemon=True)
+    chat_thread = threading.Thread(target=chat_worker, args=(None, processor, channels),
+                                   kwargs={'clips_dir': clips_dir}, daemon=True)
     chat_thread.start()
 
     os.makedirs('output', exist_ok=True)
+    preroll = None
+    if preroll_source:
+        preroll = PacketRingBuffer('temp_processing/preroll.ts', minutes=preroll_minutes)
+        preroll.start_capture(preroll_source)
+    watcher = ClipWatcher(clips_dir, segment_list=segment_list).start()
     logger.info(f"Monitoring directory: {clips_dir}")
 
     while True:
         try:
-            # Get all clips and sort by creation time (newest first)
-            snippets = glob.glob(os.path.join(clips_dir, '*.mp4'))
-            snippets.sort(key=os.path.getctime, reverse=True)
-
-            # Process any new clips we haven't seen before
-            new = [s for s in snippets if s not in processed]
-            for clip in new:
+            # block until ffmpeg closes the next segment (or briefly, to drain results)
+            clip = watcher.get(timeout=0.2 if scheduler.queue else 1.0)
+            if clip:
                 clip_id = os.path.basename(clip)
                 logger.info(f"Found new clip: {clip_id}")
-                
-                # Wait for file to be stable before processing
-                if not wait_for_file_stability(clip, max_wait=20.0):
-                    logger.warning(f"Skipping unstable file: {clip_id}")
-                    processed[clip] = time.time()  # Mark as processed
+                if is_video_file_complete_and_valid(clip):
+                    assembler.add_segment(clip)
+                    admitted = gate.push(clip, clip_id) if gate else [(clip, clip_id, True, None)]
+                    for path, cid, analyze, live_end in admitted:
+                        plan = scheduler.submit(path, cid, analyze=analyze, live_end=live_end)
+                        if plan is not None:
+                            logger.info(f"Processing {cid} ({plan})")
+                else:
+                    logger.warning(f"Skipping invalid/incomplete clip: {clip_id}")
+                    CLIPS.inc(outcome='invalid')
+
+            # finish clips strictly in segment order
+            for clip, clip_id, plan, completed in scheduler.finished():
+                if plan is None:  # not flagged by triage, or shed under load
                     continue
-                
-                # Extra safety sleep after validation
-                logger.info(f"File stable, waiting 3 more seconds before processing: {clip_id}")
-                time.sleep(3.0)
-                
-                is_viral, desc, peak_time = process_single_clip(clip, processor, clip_id)
-
-                if is_viral and prev_clip:
-                    # Ensure previous clip is also stable before concatenation
-                    logger.info(f"Viral clip detected! Checking previous clip stability...")
-                    if wait_for_file_stability(prev_clip, max_wait=5.0):
-                        # Double-check both files are ready for concatenation
-                        time.sleep(2.0)  # Extra safety buffer
-                        out = os.path.join('output', f"hype_{int(time.time())}.mp4")
-                        logger.info(f"Concatenating {os.path.basename(prev_clip)} + {clip_id}")
-                        if concatenate_two_clips(prev_clip, clip, out):
-                            logger.info(f"🎬 Created 12s hype clip: {out}")
-                            logger.info(f"🎯 Viral clip {clip_id} @ {peak_time:.1f}s: {desc}")
-                            # Process the concatenated clip
-                            try:
-                                # Wait for output file to be stable too
-                                if wait_for_file_stability(out, max_wait=5.0):
-                                    process_video(out)
-                                else:
-                                    logger.error(f"Output file not stable: {out}")
-                            except Exception as e:
-                                logger.error(f"Error processing concatenated clip: {e}")
-                        else:
-                            logger.error("Failed to concatenate hype clip")
-                    else:
-                        logger.warning(f"Previous clip {prev_clip} not stable for concatenation")
-
-                processed[clip] = os.path.getmtime(clip)
-                prev_clip = clip
-
+                if transcripts is not None and 'transcript' in completed:
+                    # segment files close when they end, so mtime marks the clip's last second;
+                    # a transcript cut short leaves the range to the captioner's own pass
+                    transcripts.cover(os.path.getmtime(clip) - SEGMENT_SECONDS, os.path.getmtime(clip))
+                is_viral, desc, peak_time = finalize_clip(clip, processor, clip_id, flagged=gate is not None)
+                if is_viral and preroll:
+                    peak_wall = os.path.getmtime(clip) - SEGMENT_SECONDS + (peak_time or 0.0)
+                    extract_highlight(preroll, processor, peak_wall, clip_id, desc, captioner=captioner)
+                elif is_viral:
+                    handle_viral_clip(assembler, processor, clip, clip_id, desc, peak_time, captioner=captioner)
+
+        except KeyboardInterrupt:
+            print("\n[Main] Shutting down...")
+            watcher.stop()
+            if preroll:
+                preroll.close()
+            executor.shutdown()
+            assembler.shutdown(wait=False)
+            if captioner is not None:
+                captioner.shutdown(wait=False)
+            if cache is not None:
+                cache.report()
+            break
         except Exception as e:
             logger.error(f"Error in main loop: {e}")
-            
-        time.sleep(1)
+
+
+def run_stream(url: str, warmup: bool = True, hop: float = 6.0, realtime: bool = False,
+               preroll_minutes: float = 5.0, channels: list = None, captions: bool = False):
+    """
+    Analyze a live source continuously from memory instead of 6-second files.
+    Highlights are only cut (from the pre-roll buffer) once a window is confirmed viral.
+    """
+    logger = loggers['main']
+    processor = ClipProcessor()
+    get_registry().load(warmup=warmup)
+
+    chat_thread = threading.Thread(target=chat_worker, args=(None, processor, channels), daemon=True)
+    chat_thread.start()
+
+    os.makedirs('output', exist_ok=True)
+    # encoded copy of the same source, so highlights are remuxed rather than re-encoded;
+    # the ingest's ffmpeg fills it alongside the decoded frames
+    os.makedirs('temp_processing', exist_ok=True)
+    preroll = PacketRingBuffer('temp_processing/preroll.ts', minutes=preroll_minutes)
+    ingest = StreamIngest(url, realtime=realtime, preroll=preroll).start()
+    transcripts = TranscriptLog() if captions else None
+    captioner = Captioner(log=transcripts) if captions else None
+    transcriber = IncrementalTranscriber()
+    t0 = 0.0
+
+    try:
+        while True:
+            t1 = t0 + hop
+            # wait for the window to be fully buffered
+            while ingest.live_time < t1 and not ingest.finished.is_set():
+                time.sleep(0.05)
+            if ingest.live_time < t0 + 1.0 / ingest.fps:
+                break
+
+            clip_id = f"live_{t0:08.1f}"
+            events = queue.Queue()
+            analyze_stream_window(ingest, t0, t1, events, transcriber)
+            while not events.empty():
+                evt = events.get()
+                processor.add_event(clip_id, evt)
+                print_event(evt)
+                if transcripts is not None:
+                    transcripts.add_event(evt, clock=ingest.wall_time)
+            if transcripts is not None:
+                transcripts.cover(ingest.wall_time(t0), ingest.wall_time(t1))
+
+            is_viral, desc, peak_time = finalize_clip(None, processor, clip_id)
+            CLIP_LAG.set(ingest.lag())
+            logger.info(f"Window {t0:.1f}-{t1:.1f}s analysed, {ingest.lag():.1f}s behind live")
+            if is_viral:
+                extract_highlight(preroll, processor, ingest.wall_time(peak_time or t0), clip_id, desc,
+                                  captioner=captioner)
+            t0 = t1
+    except KeyboardInterrupt:
+        print("\n[Main] Shutting down...")
+    finally:
+        ingest.stop()
+        preroll.close()
+        if captioner is not None:
+            captioner.shutdown()
 
 
 if __name__ == "__main__":
@@ -326,5 +454,153 @@ if __name__ == "__main__":
         default="clips",
         help="Directory containing input clips",
     )
+    parser.add_argument(
+        "--no_warmup",
+        action="store_true",
+        help="Skip the dummy inference that warms models at startup",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=EXECUTOR_MODES,
+        default="thread",
+        help="Run clip analyzers on threads or on a process pool (one model set per process)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=2,
+        help="Number of segments analysed concurrently",
+    )
+    parser.add_argument(
+        "--segment_list",
+        default=None,
+        help="ffmpeg -segment_list CSV; segments are picked up as soon as they are listed",
+    )
+    parser.add_argument(
+        "--stream",
+        default=None,
+        help="Analyze this ffmpeg-readable URL (e.g. rtmp://localhost:1935/live/<key>) directly",
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="With --stream, pace a local file at native speed (ffmpeg -re) to simulate live",
+    )
+    parser.add_argument(
+        "--preroll_source",
+        default=None,
+        help="Stream URL to keep in the rolling pre-roll buffer; highlights are cut from it",
+    )
+    parser.add_argument(
+        "--preroll_minutes",
+        type=float,
+        default=5.0,
+        help="Minutes of encoded stream the pre-roll buffer holds",
+    )
+    parser.add_argument(
+        "--cache_path",
+        default="cache/analysis.sqlite",
+        help="SQLite file for cached analyzer results (keyed by clip content)",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Always re-run every analyzer",
+    )
+    parser.add_argument(
+        "--channels",
+        default=None,
+        help="Comma-separated chat channels to watch (default: $TWITCH_CHANNELS)",
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=None,
+        help="Seconds after a segment ends live by which its analysis must finish (default: 2 segments)",
+    )
+    parser.add_argument(
+        "--max_backlog",
+        type=int,
+        default=None,
+        help="Most segments queued or in analysis before the oldest waiting one is dropped",
+    )
+    parser.add_argument(
+        "--no_triage",
+        action="store_true",
+        help="Run every analyzer on every segment instead of only on segments the cheap tier flags",
+    )
+    parser.add_argument(
+        "--lookback",
+        type=int,
+        default=1,
+        help="Segments before a flagged one that are analysed with it",
+    )
+    parser.add_argument(
+        "--face_mode",
+        choices=FACE_MODES,
+        default=os.getenv("FACE_MODE", "detect"),
+        help="Find faces by detecting on every emotion sample (default), tracking between detections, "
+             "or cropping a fixed facecam ROI (--face_roi)",
+    )
+    parser.add_argument(
+        "--face_roi",
+        default=os.getenv("FACE_ROI"),
+        help="Facecam box x,y,w,h in frame pixels, for --face_mode fixed",
+    )
+    parser.add_argument(
+        "--frame_backend",
+        choices=FRAME_BACKENDS,
+        default=os.getenv("FRAME_BACKEND", "ffmpeg"),
+        help="Decode analyzer frames through scaled ffmpeg pipes, or with OpenCV and resize afterwards",
+    )
+    parser.add_argument(
+        "--exact_cuts",
+        action="store_true",
+        help="Start highlights exactly on the peak window (re-encodes the first partial GOP) "
+             "instead of on the keyframe before it",
+    )
+    parser.add_argument(
+        "--captions",
+        action="store_true",
+        help="Burn captions into finished highlights (from the pipeline transcript, "
+             "or a CPU int8 Whisper when a highlight was not transcribed)",
+    )
+    parser.add_argument(
+        "--highlight_workers",
+        type=int,
+        default=2,
+        help="Highlights assembled in parallel",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=int(os.getenv("METRICS_PORT", "9108")),
+        help="Serve Prometheus metrics on http://127.0.0.1:<port>/metrics (0 disables)",
+    )
+    parser.add_argument(
+        "--trace",
+        default=None,
+        help="Append per-clip stage spans as JSON lines to this file",
+    )
     args = parser.parse_args()
-    run(args.clips_dir)
\ No newline at end of file
+    channels = args.channels.split(',') if args.channels else None
+    # through the environment so spawned pool processes see the same setting
+    os.environ["ANALYSIS_CACHE"] = "off" if args.no_cache else args.cache_path
+    if args.trace:
+        os.environ["METRICS_TRACE"] = args.trace
+    if args.face_mode == "fixed" and not args.face_roi:
+        parser.error("--face_mode fixed needs --face_roi x,y,w,h")
+    os.environ["FACE_MODE"] = args.face_mode
+    if args.face_roi:
+        os.environ["FACE_ROI"] = args.face_roi
+    os.environ["FRAME_BACKEND"] = args.frame_backend
+    serve_metrics(args.metrics_port)
+    if args.stream:
+        run_stream(args.stream, warmup=not args.no_warmup, realtime=args.realtime,
+                   preroll_minutes=args.preroll_minutes, channels=channels, captions=args.captions)
+        raise SystemExit(0)
+    run(args.clips_dir, warmup=not args.no_warmup, executor_mode=args.executor, workers=args.workers,
+        segment_list=args.segment_list, preroll_source=args.preroll_source,
+        preroll_minutes=args.preroll_minutes, channels=channels, budget=args.budget,
+        max_backlog=args.max_backlog, triage=not args.no_triage, lookback=args.lookback,
+        exact_cuts=args.exact_cuts, highlight_workers=args.highlight_workers, captions=args.captions)
\ No newline at end of file
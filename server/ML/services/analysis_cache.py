@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from services.metrics import CACHE_LOOKUPS
+
+ANALYSIS_CACHE = os.getenv("ANALYSIS_CACHE", "cache/analysis.sqlite")  # "off" disables caching
+
+# event fields holding seconds into the clip; shifted when a clip is rebuilt from parts
+_TIME_FIELDS = ('video_time', 'video_timestamp', 'frame')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    hash TEXT PRIMARY KEY,
+    duration REAL,
+    wall_start REAL,
+    created REAL
+);
+CREATE INDEX IF NOT EXISTS clips_wall ON clips (wall_start);
+CREATE TABLE IF NOT EXISTS parts (
+    hash TEXT,
+    idx INTEGER,
+    part TEXT,
+    offset REAL,
+    PRIMARY KEY (hash, idx)
+);
+CREATE TABLE IF NOT EXISTS results (
+    hash TEXT,
+    analyzer TEXT,
+    version TEXT,
+    payload BLOB,
+    bytes INTEGER,
+    created REAL,
+    last_used REAL,
+    PRIMARY KEY (hash, analyzer, version)
+);
+CREATE INDEX IF NOT EXISTS results_lru ON results (last_used);
+"""
+
+
+def _probe_duration(path: str) -> float:
+    import cv2
+    cap = cv2.VideoCapture(path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0.0
+        return frames / fps if fps else None
+    finally:
+        cap.release()
+
+
+def shift_events(events: list, offset: float, duration: float = None) -> list:
+    """Move clip-relative event times by `offset`, dropping what falls outside [0, duration]"""
+    out = []
+    for evt in events:
+        evt = dict(evt)
+        t = evt.get('video_time')
+        if t is None and 'video_timestamp' in evt:
+            t = float(evt['video_timestamp'])
+        if t is not None:
+            t += offset
+            if t < 0 or (duration is not None and t > duration):
+                continue
+        for field in _TIME_FIELDS:
+            if field not in evt:
+                continue
+            if field == 'video_time':
+                evt[field] = t
+            elif field == 'video_timestamp':
+                evt[field] = str(int(t))
+            else:
+                evt[field] = int(t)
+        out.append(evt)
+    return out
+
+
+class AnalysisCache:
+    """
+    On-disk cache of analyzer output, keyed by clip content hash and analyzer
+    version.
+
+    Results are the analyzer's events (clip-relative times, no datetimes),
+    stored zlib-compressed in SQLite (WAL, so pool processes can share it).
+    A clip built from others - a concatenated hype clip, or a pre-roll cut
+    over already-analysed segments - is recorded as parts with offsets, and a
+    lookup for it is answered by shifting and joining the parts' results.
+    The file is kept under `max_bytes` by evicting least recently used results.
+    """
+
+    def __init__(self, path: str = ANALYSIS_CACHE, max_bytes: int = 256 * 1024 * 1024):
+        self.logger = logging.getLogger('main')
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._hashes = OrderedDict()  # (path, size, mtime_ns) -> hash
+        self.hits = 0
+        self.composite_hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    # ── keys ──────────────────────────────────────────────────────────────────
+    def clip_key(self, path: str, wall_start: float = None) -> str:
+        """Content hash of a clip file (memoised by path, size and mtime)"""
+        st = os.stat(path)
+        memo = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._hashes.get(memo)
+        if digest is not None:
+            return digest
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._hashes[memo] = digest
+            while len(self._hashes) > 1024:
+                self._hashes.popitem(last=False)
+            known = self.db.execute("SELECT 1 FROM clips WHERE hash = ?", (digest,)).fetchone()
+        if not known:
+            duration = _probe_duration(path)
+            if wall_start is None and duration:
+                wall_start = st.st_mtime - duration  # segments are closed when they end
+            with self._lock:
+                self.db.execute("INSERT OR IGNORE INTO clips VALUES (?, ?, ?, ?)",
+                                (digest, duration, wall_start, time.time()))
+        return digest
+
+    def _duration(self, digest: str) -> float:
+        with self._lock:
+            row = self.db.execute("SELECT duration FROM clips WHERE hash = ?", (digest,)).fetchone()
+        return row[0] if row else None
+
+    # ── composites ────────────────────────────────────────────────────────────
+    def register_parts(self, digest: str, parts: list):
+        """Record that clip `digest` is made of [(part_hash, offset_seconds), ...]"""
+        with self._lock:
+            self.db.execute("DELETE FROM parts WHERE hash = ?", (digest,))
+            self.db.executemany("INSERT INTO parts VALUES (?, ?, ?, ?)",
+                                [(digest, i, part, offset) for i, (part, offset) in enumerate(parts)])
+
+    def register_concat(self, output_path: str, inputs: list) -> str:
+        """Register an ffmpeg concat of `inputs` (in order) as a composite clip"""
+        parts, offset = [], 0.0
+        for path in inputs:
+            part = self.clip_key(path)
+            parts.append((part, offset))
+            offset += self._duration(part) or 0.0
+        digest = self.clip_key(output_path)
+        self.register_parts(digest, parts)
+        return digest
+
+    def register_range(self, output_path: str, t0: float, t1: float, tolerance: float = 0.5,
+                       sources: list = None) -> str:
+        """
+        Register a cut of wall-clock [t0, t1] as the analysed segments covering
+        it; with several streams on one clock, `sources` (the segment files the
+        cut was taken from) keeps other streams' segments out.
+        """
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT hash, wall_start, duration FROM clips WHERE wall_start IS NOT NULL "
+                "AND duration IS NOT NULL AND wall_start < ? AND wall_start + duration > ? "
+                "ORDER BY wall_start", (t1, t0)).fetchall()
+        if sources is not None:
+            allowed = {self.clip_key(path) for path in sources if os.path.exists(path)}
+            rows = [row for row in rows if row[0] in allowed]
+        covered, parts = t0, []
+        for part, start, duration in rows:
+            if start > covered + tolerance:
+                break  # hole in the coverage
+            parts.append((part, start - t0))
+            covered = max(covered, start + duration)
+        digest = self.clip_key(output_path, wall_start=t0)
+        if parts and covered >= t1 - tolerance:
+            self.register_parts(digest, parts)
+        return digest
+
+    # ── results ───────────────────────────────────────────────────────────────
+    def _get_direct(self, digest: str, analyzer: str, version: str):
+        with self._lock:
+            row = self.db.execute(
+                "SELECT payload FROM results WHERE hash = ? AND analyzer = ? AND version = ?",
+                (digest, analyzer, version)).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                "UPDATE results SET last_used = ? WHERE hash = ? AND analyzer = ? AND version = ?",
+                (time.time(), digest, analyzer, version))
+        return json.loads(zlib.decompress(row[0]))
+
+    def get(self, digest: str, analyzer: str, version: str):
+        """Cached events for the clip, or None; composites are assembled from their parts"""
+        events = self._get_direct(digest, analyzer, version)
+        if events is not None:
+            self.hits += 1
+            CACHE_LOOKUPS.inc(cache='analysis', result='hit')
+            return events
+        with self._lock:
+            parts = self.db.execute("SELECT part, offset FROM parts WHERE hash = ? ORDER BY idx",
+                                    (digest,)).fetchall()
+        if parts:
+            duration = self._duration(digest)
+            joined = []
+            for part, offset in parts:
+                sub = self._get_direct(part, analyzer, version)
+                if sub is None:
+                    joined = None
+                    break
+                joined += shift_events(sub, offset, duration)
+            if joined is not None:
+                self.composite_hits += 1
+                CACHE_LOOKUPS.inc(cache='analysis', result='composite')
+                self.put(digest, analyzer, version, joined)
+                return joined
+        self.misses += 1
+        CACHE_LOOKUPS.inc(cache='analysis', result='miss')
+        return None
+
+    def put(self, digest: str, analyzer: str, version: str, events: list):
+        clean = [{k: v for k, v in evt.items() if k not in ('timestamp', 'clip_id')} for evt in events]
+        payload = zlib.compress(json.dumps(clean, ensure_ascii=False).encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (digest, analyzer, version, payload, len(payload), now, now))
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            total = self.db.execute("SELECT COALESCE(SUM(bytes), 0) FROM results").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            target = total - int(self.max_bytes * 0.9)
+            freed = 0
+            victims = []
+            for digest, analyzer, version, size in self.db.execute(
+                    "SELECT hash, analyzer, version, bytes FROM results ORDER BY last_used"):
+                victims.append((digest, analyzer, version))
+                freed += size
+                if freed >= target:
+                    break
+            self.db.executemany("DELETE FROM results WHERE hash = ? AND analyzer = ? AND version = ?", victims)
+            self.evicted += len(victims)
+        self.logger.info(f"Analysis cache: evicted {len(victims)} results ({freed / 1024:.0f} KB)")
+
+    def invalidate(self, analyzer: str = None, digest: str = None, keep_version: str = None) -> int:
+        """Drop results for an analyzer and/or clip; with keep_version, only other versions"""
+        clauses, args = [], []
+        if analyzer is not None:
+            clauses.append("analyzer = ?")
+            args.append(analyzer)
+        if digest is not None:
+            clauses.append("hash = ?")
+            args.append(digest)
+        if keep_version is not None:
+            clauses.append("version != ?")
+            args.append(keep_version)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        with self._lock:
+            return self.db.execute("DELETE FROM results" + where, args).rowcount
+
+    def prune_versions(self, versions: dict) -> int:
+        """Remove results written by any analyzer version other than the current ones"""
+        removed = sum(self.invalidate(analyzer, keep_version=v) for analyzer, v in versions.items())
+        if removed:
+            self.logger.info(f"Analysis cache: dropped {removed} results from old analyzer versions")
+        return removed
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.composite_hits + self.misses
+        with self._lock:
+            rows, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM results").fetchone()
+        return {
+            "hits": self.hits,
+            "composite_hits": self.composite_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.composite_hits) / lookups, 3) if lookups else 0.0,
+            "results": rows,
+            "kb": round(size / 1024, 1),
+            "evicted": self.evicted,
+        }
+
+    def report(self) -> dict:
+        stats = self.stats()
+        self.logger.info(f"Analysis cache {self.path}: {stats}")
+        return stats
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache from $ANALYSIS_CACHE, or None when caching is off"""
+    global _cache
+    path = os.getenv("ANALYSIS_CACHE", ANALYSIS_CACHE)
+    if not path or path.lower() == 'off':
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnalysisCache(path)
+    return _cache
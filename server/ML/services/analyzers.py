@@ -0,0 +1,180 @@
+import queue
+import logging
+import threading
+from datetime import datetime
+
+from services.intern import INTERN_FRAMES, INTERN_SAMPLING, process_video
+from services.transcript import transcribe_video, transcribe_audio
+from services.emotion_engine import EmotionEngine, face_settings
+from services.frame_bus import SamplingPolicy
+from services.frame_source import FULL_FRAME, FrameSpec
+from services.models import get_registry
+from services.scene_client import SCENE_MODEL
+
+EMOTION_SAMPLING = SamplingPolicy.every(10)
+EMOTION_FRAMES = FrameSpec(max_edge=960)  # faces stay well above the detector's minimum size
+
+
+def emotion_frames() -> FrameSpec:
+    """Frames the emotion analyzer decodes; a fixed ROI is in source pixels, so it gets them unscaled"""
+    face_mode, _ = face_settings()
+    return FULL_FRAME if face_mode == 'fixed' else EMOTION_FRAMES
+
+
+def analyzer_versions() -> dict:
+    """Cache keys of each analyzer's output; bump the suffix when an analyzer changes"""
+    registry = get_registry()
+    face_mode, roi = face_settings()
+    if roi:
+        face_mode += f"@{roi['x']},{roi['y']},{roi['w']},{roi['h']}"
+    return {
+        'emotion': f"{registry.detector_backend}/{face_mode}/{EMOTION_SAMPLING!r}/{emotion_frames()!r}/v3",
+        'scene': f"{SCENE_MODEL}/{INTERN_SAMPLING!r}/{INTERN_FRAMES!r}/keyframes/v1",
+        'transcript': f"whisper-{registry.whisper_size}/v2",
+    }
+
+
+class _Recorder:
+    """Event queue stand-in that keeps a copy of everything passing through"""
+
+    def __init__(self, event_q):
+        self.event_q = event_q
+        self.events = []
+
+    def put(self, evt: dict):
+        self.events.append(dict(evt))
+        if self.event_q is not None:
+            self.event_q.put(evt)
+
+
+def replay_events(events: list, event_q):
+    for evt in events:
+        event_q.put(dict(evt, timestamp=datetime.now()))
+
+
+def run_cached(cache, digest: str, analyzer: str, event_q, work, frames=None) -> bool:
+    """
+    Run `work(event_q)` and store the events it produced under the clip's
+    hash. Output is only cached when the worker reports success and its frame
+    subscription was not cut short by the clip timeout.
+    """
+    if cache is None or digest is None:
+        return work(event_q)
+    recorder = _Recorder(event_q)
+    ok = work(recorder)
+    if ok and not (frames is not None and frames.closed):
+        cache.put(digest, analyzer, analyzer_versions()[analyzer], recorder.events)
+    return ok
+
+
+def emotion_worker(frames, event_q: queue.Queue, batch_size=16):
+    """Consume the emotion subscription of a clip's FrameBus in batches"""
+    logger = logging.getLogger('emotion')
+    engine = EmotionEngine(batch_size=batch_size)
+    fps = frames.fps
+    logger.info(f"Emotion worker started - FPS: {fps:.1f}")
+
+    processed = 0
+    try:
+        for idx, res in engine.iter_batches(frames):
+            dom = res['dominant_emotion']
+            # every sample, neutral ones too: the timeline needs the full probability curve
+            event_q.put({
+                'type': 'emotion',
+                'timestamp': datetime.now(),
+                'video_time': idx / fps,
+                'emotion': dom,
+                'scores': [round(p / 100.0, 4) for p in res['probabilities'].tolist()],
+            })
+            if dom.lower() != 'neutral':
+                logger.debug(f"Detected {dom} at {idx/fps:.1f}s")
+            processed += 1
+
+        logger.info(f"Emotion worker finished - analyzed {processed} frames")
+        return True
+
+    except Exception as e:
+        logger.error(f"Emotion worker failed: {e}")
+        return False
+
+
+def intern_worker(video_path, event_q: queue.Queue, frames=None):
+    logger = logging.getLogger('intern')
+    try:
+        logger.info(f"Intern worker started processing {video_path}")
+        process_video(video_path, event_q, frames=frames)
+        logger.info("Intern worker finished successfully")
+        return True
+    except Exception as e:
+        logger.error(f"Intern error: {e}")
+        return False
+
+
+def transcript_worker(video_path, event_q: queue.Queue, cancel=None, transcriber=None, start: float = None):
+    logger = logging.getLogger('transcript')
+    try:
+        logger.info(f"Transcript worker started processing {video_path}")
+        transcribe_video(video_path, event_q, transcriber, start=start, cancel=cancel)
+        if cancel is not None and cancel.is_set():
+            logger.info("Transcript worker cancelled")
+            return False
+        logger.info("Transcript worker finished successfully")
+        return True
+    except Exception as e:
+        logger.error(f"Transcript error: {e}")
+        return False
+
+
+def describe_clip(video_path: str, event_q=None, cache=None):
+    """
+    Scene descriptions for a whole clip (e.g. a finished hype clip), reusing
+    cached results - including those of the segments it was cut from.
+    """
+    logger = logging.getLogger('intern')
+    version = analyzer_versions()['scene']
+    digest = cache.clip_key(video_path) if cache else None
+    events = cache.get(digest, 'scene', version) if digest else None
+    if events is not None:
+        logger.info(f"Scene descriptions for {video_path} served from cache ({len(events)} frames)")
+        if event_q is not None:
+            replay_events(events, event_q)
+    else:
+        recorder = _Recorder(event_q)
+        process_video(video_path, recorder)
+        events = recorder.events
+        if digest:
+            cache.put(digest, 'scene', version, events)
+    if event_q is None:
+        for evt in events:
+            logger.info(f"Frame {evt['frame']}: {evt['description']}")
+    return [evt['description'] for evt in events]
+
+
+def audio_transcript_worker(audio, offset: float, event_q: queue.Queue, transcriber=None):
+    """Transcribe an in-memory 16 kHz window; timestamps are stream time"""
+    logger = logging.getLogger('transcript')
+    if len(audio) == 0:
+        return
+    try:
+        transcribe_audio(audio, offset, event_q, transcriber, clip_start=0.0)
+    except Exception as e:
+        logger.error(f"Transcript error: {e}")
+
+
+def analyze_stream_window(ingest, t0: float, t1: float, event_q: queue.Queue, transcriber=None):
+    """
+    Run every analyzer on the [t0, t1) window of a StreamIngest's ring
+    buffers; windows go in order, so the stream's `transcriber` keeps context.
+    """
+    emotion_step = max(1, int(round(ingest.fps / 3)))  # ~3 emotion samples per second
+    scene_step = INTERN_SAMPLING.step(ingest.fps)      # keyframe candidates
+    workers = [
+        threading.Thread(target=emotion_worker, args=(ingest.window(t0, t1, emotion_step), event_q)),
+        threading.Thread(target=intern_worker, args=(ingest.url, event_q, ingest.window(t0, t1, scene_step))),
+        threading.Thread(target=audio_transcript_worker,
+                         args=(ingest.audio.window(t0, t1), t0, event_q, transcriber)),
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
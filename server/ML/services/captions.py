@@ -0,0 +1,216 @@
+import os
+import bisect
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from services.metrics import get_metrics, timed
+
+CAPTION_WHISPER = os.getenv("CAPTION_WHISPER", "small")
+
+
+def srt_timestamp(seconds: float) -> str:
+    ms = int(round(max(0.0, seconds) * 1000))
+    h, ms = divmod(ms, 3600000)
+    m, ms = divmod(ms, 60000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def write_srt(segments: list, path: str):
+    """segments: [{'start', 'end', 'text'}] in seconds from the start of the clip"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, seg in enumerate(segments, 1):
+            f.write(f"{i}\n{srt_timestamp(seg['start'])} --> {srt_timestamp(seg['end'])}\n{seg['text'].strip()}\n\n")
+
+
+class TranscriptLog:
+    """
+    Wall-clock transcript segments the pipeline already produced, so a
+    highlight cut from those segments can be captioned without running
+    Whisper again. `cover` records which stretches were actually transcribed:
+    silence leaves no segments, and a range is only served from the log when
+    it is covered end to end.
+    """
+
+    def __init__(self, keep_seconds: float = 900.0, default_length: float = 3.0):
+        self.keep_seconds = keep_seconds
+        self.default_length = default_length
+        self._segments = []  # (start, end, text), sorted by start
+        self._covered = []   # (start, end), sorted by start
+        self._lock = threading.Lock()
+
+    def add(self, start: float, end: float, text: str):
+        with self._lock:
+            bisect.insort(self._segments, (start, end, text))
+            self._trim(end)
+
+    def add_event(self, evt: dict, clock=None):
+        """Take a `transcript` event; `clock` maps its stream time to wall clock"""
+        if evt.get('type') != 'transcript' or evt.get('stream_time') is None:
+            return
+        start = evt['stream_time']
+        end = evt.get('stream_end') or start + self.default_length  # cached events predate stream_end
+        if clock is not None:
+            start, end = clock(start), clock(end)
+        self.add(start, end, evt['text'])
+
+    def cover(self, start: float, end: float):
+        with self._lock:
+            bisect.insort(self._covered, (start, end))
+            self._trim(end)
+
+    def _trim(self, now: float):
+        horizon = now - self.keep_seconds
+        while self._segments and self._segments[0][1] < horizon:
+            self._segments.pop(0)
+        while self._covered and self._covered[0][1] < horizon:
+            self._covered.pop(0)
+
+    def covered(self, t0: float, t1: float, tolerance: float = 0.5) -> bool:
+        with self._lock:
+            reached = t0
+            for start, end in self._covered:
+                if start > reached + tolerance:
+                    break
+                reached = max(reached, end)
+        return reached >= t1 - tolerance
+
+    def between(self, t0: float, t1: float) -> list:
+        """Segments overlapping [t0, t1], clipped to it and relative to t0"""
+        with self._lock:
+            rows = [s for s in self._segments if s[1] > t0 and s[0] < t1]
+        return [{'start': max(0.0, start - t0), 'end': min(t1, end) - t0, 'text': text}
+                for start, end, text in rows]
+
+
+def _init_transcriber(whisper_size: str):
+    from services.models import get_registry
+    get_registry(whisper_size=whisper_size, int8=True).load(emotion=False, openai=False)
+
+
+def transcribe_clip(path: str) -> list:
+    """Whisper segments of a whole clip (runs in a caption pool process)"""
+    from services.models import get_registry
+    from services.transcript import extract_audio
+    with timed('caption_transcribe'):
+        result = get_registry().transcribe(extract_audio(path), condition_on_previous_text=False)
+    return [{'start': s['start'], 'end': s['end'], 'text': s['text']} for s in result.get('segments', [])]
+
+
+def _filter_path(path: str) -> str:
+    # the subtitles filter takes a filtergraph argument: escape its special characters
+    return path.replace('\\', '/').replace(':', '\\:').replace("'", "\\'")
+
+
+def burn_captions(video_path: str, srt_path: str, output_path: str,
+                  encoder: tuple = ('-c:v', 'libx264', '-preset', 'veryfast', '-crf', '20')):
+    """Re-encode `video_path` with the SRT burned in; audio is copied, output is fast-start"""
+    cmd = ['ffmpeg', '-y', '-nostdin', '-loglevel', 'error', '-i', video_path,
+           '-vf', f"subtitles='{_filter_path(srt_path)}'", *encoder,
+           '-c:a', 'copy', '-movflags', '+faststart', output_path]
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {proc.returncode}: {proc.stderr.strip()[-500:]}")
+
+
+class Captioner:
+    """
+    Burns captions into finished highlight clips, several at a time.
+
+    Captions come from the pipeline's own transcript when `log` covers the
+    clip's wall-clock range; otherwise the clip is transcribed by a CPU
+    Whisper (int8, `whisper_size`) in a pool of `transcribe_workers`
+    processes so the main loop's GIL and model stay untouched. Burning runs on
+    `workers` threads, each driving one ffmpeg. By default the captioned clip
+    replaces the original in place.
+    """
+
+    def __init__(self, workers: int = 2, transcribe_workers: int = 1, log: TranscriptLog = None,
+                 whisper_size: str = CAPTION_WHISPER):
+        self.logger = logging.getLogger('main')
+        self.log = log
+        self.whisper_size = whisper_size
+        self.transcribe_workers = transcribe_workers
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='caption')
+        self._transcriber = None
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.transcribed = 0
+        self.pending = 0
+        get_metrics().gauge('clippy_caption_backlog', 'Highlights waiting for captions', fn=lambda: self.pending)
+
+    def _transcribe(self, path: str) -> list:
+        with self._lock:
+            if self._transcriber is None:
+                # spawn, not fork: torch is not fork-safe once initialised
+                self._transcriber = ProcessPoolExecutor(
+                    max_workers=self.transcribe_workers, mp_context=mp.get_context('spawn'),
+                    initializer=_init_transcriber, initargs=(self.whisper_size,))
+        return self._transcriber.submit(transcribe_clip, path).result()
+
+    def segments(self, path: str, t0: float = None, t1: float = None, log: TranscriptLog = None) -> list:
+        """Caption segments for a clip spanning wall-clock [t0, t1], reusing the log when it can"""
+        log = log or self.log
+        if log is not None and t0 is not None and log.covered(t0, t1):
+            self.reused += 1
+            return log.between(t0, t1)
+        self.transcribed += 1
+        return self._transcribe(path)
+
+    def caption(self, path: str, t0: float = None, t1: float = None, output_path: str = None,
+                log: TranscriptLog = None) -> str:
+        """Blocking: caption one clip; returns output_path (path by default), uncaptioned if no one speaks"""
+        segments = self.segments(path, t0, t1, log)
+        output_path = output_path or path
+        if not segments:
+            self.logger.info(f"No speech in {path}, leaving it uncaptioned")
+            if os.path.abspath(output_path) != os.path.abspath(path):
+                tmp = output_path + '.captioned.mp4'
+                shutil.copyfile(path, tmp)
+                os.replace(tmp, output_path)
+            return output_path
+        with tempfile.TemporaryDirectory(prefix='captions_') as scratch:
+            srt = os.path.join(scratch, 'captions.srt')
+            write_srt(segments, srt)
+            # render next to the destination so the swap is an atomic rename
+            tmp = output_path + '.captioned.mp4'
+            try:
+                with timed('captions'):
+                    burn_captions(path, srt, tmp)
+                os.replace(tmp, output_path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        return output_path
+
+    def _run(self, path, t0, t1, output_path, on_done, log):
+        ok, out = False, path
+        try:
+            out = self.caption(path, t0, t1, output_path, log)
+            ok = True
+            self.logger.info(f"💬 Captioned {out}")
+        except Exception as e:
+            self.logger.error(f"Captioning {path} failed: {e}")
+        finally:
+            with self._lock:
+                self.pending -= 1
+        if on_done:
+            on_done(out, ok)
+        return out
+
+    def submit(self, path: str, t0: float = None, t1: float = None, output_path: str = None, on_done=None,
+               log: TranscriptLog = None):
+        """Queue a finished clip; returns a Future of the captioned path. `log` overrides the shared one"""
+        with self._lock:
+            self.pending += 1
+        return self.pool.submit(self._run, path, t0, t1, output_path, on_done, log)
+
+    def shutdown(self, wait: bool = True):
+        self.pool.shutdown(wait=wait)
+        if self._transcriber is not None:
+            self._transcriber.shutdown(wait=wait)
@@ -1,59 +1,265 @@
-import cv2
-from collections import defaultdict, Counter
-import os
+import time
 import logging
-import subprocess
-from datetime import datetime, timedelta
-import tempfile
+import threading
+from array import array
+from enum import IntEnum
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from services.highlights import get_assembler
+
+VIRAL_SCORE = 0.2  # continuous virality score a clip needs: dominant share x smoothed peak intensity
+SMOOTH_SIGMA = 0.75  # seconds; width of the Gaussian that smooths the intensity curve
+
+
+class Emotion(IntEnum):
+    """DeepFace emotion labels, in EMOTION_LABELS order"""
+    ANGRY = 0
+    DISGUST = 1
+    FEAR = 2
+    HAPPY = 3
+    SAD = 4
+    SURPRISE = 5
+    NEUTRAL = 6
+
+    @classmethod
+    def parse(cls, label: str):
+        """Emotion for a label in any case, None if unknown"""
+        return _EMOTION_BY_LABEL.get(label.lower())
+
+    @property
+    def label(self) -> str:
+        return self.name.lower()
+
+
+_EMOTION_BY_LABEL = {e.label: e for e in Emotion}
+_EXPRESSIVE = np.array([e for e in Emotion if e != Emotion.NEUTRAL])
+
+
+def smoothed_intensity(times: np.ndarray, probs: np.ndarray, at: np.ndarray = None,
+                       sigma: float = SMOOTH_SIGMA) -> np.ndarray:
+    """
+    Confidence-weighted emotional intensity (non-neutral probability mass
+    times the model's top probability), Gaussian-smoothed over time and
+    evaluated at `at` (default: every sample). Samples need not be evenly
+    spaced, so gaps between clips just widen the kernel's support.
+    """
+    at = times if at is None else at
+    intensity = (1.0 - probs[:, Emotion.NEUTRAL]) * probs.max(axis=1)
+    d = (at[:, None] - times[None, :]) / sigma
+    kernel = np.exp(-0.5 * d * d)
+    return kernel @ intensity / np.maximum(kernel.sum(axis=1), 1e-12)
+
+
+def score_emotions(times: np.ndarray, probs: np.ndarray, t0: float, t1: float,
+                   sigma: float = SMOOTH_SIGMA) -> dict:
+    """
+    Score the samples in [t0, t1] against the whole series around them: the
+    peak of the smoothed intensity curve (and when it happens), the dominant
+    non-neutral emotion by confidence-weighted probability mass, its share of
+    that mass, and score = share x peak. None if no sample falls in the range.
+    """
+    inside = (times >= t0) & (times <= t1)
+    if not inside.any():
+        return None
+    curve = smoothed_intensity(times, probs, times[inside], sigma)
+    peak = int(curve.argmax())
+    clip_probs = probs[inside]
+    mass = (clip_probs[:, _EXPRESSIVE] * clip_probs.max(axis=1)[:, None]).sum(axis=0)
+    total = float(mass.sum())
+    dominant = Emotion(int(_EXPRESSIVE[mass.argmax()])) if total > 0 else None
+    share = float(mass.max()) / total if total > 0 else 0.0
+    return {
+        'score': share * float(curve[peak]),
+        'peak': float(curve[peak]),
+        'peak_time': float(times[inside][peak]),
+        'dominant': dominant,
+        'share': share,
+    }
+
+
+class EmotionTimeline:
+    """
+    Emotion probability vectors of consecutive clips on one clock (wall
+    clock for segments, stream time for a live window), as NumPy arrays.
+    Keeps the last `horizon` seconds so a clip is smoothed and scored with
+    the tail of the clip before it.
+    """
+
+    def __init__(self, horizon: float = 120.0, sigma: float = SMOOTH_SIGMA):
+        self.horizon = horizon
+        self.sigma = sigma
+        self.times = np.zeros(0)
+        self.probs = np.zeros((0, len(Emotion)), dtype=np.float32)
+
+    def extend(self, times: np.ndarray, probs: np.ndarray):
+        times = np.concatenate([self.times, times])
+        probs = np.concatenate([self.probs, probs])
+        order = np.argsort(times, kind='stable')
+        keep = order[times[order] >= times.max() - self.horizon]
+        self.times, self.probs = times[keep], probs[keep]
+
+    def score(self, t0: float, t1: float) -> dict:
+        return score_emotions(self.times, self.probs, t0, t1, self.sigma)
+
+
+class SceneRecord:
+    __slots__ = ('video_time', 'description')
+
+    def __init__(self, video_time: float, description: str):
+        self.video_time = video_time
+        self.description = description
+
+
+class TranscriptRecord:
+    __slots__ = ('video_time', 'text')
+
+    def __init__(self, video_time: float, text: str):
+        self.video_time = video_time
+        self.text = text
+
+
+class ClipEvents:
+    """
+    Everything known about one clip, kept compact: emotions are array columns
+    (code, video time, flattened probability vectors) with running
+    per-emotion counts, first occurrence times and the current non-neutral
+    leader, updated on insert so the viral queries never rescan. Scenes and
+    transcripts are __slots__ records; no per-event dicts or datetimes are kept.
+    """
+
+    __slots__ = ('emotion_codes', 'emotion_times', 'emotion_scores', 'counts', 'first_time', 'total',
+                 'dominant', 'dominant_count', 'scenes', 'transcripts', 'start', 'created', 'finished_at')
 
-class ClipProcessor:
     def __init__(self):
+        self.emotion_codes = array('b')
+        self.emotion_times = array('d')
+        self.emotion_scores = array('f')
+        self.counts = [0] * len(Emotion)
+        self.first_time = [None] * len(Emotion)
+        self.total = 0
+        self.dominant = None  # most frequent non-neutral Emotion
+        self.dominant_count = 0
+        self.scenes = []
+        self.transcripts = []
+        self.start = None  # where the clip's video time 0 sits on the processor's timeline
+        self.created = time.monotonic()
+        self.finished_at = None
+
+    def add_emotion(self, emotion: Emotion, video_time: float, scores: list = None):
+        self.emotion_codes.append(emotion)
+        self.emotion_times.append(video_time)
+        if scores is None or len(scores) != len(Emotion):
+            # label only (older cached events): a fully confident one-hot vector
+            scores = [0.0] * len(Emotion)
+            scores[emotion] = 1.0
+        self.emotion_scores.extend(scores)
+        self.total += 1
+        self.counts[emotion] += 1
+        if self.first_time[emotion] is None:
+            self.first_time[emotion] = video_time
+        if emotion != Emotion.NEUTRAL and self.counts[emotion] > self.dominant_count:
+            self.dominant, self.dominant_count = emotion, self.counts[emotion]
+
+    def emotion_series(self) -> tuple:
+        """(video times, probability matrix) as NumPy arrays"""
+        times = np.frombuffer(self.emotion_times, dtype=np.float64).copy()
+        probs = np.frombuffer(self.emotion_scores, dtype=np.float32).reshape(-1, len(Emotion)).copy()
+        return times, probs
+
+    def middle_scene(self) -> str:
+        return self.scenes[len(self.scenes) // 2].description if self.scenes else None
+
+
+class ClipProcessor:
+    def __init__(self, max_clips: int = 256, finished_ttl: float = 600.0):
         self.logger = logging.getLogger('main')  # Use main logger since ClipProcessor is part of main processing
         self.current_clips = []  # List of (path, description, emotion) tuples for viral clips
-        self.events_by_clip = defaultdict(list)
-        self.emotions_by_clip = defaultdict(list)
-        self.is_clip_viral = defaultdict(bool)
+        # clip id -> ClipEvents, least recently touched first; finished clips are
+        # dropped after `finished_ttl` seconds or when more than `max_clips` are held
+        self.clips = OrderedDict()
+        self.max_clips = max_clips
+        self.finished_ttl = finished_ttl
+        self.evicted = 0
+        self._lock = threading.Lock()
         self.hype_start_time = None  # Track when hype moments start
         self.in_hype_moment = False  # Track if we're currently in a hype moment
         self.hype_descriptions = []  # Store descriptions of what's happening during hype moments
-        
+        self.timeline = EmotionTimeline()  # emotion curves of consecutive clips, for smoothing and peaks
+
+    def _evict(self, now: float):
+        while len(self.clips) > self.max_clips:
+            self.clips.popitem(last=False)
+            self.evicted += 1
+        expired = [cid for cid, c in self.clips.items()
+                   if c.finished_at is not None and now - c.finished_at > self.finished_ttl]
+        for cid in expired:
+            del self.clips[cid]
+        self.evicted += len(expired)
+
+    def _clip(self, clip_id: str, create: bool = True) -> ClipEvents:
+        clip = self.clips.get(clip_id)
+        if clip is None:
+            if not create:
+                return None
+            clip = self.clips[clip_id] = ClipEvents()
+            self._evict(time.monotonic())
+        else:
+            self.clips.move_to_end(clip_id)
+        return clip
+
     def add_event(self, clip_id: str, event: dict):
         """Add an event to a specific clip's timeline"""
-        self.events_by_clip[clip_id].append(event)
-        if event["type"] == "emotion":
-            self.emotions_by_clip[clip_id].append(event["emotion"])
-            self.logger.info(f"Added emotion {event['emotion']} to clip {clip_id}")
-        
+        kind = event["type"]
+        with self._lock:
+            clip = self._clip(clip_id)
+            if kind == "emotion":
+                emotion = Emotion.parse(event["emotion"])
+                if emotion is None:
+                    return
+                clip.add_emotion(emotion, float(event.get("video_time", 0.0)), event.get("scores"))
+                self.logger.debug(f"Added emotion {event['emotion']} to clip {clip_id}")
+            elif kind == "scene":
+                clip.scenes.append(SceneRecord(float(event.get("video_time", event.get("frame", 0))),
+                                               event.get("description", "Unknown scene")))
+            elif kind == "transcript":
+                clip.transcripts.append(TranscriptRecord(float(event.get("video_timestamp", 0)), event["text"]))
+
+    def finish_clip(self, clip_id: str):
+        """Mark a clip as decided; it becomes eligible for eviction"""
+        with self._lock:
+            clip = self.clips.get(clip_id)
+            if clip is not None:
+                clip.finished_at = time.monotonic()
+            self._evict(time.monotonic())
+
     def get_dominant_emotion(self, clip_id: str) -> tuple:
         """Get the most frequent non-neutral emotion and its frequency"""
-        emotions = [e.lower() for e in self.emotions_by_clip[clip_id]]
-        if not emotions:
+        with self._lock:
+            clip = self._clip(clip_id, create=False)
+        if clip is None or not clip.total:
             self.logger.info(f"No emotions found for clip {clip_id}")
             return ("neutral", 0)
-            
-        # Count emotions excluding neutral
-        emotion_counts = Counter(e for e in emotions if e != "neutral")
-        if not emotion_counts:
+        if clip.dominant is None:
             self.logger.info(f"Only neutral emotions found for clip {clip_id}")
             return ("neutral", 0)
-            
-        # Get the most common emotion and its count
-        dominant_emotion, count = emotion_counts.most_common(1)[0]
-        self.logger.info(f"Clip {clip_id} dominant emotion: {dominant_emotion} ({count}/{len(emotions)})")
-        return (dominant_emotion, count)
-        
+        self.logger.info(f"Clip {clip_id} dominant emotion: {clip.dominant.label} ({clip.dominant_count}/{clip.total})")
+        return (clip.dominant.label, clip.dominant_count)
+
     def get_clip_description(self, clip_id: str) -> str:
         """Get the most relevant scene description for the clip"""
-        scene_events = [e for e in self.events_by_clip[clip_id] if e["type"] == "scene"]
-        if not scene_events:
+        with self._lock:
+            clip = self._clip(clip_id, create=False)
+        # Take the description from the middle of the clip for best representation
+        description = clip.middle_scene() if clip else None
+        if description is None:
             self.logger.info(f"No scene descriptions found for clip {clip_id}")
             return "Unknown scene"
-        # Take the description from the middle of the clip for best representation
-        middle_idx = len(scene_events) // 2
-        description = scene_events[middle_idx].get("description", "Unknown scene")
         self.logger.info(f"Clip {clip_id} scene description: {description}")
         return description
-        
+
     def start_hype_moment(self):
         """Called when chat activity indicates start of a hype moment"""
         if not self.in_hype_moment:
@@ -67,16 +273,48 @@ class ClipProcessor:
             self.in_hype_moment = False
             self.logger.info("📉 Hype moment ended")
 
-    def check_viral_status(self, clip_id: str, clip_path: str = None) -> tuple:
+    def _place(self, clip: ClipEvents, start: float):
+        if clip.start is None:
+            clip.start = start
+            if clip.total:
+                times, probs = clip.emotion_series()
+                self.timeline.extend(times + start, probs)
+
+    def place_clip(self, clip_id: str, start: float = 0.0):
+        """
+        Put a finished clip's emotion samples on the timeline, with video time 0
+        at `start` (wall clock for segments, stream time for live windows).
+        Every clip should be placed, judged or not: it is the context the next
+        one is smoothed with.
+        """
+        with self._lock:
+            clip = self._clip(clip_id, create=False)
+            if clip is not None:
+                self._place(clip, start)
+
+    def check_viral_status(self, clip_id: str, clip_path: str = None, flagged: bool = False) -> tuple:
         """
-        Only runs emotion/scene analysis if we're in a hype moment.
+        Only runs emotion/scene analysis if we're in a hype moment, or the
+        segment was flagged by the cheap triage tier (loudness/motion spike).
+        The clip is scored on the smoothed, confidence-weighted intensity
+        curve of the timeline (see place_clip), so peaks near its start see
+        the end of the previous clip.
         Logs everything with the hype-start timestamp.
         Returns (is_viral, description, peak_time) as before.
         """
         logger = self.logger
 
+        with self._lock:
+            clip = self._clip(clip_id, create=False)
+            result, start = None, 0.0
+            if clip is not None and clip.total:
+                self._place(clip, 0.0)
+                start = clip.start
+                times = np.frombuffer(clip.emotion_times, dtype=np.float64)
+                result = self.timeline.score(start + times.min(), start + times.max())
+
         # If we’re not in a hype moment, skip analysis entirely
-        if not self.in_hype_moment:
+        if not self.in_hype_moment and not flagged:
             logger.info(f"Clip {clip_id}: skipping, not in hype moment")
             return False, None, None
 
@@ -84,34 +322,23 @@ class ClipProcessor:
         ts = self.hype_start_time or datetime.now()
         prefix = f"[{ts:%H:%M:%S}]"
 
-        # gather emotions
-        emotions = [e.lower() for e in self.emotions_by_clip[clip_id]]
-        total = len(emotions)
-        non_neutrals = Counter(e for e in emotions if e != "neutral")
-
-        if total == 0 or not non_neutrals:
+        if result is None or result['dominant'] is None:
             logger.info(f"{prefix} Clip {clip_id}: no strong emotions → not viral")
             return False, None, None
 
-        # pick dominant
-        dominant, count = non_neutrals.most_common(1)[0]
-        ratio = count / total
+        dominant, score = result['dominant'].label, result['score']
 
         # pick a representative scene
-        scenes = [e for e in self.events_by_clip[clip_id] if e["type"] == "scene"]
-        desc = scenes[len(scenes)//2]["description"] if scenes else "Unknown scene"
+        desc = clip.middle_scene() or "Unknown scene"
 
         # print with timestamp prefix
         print(f"{prefix} Clip {clip_id}:")
-        print(f"{prefix}   - Emotion: {dominant} ({count}/{total} = {ratio:.2%})")
+        print(f"{prefix}   - Emotion: {dominant} (share {result['share']:.0%}, peak {result['peak']:.2f}, "
+              f"score {score:.2f})")
         print(f"{prefix}   - Scene: {desc}")
 
-        is_viral = ratio >= 0.3
-        peak_time = next(
-            (e["video_time"] for e in self.events_by_clip[clip_id]
-            if e["type"]=="emotion" and e["emotion"].lower()==dominant),
-            0.0
-        )
+        is_viral = score >= VIRAL_SCORE
+        peak_time = result['peak_time'] - start
 
         if is_viral:
             logger.info(f"{prefix} 🎯 Clip {clip_id} marked VIRAL at peak {peak_time:.1f}s")
@@ -119,48 +346,24 @@ class ClipProcessor:
             if clip_path:
                 self.current_clips.append((clip_path, desc, dominant))
         else:
-            logger.info(f"{prefix} ❌ Clip {clip_id} not viral (ratio {ratio:.2%})")
+            logger.info(f"{prefix} ❌ Clip {clip_id} not viral (score {score:.2f})")
 
         return is_viral, desc, peak_time
-        
+
     def concatenate_clips(self, output_path: str) -> bool:
         """
-        Concatenate all viral clips in the current batch into one MP4,
-        using ffmpeg concat demuxer with -c copy to avoid re-encoding.
+        Join all viral clips in the current batch into one fast-start MP4
+        (stream copy, through the shared HighlightAssembler).
         """
         if not self.current_clips:
             self.logger.info("[Processor] No viral clips to concatenate")
             return False
 
-        # build a temporary file list for ffmpeg
-        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
-            for clip_path, _, _ in self.current_clips:
-                f.write(f"file '{os.path.abspath(clip_path)}'\n")
-            list_file = f.name
-
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        cmd = [
-            'ffmpeg', '-y',
-            '-f', 'concat', '-safe', '0',
-            '-i', list_file,
-            '-c', 'copy',
-            output_path
-        ]
-
-        try:
-            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"[Processor] FFmpeg concat failed: {e}")
-            os.remove(list_file)
+        paths = [clip_path for clip_path, _, _ in self.current_clips]
+        self.current_clips.clear()
+        job = get_assembler().submit_clips(paths, output_path).future.result()
+        if not job.ok:
+            self.logger.error(f"[Processor] Concat failed: {job.error}")
             return False
-        finally:
-            os.remove(list_file)
-
-        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-            self.logger.info(f"[Processor] ✅ Saved viral compilation to {output_path}")
-            self.current_clips.clear()
-            return True
-        else:
-            self.logger.error(f"[Processor] Output file not created or empty: {output_path}")
-            self.current_clips.clear()
-            return False
\ No newline at end of file
+        self.logger.info(f"[Processor] ✅ Saved viral compilation to {output_path}")
+        return True
\ No newline at end of file
@@ -0,0 +1,321 @@
+import os
+import time
+import logging
+
+import cv2
+import numpy as np
+
+from services.models import get_registry
+from services.metrics import FRAMES, timed
+
+# output order of DeepFace's Emotion model
+EMOTION_LABELS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+EMOTION_INPUT = 48  # the classifier takes 48x48 grayscale faces
+DEEPFACE_FACE_SIZE = 224  # DeepFace.analyze pads every face to this square before the classifier
+FACE_MODES = ('detect', 'track', 'fixed')
+FACE_MODE = os.getenv("FACE_MODE", "detect")  # detect every frame, track between detections, or a fixed ROI
+FACE_ROI = os.getenv("FACE_ROI")             # "x,y,w,h" of the facecam, for FACE_MODE=fixed
+
+
+def parse_roi(text: str) -> dict:
+    """ "x,y,w,h" -> facial_area dict"""
+    x, y, w, h = (int(v) for v in text.split(','))
+    if w <= 0 or h <= 0:
+        raise ValueError(f"Empty face ROI {text!r}")
+    return {"x": x, "y": y, "w": w, "h": h}
+
+
+def face_settings() -> tuple:
+    """(mode, roi) from the environment, so pool processes follow the CLI"""
+    mode = os.getenv("FACE_MODE", FACE_MODE)
+    if mode not in FACE_MODES:
+        raise ValueError(f"Unknown face mode {mode!r}, expected one of {FACE_MODES}")
+    roi = os.getenv("FACE_ROI", FACE_ROI)
+    if mode == 'fixed' and not roi:
+        raise ValueError("FACE_MODE=fixed needs FACE_ROI=x,y,w,h")
+    return mode, parse_roi(roi) if mode == 'fixed' else None
+
+
+class FaceTracker:
+    """
+    Finds the face once and follows it instead of detecting on every frame.
+
+    The face is detected on the first frame (and every `redetect_every`
+    frames after); on the frames in between its box is found again by
+    normalised template matching inside a window `margin` box-sizes around
+    the last position, at `scale` of the frame resolution. A match below
+    `min_score` (a cut, the streamer leaving the facecam) falls back to full
+    detection. With a fixed `roi` nothing is detected at all.
+    """
+
+    def __init__(self, registry=None, roi: dict = None, redetect_every: int = 30, min_score: float = 0.6,
+                 margin: float = 0.5, template_width: int = 48):
+        self.registry = registry or get_registry()
+        self.roi = roi
+        self.redetect_every = redetect_every
+        self.min_score = min_score
+        self.margin = margin
+        self.template_width = template_width
+        self.box = None  # x, y, w, h in frame pixels
+        self.template = None
+        self.scale = 1.0
+        self.since_detect = 0
+        self.detections = 0
+        self.tracked = 0
+
+    @staticmethod
+    def _clip_box(box, shape) -> tuple:
+        x, y, w, h = box
+        fh, fw = shape[:2]
+        x, y = max(0, min(int(x), fw - 1)), max(0, min(int(y), fh - 1))
+        return x, y, max(1, min(int(w), fw - x)), max(1, min(int(h), fh - y))
+
+    def _small_gray(self, image: np.ndarray) -> np.ndarray:
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def _detect(self, frame: np.ndarray):
+        face, region = self.registry.detect_face(frame)
+        self.detections += 1
+        self.since_detect = 0
+        box = self._clip_box((region["x"], region["y"], region["w"], region["h"]), frame.shape)
+        if box[2] >= frame.shape[1] and box[3] >= frame.shape[0]:
+            # no face: DeepFace hands back the whole frame; nothing to follow
+            self.box = self.template = None
+            return face, region
+        self.box = box
+        self.scale = min(1.0, self.template_width / box[2])
+        x, y, w, h = box
+        self.template = self._small_gray(frame[y:y + h, x:x + w])
+        return face, region
+
+    def _track(self, frame: np.ndarray) -> bool:
+        x, y, w, h = self.box
+        mx, my = int(w * self.margin), int(h * self.margin)
+        sx, sy, sw, sh = self._clip_box((x - mx, y - my, w + 2 * mx, h + 2 * my), frame.shape)
+        window = self._small_gray(frame[sy:sy + sh, sx:sx + sw])
+        th, tw = self.template.shape
+        if window.shape[0] < th or window.shape[1] < tw:
+            return False
+        _, score, _, (bx, by) = cv2.minMaxLoc(cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED))
+        if score < self.min_score:
+            return False
+        self.box = self._clip_box((sx + bx / self.scale, sy + by / self.scale, w, h), frame.shape)
+        self.since_detect += 1
+        self.tracked += 1
+        return True
+
+    def locate(self, frame: np.ndarray) -> tuple:
+        """
+        (face, region) like ModelRegistry.detect_face; face is either the
+        detector's RGB float crop or a BGR uint8 crop of the tracked box
+        (EmotionEngine.preprocess handles both).
+        """
+        if self.roi is not None:
+            x, y, w, h = self._clip_box((self.roi["x"], self.roi["y"], self.roi["w"], self.roi["h"]), frame.shape)
+            return frame[y:y + h, x:x + w], {"x": x, "y": y, "w": w, "h": h}
+        if self.box is not None and self.since_detect < self.redetect_every and self._track(frame):
+            x, y, w, h = self.box
+            return frame[y:y + h, x:x + w], {"x": x, "y": y, "w": w, "h": h}
+        return self._detect(frame)
+
+
+class EmotionEngine:
+    """
+    Batched replacement for per-frame DeepFace.analyze(actions=['emotion']).
+    Faces are located frame by frame - detected every time (`detect`),
+    followed by a FaceTracker between detections (`track`), or cut from a
+    fixed facecam ROI (`fixed`) - then all crops of a batch are stacked into
+    one (N, 48, 48, 1) tensor and classified in a single forward pass.
+    Results keep DeepFace's per-face dict layout so callers can swap it in.
+    """
+
+    def __init__(self, registry=None, batch_size: int = 16, face_mode: str = None, roi: dict = None):
+        self.logger = logging.getLogger('emotion')
+        self.registry = registry or get_registry()
+        self.batch_size = max(1, batch_size)
+        if face_mode is None:
+            face_mode, env_roi = face_settings()
+            roi = roi or env_roi
+        self.face_mode = face_mode
+        self.tracker = None
+        if face_mode == 'track':
+            self.tracker = FaceTracker(self.registry)
+        elif face_mode == 'fixed':
+            self.tracker = FaceTracker(self.registry, roi=roi)
+
+    @staticmethod
+    def pad_square(gray: np.ndarray, size: int = DEEPFACE_FACE_SIZE) -> np.ndarray:
+        """DeepFace's resize_image: fit into size x size keeping the aspect ratio, pad with black, centred"""
+        h, w = gray.shape[:2]
+        factor = min(size / h, size / w)
+        fitted = cv2.resize(gray, (max(1, int(w * factor)), max(1, int(h * factor))))
+        dh, dw = size - fitted.shape[0], size - fitted.shape[1]
+        return cv2.copyMakeBorder(fitted, dh // 2, dh - dh // 2, dw // 2, dw - dw // 2,
+                                  cv2.BORDER_CONSTANT, value=0)
+
+    @classmethod
+    def preprocess(cls, face: np.ndarray) -> np.ndarray:
+        """
+        Face crop -> 48x48 gray, same as DeepFace.analyze: padded to a square
+        first, so non-square boxes are not stretched. Takes the RGB float faces
+        of extract_faces or BGR uint8 crops of a tracked box.
+        """
+        if face.dtype == np.uint8:
+            gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
+        else:
+            bgr = np.ascontiguousarray(face[:, :, ::-1], dtype=np.float32)
+            gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(cls.pad_square(gray), (EMOTION_INPUT, EMOTION_INPUT))
+
+    def locate(self, frame: np.ndarray) -> tuple:
+        if self.tracker is None:
+            FRAMES.inc(kind='face_detected')
+            return self.registry.detect_face(frame)
+        detections = self.tracker.detections
+        face, region = self.tracker.locate(frame)
+        FRAMES.inc(kind='face_detected' if self.tracker.detections > detections else 'face_tracked')
+        return face, region
+
+    def probabilities(self, frames) -> tuple:
+        """
+        Returns (probs, regions): probs is an (N, 7) array of percentages in
+        EMOTION_LABELS order, regions the detected facial_area of each frame.
+        A frame that could not be analysed has a NaN row and a None region;
+        the others are unaffected, as with per-frame DeepFace.analyze.
+        """
+        n = len(frames)
+        if n == 0:
+            return np.zeros((0, len(EMOTION_LABELS)), dtype=np.float32), []
+
+        crops = np.zeros((n, EMOTION_INPUT, EMOTION_INPUT, 1), dtype=np.float32)
+        regions = []
+        for i, frame in enumerate(frames):
+            try:
+                try:
+                    face, region = self.locate(frame)
+                except Exception as e:
+                    # same fallback as enforce_detection=False: classify the whole frame
+                    self.logger.error(f"Face detection error, using full frame: {e}")
+                    face = frame[:, :, ::-1].astype(np.float32) / 255.0
+                    region = {"x": 0, "y": 0, "w": frame.shape[1], "h": frame.shape[0]}
+                crops[i, :, :, 0] = self.preprocess(face)
+            except Exception as e:
+                self.logger.error(f"Frame {i} of batch could not be prepared: {e}")
+                region = None
+            regions.append(region)
+
+        probs = np.full((n, len(EMOTION_LABELS)), np.nan, dtype=np.float32)
+        ok = np.array([r is not None for r in regions])
+        for start in range(0, n, self.batch_size):
+            idx = np.flatnonzero(ok[start:start + self.batch_size]) + start
+            if not len(idx):
+                continue
+            try:
+                probs[idx] = self.registry.classify_emotions(crops[idx])
+            except Exception as e:
+                # find the frame that breaks the batch instead of losing all of them
+                self.logger.error(f"Batched emotion classification failed, retrying per frame: {e}")
+                for i in idx:
+                    try:
+                        probs[i] = self.registry.classify_emotions(crops[i:i + 1])[0]
+                    except Exception as e:
+                        self.logger.error(f"Frame {i} of batch emotion analysis error: {e}")
+                        regions[i] = None
+
+        totals = probs.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1.0
+        return probs * (100.0 / totals), regions
+
+    def analyze_batch(self, frames) -> list:
+        """One DeepFace-style result dict per frame, None for a frame that failed"""
+        with timed('emotion_inference'):
+            probs, regions = self.probabilities(frames)
+        return [
+            {
+                "dominant_emotion": EMOTION_LABELS[int(row.argmax())],
+                "emotion": dict(zip(EMOTION_LABELS, row.tolist())),
+                "region": region,
+                "probabilities": row,
+            } if region is not None else None
+            for row, region in zip(probs, regions)
+        ]
+
+    def _results(self, idxs, batch):
+        try:
+            results = self.analyze_batch(batch)
+        except Exception as e:
+            self.logger.error(f"Emotion batch at frame {idxs[0]} failed: {e}")
+            return
+        for idx, res in zip(idxs, results):
+            if res is None:
+                self.logger.debug(f"Frame {idx} skipped")
+                continue
+            yield idx, res
+
+    def iter_batches(self, frames):
+        """
+        Group an iterable of (idx, frame) into batches and yield (idx, result)
+        pairs; frames that fail are logged and skipped, the clip goes on.
+        """
+        idxs, batch = [], []
+        for idx, frame in frames:
+            idxs.append(idx)
+            batch.append(frame)
+            if len(batch) >= self.batch_size:
+                yield from self._results(idxs, batch)
+                idxs, batch = [], []
+        if batch:
+            yield from self._results(idxs, batch)
+
+
+def benchmark(video_path: str, batch_sizes=(1, 4, 8, 16, 32), sample_every: int = 10, max_frames: int = 256,
+              face_modes=('detect', 'track')):
+    """Frames/sec of the batched engine (per face mode) vs. per-frame DeepFace.analyze on CPU"""
+    cap = cv2.VideoCapture(video_path)
+    frames, idx = [], 0
+    while len(frames) < max_frames:
+        if not cap.grab():
+            break
+        if idx % sample_every == 0:
+            ret, frame = cap.retrieve()
+            if ret:
+                frames.append(frame)
+        idx += 1
+    cap.release()
+    if not frames:
+        raise RuntimeError(f"No frames decoded from {video_path}")
+
+    registry = get_registry()
+    registry.load(whisper=False, openai=False, warmup=True)
+
+    results = {}
+    start = time.perf_counter()
+    for frame in frames:
+        registry.analyze_emotion(frame)
+    results["deepface.analyze"] = len(frames) / (time.perf_counter() - start)
+
+    for mode in face_modes:
+        for bs in batch_sizes:
+            engine = EmotionEngine(registry, batch_size=bs, face_mode=mode)
+            start = time.perf_counter()
+            for i in range(0, len(frames), bs):
+                engine.analyze_batch(frames[i:i + bs])
+            results[f"{mode} batch={bs}"] = len(frames) / (time.perf_counter() - start)
+
+    print(f"Emotion throughput on {len(frames)} frames of {video_path}:")
+    for name, fps in results.items():
+        print(f"  {name:>20}: {fps:7.1f} frames/sec")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Batched emotion engine CPU benchmark")
+    parser.add_argument("video", nargs="?", default="../captions/videoplayback.mp4")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--max_frames", type=int, default=256)
+    parser.add_argument("--face_modes", nargs="+", default=["detect", "track"], choices=["detect", "track"])
+    args = parser.parse_args()
+    benchmark(args.video, args.batch_sizes, max_frames=args.max_frames, face_modes=args.face_modes)
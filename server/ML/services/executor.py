@@ -0,0 +1,540 @@
+import time
+import queue
+import logging
+import threading
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+from services.frame_bus import FrameBus, SamplingPolicy
+from services.intern import INTERN_FRAMES, INTERN_SAMPLING
+from services.models import get_registry
+from services.analyzers import (EMOTION_SAMPLING, emotion_frames, emotion_worker, intern_worker, transcript_worker,
+                                analyzer_versions, replay_events, run_cached)
+from services.analysis_cache import get_cache
+from services.metrics import CLIPS, get_metrics, span
+from services.scheduler import FULL_PLAN
+from services.transcript import IncrementalTranscriber, replay_transcript
+
+EXECUTOR_MODES = ('thread', 'process')
+
+# event queue of a pool process, installed by _init_process
+_process_event_q = None
+
+
+def _init_process(event_q, warmup, models=None):
+    """Per-process initializer: keep the shared event queue and load models once"""
+    global _process_event_q
+    _process_event_q = event_q
+    get_registry().load(warmup=warmup, **(models or {}))
+
+
+class _ClipEvents:
+    """
+    Tags every event with its clip id before it goes onto the shared queue.
+    Closed by the 'done' marker: analyzers still running past the deadline
+    cannot add to a clip that is being (or has been) finalized.
+    """
+
+    def __init__(self, event_q, clip_id: str):
+        self.event_q = event_q
+        self.clip_id = clip_id
+        self.closed = False
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def put(self, evt: dict):
+        with self._lock:
+            if self.closed:
+                self.dropped += 1
+                return
+            if evt['type'] == 'done':
+                self.closed = True
+            evt['clip_id'] = self.clip_id
+            self.event_q.put(evt)
+
+
+def _run_analyzers(path: str, clip_id: str, events, deadline: float, plan=FULL_PLAN) -> bool:
+    """
+    Replay cached analyzers and run the rest of `plan`'s frame analyzers
+    until `deadline`; True if any ran over. Late analyzers are cancelled
+    cooperatively by closing their frame subscriptions.
+    """
+    logger = logging.getLogger('main')
+    cache = get_cache()
+    wanted = ['emotion', 'scene'] if plan.scene else ['emotion']
+    digest, missing = None, wanted
+    if cache is not None:
+        digest = cache.clip_key(path)
+        versions = analyzer_versions()
+        missing = []
+        for name in wanted:
+            cached = cache.get(digest, name, versions[name])
+            if cached is None:
+                missing.append(name)
+            else:
+                replay_events(cached, events)
+        if len(missing) < len(wanted):
+            logger.info(f"Clip {clip_id}: {len(wanted) - len(missing)}/{len(wanted)} analyzers served from cache")
+
+    def analyzer(name, work, frames=None, store=True):
+        def run():
+            with span(name, clip_id, level=plan.level):
+                run_cached(cache if store else None, digest, name, events, work, frames)
+        return threading.Thread(target=run, daemon=True)
+
+    subscriptions, workers = [], []
+    bus = FrameBus(path) if 'emotion' in missing or 'scene' in missing else None
+    if 'emotion' in missing:
+        # thinned-out emotion results are not what the cache version promises
+        full = plan.emotion_every == EMOTION_SAMPLING.every_n
+        frames = bus.subscribe('emotion', EMOTION_SAMPLING if full else SamplingPolicy.every(plan.emotion_every),
+                               emotion_frames())
+        subscriptions.append(frames)
+        workers.append(analyzer('emotion', lambda q, f=frames: emotion_worker(f, q), frames, store=full))
+    if 'scene' in missing:
+        frames = bus.subscribe('intern', INTERN_SAMPLING, INTERN_FRAMES)
+        subscriptions.append(frames)
+        workers.append(analyzer('scene', lambda q, f=frames: intern_worker(path, q, f), frames))
+
+    if bus is not None:
+        bus.start()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(max(0.0, deadline - time.time()))
+
+    # stop feeding analyzers that ran past the cutoff
+    for frames in subscriptions:
+        frames.close()
+    return any(w.is_alive() for w in workers)
+
+
+def analyze_clip(path: str, clip_id: str, timeout: float = 6.0, event_q=None, plan=None,
+                 deadline: float = None) -> str:
+    """
+    Run the frame analyzers of `plan` (all by default) on one clip, with one
+    decode through a FrameBus, until `deadline` (wall clock; default now +
+    timeout); the transcript is transcribe_segment's part.
+    Analyzers whose output for this exact content is in the analysis cache are
+    replayed from it instead, and the clip is only decoded if one is missing.
+    Events go to `event_q` (or the pool process's queue) tagged with clip_id,
+    followed by a final {'type': 'done', 'part': 'analysis'} marker; in a pool
+    process that marker also carries the metrics recorded since the previous clip.
+    """
+    logger = logging.getLogger('main')
+    in_pool = event_q is None
+    event_q = event_q if event_q is not None else _process_event_q
+    events = _ClipEvents(event_q, clip_id)
+
+    start = time.time()
+    deadline = start + timeout if deadline is None else deadline
+    timed_out = False
+    try:
+        if deadline <= start:
+            # waited in the queue past its deadline: the result would be stale anyway
+            timed_out = True
+            CLIPS.inc(outcome='expired')
+            logger.info(f"Clip {clip_id} expired before analysis started")
+            return clip_id
+        with span('analyze', clip_id):
+            timed_out = _run_analyzers(path, clip_id, events, deadline, plan or FULL_PLAN)
+        if timed_out:
+            CLIPS.inc(outcome='timed_out')
+            logger.info(f"Clip {clip_id} hit its deadline ({deadline - start:.1f}s)")
+    except Exception as e:
+        logger.error(f"Clip {clip_id} analysis failed: {e}")
+    finally:
+        done = {'type': 'done', 'part': 'analysis', 'timed_out': timed_out, 'elapsed': time.time() - start}
+        if in_pool:
+            done['metrics'] = get_metrics().drain()
+        events.put(done)
+    return clip_id
+
+
+def transcribe_segment(path: str, clip_id: str, transcriber: IncrementalTranscriber, timeout: float = 6.0,
+                       event_q=None, deadline: float = None, start: float = None) -> IncrementalTranscriber:
+    """
+    Transcribe one clip with its stream's `transcriber` until `deadline`.
+    ClipExecutor runs this per stream, one clip after the other in segment
+    order, so the transcriber's context follows the stream. Events go out
+    tagged with clip_id like analyze_clip's, then a {'type': 'done', 'part':
+    'transcript'} marker, at the deadline at the latest, whose 'completed' is
+    True only if the whole clip was transcribed (or replayed from the cache);
+    a Whisper call already running is still waited for, so no later clip is
+    fed before it.
+    Returns the transcriber - in a pool process a copy, for the caller to
+    restore() its context from.
+    """
+    logger = logging.getLogger('main')
+    in_pool = event_q is None
+    event_q = event_q if event_q is not None else _process_event_q
+    events = _ClipEvents(event_q, clip_id)
+
+    began = time.time()
+    deadline = began + timeout if deadline is None else deadline
+    timed_out = False
+    completed = []
+    worker = None
+    try:
+        if deadline <= began:
+            timed_out = True
+            return transcriber
+        cache = get_cache()
+        digest = None
+        if cache is not None:
+            digest = cache.clip_key(path)
+            cached = cache.get(digest, 'transcript', analyzer_versions()['transcript'])
+            if cached is not None:
+                replay_transcript(path, cached, events, transcriber, start)
+                completed.append(True)
+                return transcriber
+
+        cancel = threading.Event()
+
+        def run():
+            with span('transcript', clip_id):
+                completed.append(run_cached(cache, digest, 'transcript', events,
+                                            lambda q: transcript_worker(path, q, cancel, transcriber, start)))
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        worker.join(max(0.0, deadline - time.time()))
+        timed_out = worker.is_alive()
+        cancel.set()
+        if timed_out:
+            logger.info(f"Transcript of {clip_id} hit its deadline ({deadline - began:.1f}s)")
+    except Exception as e:
+        logger.error(f"Clip {clip_id} transcript failed: {e}")
+    finally:
+        done = {'type': 'done', 'part': 'transcript', 'timed_out': timed_out,
+                'completed': not timed_out and any(completed), 'elapsed': time.time() - began}
+        if in_pool:
+            done['metrics'] = get_metrics().drain()
+        events.put(done)
+    if worker is not None:
+        worker.join()
+    return transcriber
+
+
+class _TranscriptChain:
+    """Clips waiting for one transcriber, fed to it one at a time in submission order"""
+
+    __slots__ = ('transcriber', 'pending', 'busy')
+
+    def __init__(self, transcriber: IncrementalTranscriber):
+        self.transcriber = transcriber
+        self.pending = deque()  # (path, clip_id, deadline)
+        self.busy = False
+
+
+class ClipExecutor:
+    """
+    Runs analyze_clip for several segments at once, on threads or on a pool of
+    processes (each with its own model registry) so analyzers don't share a GIL.
+    Transcripts run beside it on `transcript_workers` of their own: the clips
+    submitted with one transcriber (one stream) are transcribed strictly one
+    after another in submission order, its context handed from clip to clip.
+    Events flow back over one queue and are pumped into ClipProcessor.add_event.
+    """
+
+    def __init__(self, mode: str = 'thread', workers: int = 2, timeout: float = 6.0, warmup: bool = True,
+                 transcript_workers: int = 1):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Unknown executor mode {mode!r}, expected one of {EXECUTOR_MODES}")
+        self.logger = logging.getLogger('main')
+        self.mode = mode
+        self.workers = workers
+        self.timeout = timeout
+        if mode == 'process':
+            # spawn, not fork: TensorFlow and torch are not fork-safe once initialised
+            ctx = mp.get_context('spawn')
+            self.events = ctx.Queue()
+            self.pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=ctx,
+                initializer=_init_process, initargs=(self.events, warmup, {'whisper': False}),
+            )
+            self.transcripts = ProcessPoolExecutor(
+                max_workers=transcript_workers, mp_context=ctx,
+                initializer=_init_process, initargs=(self.events, warmup, {'emotion': False, 'openai': False}),
+            )
+        else:
+            self.events = queue.Queue()
+            self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='clip')
+            self.transcripts = ThreadPoolExecutor(max_workers=transcript_workers, thread_name_prefix='transcript')
+        self._finished = {}
+        self._parts = {}   # clip_id -> 'done' markers still to come
+        self._completed = {}  # clip_id -> parts that finished in time, e.g. {'transcript'}
+        self._chains = {}  # id(transcriber) -> _TranscriptChain, while it has clips
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pump = None
+        self.logger.info(f"Clip executor: {mode} mode with {workers} workers")
+
+    def submit(self, path: str, clip_id: str, plan=None, deadline: float = None,
+               transcriber: IncrementalTranscriber = None):
+        """
+        Analyse a clip; its transcript goes to `transcriber` (the stream's),
+        after every clip submitted with it before. Without one the clip is
+        transcribed on its own, with no context.
+        """
+        plan = plan or FULL_PLAN
+        with self._lock:
+            self._finished[clip_id] = threading.Event()
+            self._parts[clip_id] = 2 if plan.transcript else 1
+        event_q = None if self.mode == 'process' else self.events
+        fut = self.pool.submit(analyze_clip, path, clip_id, self.timeout, event_q, plan, deadline)
+        fut.add_done_callback(lambda f, cid=clip_id: self._on_future_done(cid, f))
+        if plan.transcript:
+            self._transcribe(transcriber or IncrementalTranscriber(), path, clip_id, deadline)
+        return fut
+
+    def _give_up(self, clip_id: str):
+        with self._lock:
+            done = self._finished.get(clip_id)
+        if done:
+            done.set()
+
+    def _on_future_done(self, clip_id: str, fut):
+        # a cancelled clip or a crashed worker process never sends its 'done' marker
+        if fut.cancelled() or fut.exception() is not None:
+            if not fut.cancelled():
+                self.logger.error(f"Clip {clip_id} worker died: {fut.exception()}")
+            self._give_up(clip_id)
+
+    def _transcribe(self, transcriber: IncrementalTranscriber, path: str, clip_id: str, deadline: float):
+        with self._lock:
+            chain = self._chains.get(id(transcriber))
+            if chain is None:
+                chain = self._chains[id(transcriber)] = _TranscriptChain(transcriber)
+            chain.pending.append((path, clip_id, deadline))
+            if chain.busy:
+                return
+            chain.busy = True
+        self._next_link(chain)
+
+    def _next_link(self, chain: _TranscriptChain):
+        event_q = None if self.mode == 'process' else self.events
+        while True:
+            with self._lock:
+                if not chain.pending:
+                    chain.busy = False
+                    self._chains.pop(id(chain.transcriber), None)
+                    return
+                path, clip_id, deadline = chain.pending.popleft()
+                done = self._finished.get(clip_id)
+            if done is None or done.is_set():
+                continue  # shed or given up on while it waited for its turn
+            try:
+                fut = self.transcripts.submit(transcribe_segment, path, clip_id, chain.transcriber,
+                                              self.timeout, event_q, deadline)
+            except RuntimeError:  # shut down
+                return
+            fut.add_done_callback(lambda f, cid=clip_id: self._link_done(chain, cid, f))
+            return
+
+    def _link_done(self, chain: _TranscriptChain, clip_id: str, fut):
+        if fut.cancelled() or fut.exception() is not None:
+            if not fut.cancelled():
+                self.logger.error(f"Clip {clip_id} transcript worker died: {fut.exception()}")
+            self._give_up(clip_id)
+        elif fut.result() is not chain.transcriber:
+            chain.transcriber.restore(fut.result())  # the copy a pool process fed
+        self._next_link(chain)
+
+    def start(self, processor, on_event=None):
+        """Start the thread that feeds events into `processor`"""
+        get_metrics().gauge('clippy_event_queue_depth', 'Analyzer events waiting for the pump',
+                            fn=self._queue_depth)
+        self._pump = threading.Thread(target=self._run_pump, args=(processor, on_event), daemon=True)
+        self._pump.start()
+
+    def _queue_depth(self):
+        try:
+            return self.events.qsize()
+        except NotImplementedError:  # multiprocessing queues on macOS
+            return None
+
+    def _run_pump(self, processor, on_event):
+        while not self._stop.is_set():
+            try:
+                evt = self.events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            clip_id = evt.get('clip_id')
+            with self._lock:
+                done = self._finished.get(clip_id)
+            if done is None or done.is_set():
+                # the clip was already given up on (worker died, cancelled) or finalized
+                self.logger.debug(f"Dropping late {evt['type']} event for {clip_id}")
+                continue
+            if evt['type'] == 'done':
+                if 'metrics' in evt:
+                    get_metrics().merge(evt['metrics'])
+                with self._lock:
+                    self._parts[clip_id] = left = self._parts.get(clip_id, 1) - 1
+                    if evt.get('completed'):
+                        self._completed.setdefault(clip_id, set()).add(evt['part'])
+                if left <= 0:
+                    done.set()
+                continue
+            try:
+                processor.add_event(clip_id, evt)
+                if on_event:
+                    on_event(evt)
+            except Exception as e:
+                self.logger.error(f"Failed to handle event for {clip_id}: {e}")
+
+    def is_done(self, clip_id: str) -> bool:
+        with self._lock:
+            done = self._finished.get(clip_id)
+        return done is None or done.is_set()
+
+    def completed(self, clip_id: str) -> frozenset:
+        """Parts of clip_id that ran to the end before its deadline; only 'transcript' reports it"""
+        with self._lock:
+            return frozenset(self._completed.get(clip_id, ()))
+
+    def wait(self, clip_id: str, timeout: float = None) -> bool:
+        """Block until every event of clip_id has reached the processor"""
+        with self._lock:
+            done = self._finished.get(clip_id)
+        ok = done is None or done.wait(timeout)
+        if ok:
+            with self._lock:
+                self._finished.pop(clip_id, None)
+                self._parts.pop(clip_id, None)
+                self._completed.pop(clip_id, None)
+        return ok
+
+    def shutdown(self):
+        self._stop.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.transcripts.shutdown(wait=False, cancel_futures=True)
+
+
+class _Lane:
+    """One stream's view of a FairShare: the ClipExecutor interface ClipScheduler uses"""
+
+    def __init__(self, share, name: str):
+        self.share = share
+        self.name = name
+        self.pending = deque()  # (future, path, clip_id, plan, deadline, transcriber), oldest first
+        self.queued = {}        # clip_id -> future, until handed to the executor
+        self.running = 0
+        self.served = 0  # dispatch count at this lane's last turn
+
+    @property
+    def workers(self) -> int:
+        # backlog and degradation are judged against this stream's share of the pool
+        return max(1, self.share.executor.workers // max(1, len(self.share.lanes)))
+
+    def submit(self, path: str, clip_id: str, plan=None, deadline: float = None,
+               transcriber: IncrementalTranscriber = None) -> Future:
+        fut = Future()
+        with self.share._lock:
+            self.pending.append((fut, path, clip_id, plan, deadline, transcriber))
+            self.queued[clip_id] = fut
+        self.share._dispatch()
+        return fut
+
+    def is_done(self, clip_id: str) -> bool:
+        with self.share._lock:
+            fut = self.queued.get(clip_id)
+        if fut is not None:
+            return fut.cancelled()
+        return self.share.executor.is_done(clip_id)
+
+    def completed(self, clip_id: str) -> frozenset:
+        return self.share.executor.completed(clip_id)
+
+    def wait(self, clip_id: str, timeout: float = None) -> bool:
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.share._lock:
+                fut = self.queued.get(clip_id)
+            if fut is None or fut.cancelled():
+                break
+            if end is not None and time.monotonic() >= end:
+                return False
+            time.sleep(0.01)
+        remaining = None if end is None else max(0.0, end - time.monotonic())
+        return self.share.executor.wait(clip_id, remaining)
+
+
+class FairShare:
+    """
+    Shares one ClipExecutor between several streams. Each stream submits
+    through its own lane (see `lane`); clips wait in their lane until a
+    worker is free and are then handed out to the lane with the fewest clips
+    in analysis, the one served longest ago among equals, so a busy stream
+    cannot starve a quiet one. Never more clips than workers are in the
+    executor, so a clip cancelled while it waits in its lane never ran.
+    """
+
+    def __init__(self, executor: ClipExecutor):
+        self.executor = executor
+        self.lanes = {}
+        self.running = 0
+        self.dispatched = 0
+        self._lock = threading.Lock()
+
+    def lane(self, name: str) -> _Lane:
+        with self._lock:
+            if name not in self.lanes:
+                self.lanes[name] = _Lane(self, name)
+            return self.lanes[name]
+
+    def _next(self):
+        # called with the lock held
+        best = None
+        for lane in self.lanes.values():
+            while lane.pending and lane.pending[0][0].cancelled():
+                clip_id = lane.pending.popleft()[2]
+                lane.queued.pop(clip_id, None)
+            if not lane.pending:
+                continue
+            key = (lane.running, lane.served)
+            if best is None or key < best[0]:
+                best = (key, lane)
+        return best[1] if best else None
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                if self.running >= self.executor.workers:
+                    return
+                lane = self._next()
+                if lane is None:
+                    return
+                fut, path, clip_id, plan, deadline, transcriber = lane.pending.popleft()
+                if not fut.set_running_or_notify_cancel():
+                    lane.queued.pop(clip_id, None)
+                    continue
+                self.running += 1
+                self.dispatched += 1
+                lane.running += 1
+                lane.served = self.dispatched
+                # submit before leaving `queued`, so is_done never sees the clip in neither
+                try:
+                    inner = self.executor.submit(path, clip_id, plan=plan, deadline=deadline,
+                                                 transcriber=transcriber)
+                finally:
+                    lane.queued.pop(clip_id, None)
+            inner.add_done_callback(lambda f, outer=fut, lane=lane: self._on_done(lane, outer, f))
+
+    def _on_done(self, lane: _Lane, outer: Future, inner: Future):
+        with self._lock:
+            self.running -= 1
+            lane.running -= 1
+        if inner.cancelled():  # the executor shut down; `outer` is already running
+            outer.set_exception(CancelledError())
+        elif inner.exception() is not None:
+            outer.set_exception(inner.exception())
+        else:
+            outer.set_result(inner.result())
+        self._dispatch()
+
+    def backlog(self) -> dict:
+        """Clips waiting for a worker, per stream"""
+        with self._lock:
+            return {name: len(lane.pending) for name, lane in self.lanes.items()}
@@ -0,0 +1,211 @@
+import os
+import cv2
+import time
+import queue
+import logging
+import threading
+
+from services.metrics import FRAMES, STAGE_SECONDS
+from services.frame_source import FULL_FRAME, FFmpegFrameSource, FrameSpec, probe_video
+
+FRAME_BACKENDS = ('ffmpeg', 'opencv')
+FRAME_BACKEND = os.getenv("FRAME_BACKEND", "ffmpeg")  # opencv: VideoCapture + per-subscriber resize
+
+
+class SamplingPolicy:
+    """Decides which frame indices an analyzer wants to see"""
+
+    def __init__(self, every_n: int = None, per_second: float = None):
+        if (every_n is None) == (per_second is None):
+            raise ValueError("SamplingPolicy needs exactly one of every_n or per_second")
+        self.every_n = every_n
+        self.per_second = per_second
+
+    @classmethod
+    def every(cls, n: int):
+        """Keep every n-th frame (emotion worker style)"""
+        return cls(every_n=max(1, int(n)))
+
+    @classmethod
+    def rate(cls, per_second: float = 1.0):
+        """Keep `per_second` frames per second of video (intern style)"""
+        return cls(per_second=per_second)
+
+    def step(self, fps: float) -> int:
+        if self.every_n is not None:
+            return self.every_n
+        return max(1, int(round((fps or 1) / self.per_second)))
+
+    def wants(self, frame_idx: int, fps: float) -> bool:
+        return frame_idx % self.step(fps) == 0
+
+    def __repr__(self):
+        if self.every_n is not None:
+            return f"SamplingPolicy(every_n={self.every_n})"
+        return f"SamplingPolicy(per_second={self.per_second})"
+
+
+class Subscription:
+    """Iterator over the (frame_idx, frame) pairs a single analyzer asked for"""
+
+    _END = object()
+
+    def __init__(self, name: str, policy: SamplingPolicy, fps: float, maxsize: int, spec: FrameSpec = None):
+        self.name = name
+        self.policy = policy
+        self.spec = spec or FULL_FRAME
+        self.fps = fps
+        self._q = queue.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def _put(self, item):
+        # never block the shared decoder on an analyzer that already gave up
+        while not self.closed:
+            try:
+                self._q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        """Stop receiving frames; the bus drops this subscriber on its next publish"""
+        self.closed = True
+
+    def __iter__(self):
+        while not self.closed:
+            try:
+                item = self._q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is Subscription._END:
+                return
+            yield item
+
+
+class FrameBus:
+    """
+    One decoder per clip. Analyzers subscribe with a SamplingPolicy and a
+    FrameSpec (size, pixel format, keyframes only) and the bus publishes only
+    the frames at least one of them wants, the way each asked for them.
+
+    The ffmpeg backend decodes once into a filter graph with one scaled,
+    converted, decimated branch per subscriber, read from rawvideo pipes into
+    pooled buffers. The opencv backend (and the webcam) skips unwanted frames
+    with grab() and converts retrieved full-resolution frames per spec.
+    """
+
+    def __init__(self, video_path: str, maxsize: int = 64, backend: str = None):
+        self.logger = logging.getLogger('main')
+        self.video_path = video_path
+        self.maxsize = maxsize
+        backend = backend or os.getenv("FRAME_BACKEND", FRAME_BACKEND)
+        if backend not in FRAME_BACKENDS:
+            raise ValueError(f"Unknown frame backend {backend!r}, expected one of {FRAME_BACKENDS}")
+        self.cap, self.info = None, None
+        if backend == 'ffmpeg' and video_path:
+            try:
+                self.info = probe_video(video_path)
+            except Exception as e:
+                self.logger.warning(f"Cannot probe {video_path} ({e}), decoding with OpenCV")
+                backend = 'opencv'
+        else:
+            backend = 'opencv'
+        self.backend = backend
+        if backend == 'opencv':
+            self.cap = cv2.VideoCapture(video_path if video_path else 0)  # 0 == webcam
+            self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        else:
+            self.fps = self.info['fps']
+        self.subscribers = []
+        self._thread = None
+        self.frames_decoded = 0
+        self.frames_retrieved = 0
+
+    def subscribe(self, name: str, policy: SamplingPolicy, spec: FrameSpec = None) -> Subscription:
+        if self._thread is not None:
+            raise RuntimeError("Cannot subscribe after the bus has started")
+        sub = Subscription(name, policy, self.fps, self.maxsize, spec)
+        self.subscribers.append(sub)
+        return sub
+
+    def _run_opencv(self):
+        idx = 0
+        steps = [(sub, sub.policy.step(self.fps)) for sub in self.subscribers]
+        try:
+            while self.cap.isOpened() and steps:
+                if not self.cap.grab():
+                    break
+                self.frames_decoded += 1
+                wanted = [sub for sub, step in steps if idx % step == 0 and not sub.closed]
+                if wanted:
+                    ret, frame = self.cap.retrieve()
+                    if not ret or frame is None:
+                        self.logger.debug(f"Invalid frame at {idx} in {self.video_path}")
+                        break
+                    self.frames_retrieved += 1
+                    converted = {}  # subscribers with the same spec share one conversion
+                    for sub in wanted:
+                        if sub.spec not in converted:
+                            converted[sub.spec] = frame if sub.spec == FULL_FRAME else sub.spec.convert(frame)
+                        sub._put((idx, converted[sub.spec]))
+                steps = [(sub, step) for sub, step in steps if not sub.closed]
+                idx += 1
+        finally:
+            self.cap.release()
+
+    def _run_ffmpeg(self):
+        subs = self.subscribers
+        if not subs:
+            return
+        source = FFmpegFrameSource(self.video_path, [(sub.spec, sub.policy.step(self.fps)) for sub in subs],
+                                   info=self.info)
+        done = [False] * len(subs)
+
+        def pump(k, sub):
+            # keep reading after the subscriber closes: the branches share one decoder
+            for idx, frame in source.frames(k):
+                if not sub.closed:
+                    sub._put((idx, frame))
+                elif all(s.closed for s in subs):
+                    source.stop()
+            done[k] = True
+
+        source.start()
+        pumps = [threading.Thread(target=pump, args=(k, sub), daemon=True) for k, sub in enumerate(subs)]
+        for thread in pumps:
+            thread.start()
+        for thread in pumps:
+            thread.join()
+        source.wait()
+        self.frames_retrieved = sum(source.delivered)
+        self.frames_decoded = source.last_index + 1
+
+    def run(self):
+        """Decode the clip once, fanning sampled frames out to the subscribers"""
+        started = time.perf_counter()
+        try:
+            if self.backend == 'ffmpeg':
+                self._run_ffmpeg()
+            else:
+                self._run_opencv()
+        except Exception as e:
+            self.logger.error(f"Frame bus failed on {self.video_path}: {e}")
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='decode')
+            FRAMES.inc(self.frames_decoded, kind='decoded')
+            FRAMES.inc(self.frames_retrieved, kind='retrieved')
+            for sub in self.subscribers:
+                sub._put(Subscription._END)
+            self.logger.debug(
+                f"Frame bus done: {self.frames_decoded} decoded, "
+                f"{self.frames_retrieved} retrieved for {len(self.subscribers)} analyzers"
+            )
+
+    def start(self) -> threading.Thread:
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def join(self, timeout: float = None):
+        if self._thread:
+            self._thread.join(timeout)
@@ -0,0 +1,363 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import logging
+import resource
+import threading
+import subprocess
+from fractions import Fraction
+
+import numpy as np
+
+PIXEL_CHANNELS = {'bgr24': 3, 'rgb24': 3, 'gray': 1}
+
+
+class FrameSpec:
+    """
+    What a consumer wants out of the decoder: a size (`width` x `height`, or
+    either one keeping the aspect ratio, or at most `max_edge` on the long
+    side - never upscaled), a pixel format (bgr24, rgb24 or gray) and whether
+    only keyframes are needed.
+    """
+
+    __slots__ = ('max_edge', 'width', 'height', 'pix_fmt', 'keyframes_only')
+
+    def __init__(self, max_edge: int = None, width: int = None, height: int = None,
+                 pix_fmt: str = 'bgr24', keyframes_only: bool = False):
+        if pix_fmt not in PIXEL_CHANNELS:
+            raise ValueError(f"Unknown pixel format {pix_fmt!r}, expected one of {tuple(PIXEL_CHANNELS)}")
+        self.max_edge = max_edge
+        self.width = width
+        self.height = height
+        self.pix_fmt = pix_fmt
+        self.keyframes_only = keyframes_only
+
+    def size(self, src_w: int, src_h: int) -> tuple:
+        """Output (width, height) for a source of src_w x src_h; even, for the scaler's sake"""
+        if self.width and self.height:
+            w, h = self.width, self.height
+        elif self.width:
+            w, h = self.width, src_h * self.width / src_w
+        elif self.height:
+            w, h = src_w * self.height / src_h, self.height
+        elif self.max_edge and max(src_w, src_h) > self.max_edge:
+            scale = self.max_edge / max(src_w, src_h)
+            w, h = src_w * scale, src_h * scale
+        else:
+            return src_w, src_h
+        return max(2, int(round(w / 2)) * 2), max(2, int(round(h / 2)) * 2)
+
+    def shape(self, src_w: int, src_h: int) -> tuple:
+        w, h = self.size(src_w, src_h)
+        channels = PIXEL_CHANNELS[self.pix_fmt]
+        return (h, w) if channels == 1 else (h, w, channels)
+
+    def convert(self, frame: np.ndarray) -> np.ndarray:
+        """Apply the spec to a full-resolution BGR frame in Python (the OpenCV backend)"""
+        import cv2
+        h, w = frame.shape[:2]
+        size = self.size(w, h)
+        if size != (w, h):
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if self.pix_fmt == 'gray':
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.pix_fmt == 'rgb24':
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return frame
+
+    def _key(self) -> tuple:
+        return self.max_edge, self.width, self.height, self.pix_fmt, self.keyframes_only
+
+    def __eq__(self, other):
+        return isinstance(other, FrameSpec) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        parts = [f"{k}={v}" for k, v in zip(self.__slots__, self._key()) if v]
+        return f"FrameSpec({', '.join(parts)})"
+
+
+FULL_FRAME = FrameSpec()
+
+
+class FramePool:
+    """
+    Preallocated frame buffers. A buffer is handed out again only once
+    nothing but the pool references it - so frames (and slices of them) that
+    an analyzer keeps stay valid - and the pool grows up to `max_size` when
+    every buffer is still in use, then waits.
+    """
+
+    def __init__(self, shape: tuple, dtype=np.uint8, size: int = 8, max_size: int = 256):
+        self.shape = shape
+        self.dtype = dtype
+        self.max_size = max(size, max_size)
+        self._slots = [np.empty(shape, dtype) for _ in range(size)]
+        self._next = 0
+        # references to a buffer nobody else holds: the list's, plus getrefcount's argument
+        self._free = sys.getrefcount(self._slots[0])
+
+    def __len__(self):
+        return len(self._slots)
+
+    def acquire(self) -> np.ndarray:
+        while True:
+            n = len(self._slots)
+            for k in range(n):
+                i = (self._next + k) % n
+                if sys.getrefcount(self._slots[i]) <= self._free:
+                    self._next = i + 1
+                    return self._slots[i]
+            if n < self.max_size:
+                self._slots.append(np.empty(self.shape, self.dtype))
+                self._next = 0
+                return self._slots[-1]
+            time.sleep(0.001)
+
+
+def probe_video(path: str) -> dict:
+    """Width, height, frame rate and start time of the first video stream"""
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'stream=width,height,avg_frame_rate,r_frame_rate:format=start_time', '-of', 'json', path]
+    info = json.loads(subprocess.run(cmd, capture_output=True, text=True, check=True).stdout or '{}')
+    streams = info.get('streams') or [{}]
+    stream = streams[0]
+    if not stream.get('width'):
+        raise RuntimeError(f"No video stream in {path}")
+    fps = 0.0
+    for key in ('avg_frame_rate', 'r_frame_rate'):
+        try:
+            fps = float(Fraction(stream.get(key, '0/1')))
+        except (ValueError, ZeroDivisionError):
+            continue
+        if fps > 0:
+            break
+    return {'width': int(stream['width']), 'height': int(stream['height']), 'fps': fps or 30.0,
+            'start': float(info.get('format', {}).get('start_time') or 0.0)}
+
+
+def _read_into(stream, buf: np.ndarray) -> bool:
+    view = memoryview(buf).cast('B')
+    got = 0
+    while got < len(view):
+        n = stream.readinto(view[got:])
+        if not n:
+            return False
+        got += n
+    return True
+
+
+class FFmpegFrameSource:
+    """
+    Decodes a video once with ffmpeg and delivers each output its own scaled,
+    colour-converted, decimated frames as rawvideo - the work is done in the
+    decoder's filter graph instead of on full-resolution BGR frames in Python.
+
+    `outputs` is a list of (FrameSpec, step): every `step`-th frame at that
+    spec. Regular outputs are branches of one split filter graph, each on its
+    own pipe; keyframes-only outputs get a second process that skips non-key
+    frames in the decoder. frames(k) yields (frame_idx, frame) for output k,
+    with frames from a FramePool - no per-frame allocation once warm.
+    Every output has to be consumed (or the source stopped), since ffmpeg
+    writes the branches in lockstep.
+    """
+
+    def __init__(self, path: str, outputs: list, info: dict = None, pool_size: int = 8, threads: int = 0):
+        self.logger = logging.getLogger('main')
+        self.path = path
+        self.outputs = [(spec or FULL_FRAME, max(1, int(step))) for spec, step in outputs]
+        self.info = info or probe_video(path)
+        self.fps = self.info['fps']
+        self.threads = threads
+        src = (self.info['width'], self.info['height'])
+        self.pools = [FramePool(spec.shape(*src), size=pool_size) for spec, _ in self.outputs]
+        self._pipes = {}
+        self._procs = []
+        self._stderr = {}
+        self._pts = {}
+        self.delivered = [0] * len(self.outputs)
+        self.last_index = -1
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _filter(self, spec: FrameSpec, step: int, keyframes: bool) -> list:
+        chain = []
+        if step > 1 and not keyframes:
+            chain.append(f"select=not(mod(n\\,{step}))")
+        if keyframes:
+            chain.append("showinfo")  # the only way to learn which frames the decoder kept
+        w, h = spec.size(self.info['width'], self.info['height'])
+        if (w, h) != (self.info['width'], self.info['height']):
+            chain.append(f"scale={w}:{h}:flags=area")
+        chain.append(f"format={spec.pix_fmt}")
+        return chain
+
+    def _spawn(self, indices: list, keyframes: bool):
+        cmd = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'info' if keyframes else 'error',
+               '-threads', str(self.threads)]
+        if keyframes:
+            cmd += ['-skip_frame', 'nokey']
+        # -vsync rather than -fps_mode: ffmpeg before 5.1 only knows the former
+        cmd += ['-i', self.path, '-vsync', 'passthrough']
+        graph, showinfo = [], {}
+        if len(indices) > 1:
+            graph.append(f"[0:v]split={len(indices)}" + "".join(f"[in{k}]" for k in indices))
+        position = len(graph)  # ffmpeg numbers the filters of a graph in order
+        fds = []
+        for k in indices:
+            spec, step = self.outputs[k]
+            chain = self._filter(spec, step, keyframes)
+            if keyframes:
+                showinfo[str(position + chain.index("showinfo"))] = k
+            position += len(chain)
+            source = f"[in{k}]" if len(indices) > 1 else "[0:v]"
+            graph.append(f"{source}{','.join(chain)}[out{k}]")
+        cmd += ['-filter_complex', ";".join(graph)]
+        for k in indices:
+            read, write = os.pipe()
+            fds.append(write)
+            self._pipes[k] = open(read, 'rb', buffering=0)
+            cmd += ['-map', f"[out{k}]", '-an',
+                    '-f', 'rawvideo', '-pix_fmt', self.outputs[k][0].pix_fmt, f"pipe:{write}"]
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, text=True, pass_fds=fds)
+        for fd in fds:
+            os.close(fd)
+        self._procs.append(proc)
+        if keyframes:
+            for k in indices:
+                self._pts[k] = queue.Queue()
+        threading.Thread(target=self._drain_stderr, args=(proc, showinfo), daemon=True).start()
+
+    def _drain_stderr(self, proc, showinfo: dict):
+        # showinfo logs one line per frame as Parsed_showinfo_<filter number>
+        tail = self._stderr.setdefault(proc.pid, [])
+        pattern = re.compile(r"Parsed_showinfo_(\d+).*pts_time:\s*(-?[\d.]+)")
+        for line in proc.stderr:
+            match = pattern.search(line)
+            if match and match.group(1) in showinfo:
+                self._pts[showinfo[match.group(1)]].put(float(match.group(2)))
+            elif 'showinfo' not in line:
+                tail.append(line.rstrip())
+                del tail[:-20]
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                self._spawn_all()
+                self._started = True
+        return self
+
+    def _spawn_all(self):
+        regular = [k for k, (spec, _) in enumerate(self.outputs) if not spec.keyframes_only]
+        keyframes = [k for k, (spec, _) in enumerate(self.outputs) if spec.keyframes_only]
+        if regular:
+            self._spawn(regular, keyframes=False)
+        if keyframes:
+            self._spawn(keyframes, keyframes=True)
+
+    def frames(self, k: int = 0):
+        """(frame_idx, frame) of output k; a frame stays valid while it is referenced"""
+        self.start()
+        spec, step = self.outputs[k]
+        pipe, pool = self._pipes[k], self.pools[k]
+        n = 0
+        try:
+            while True:
+                buf = pool.acquire()
+                if not _read_into(pipe, buf):
+                    return
+                if spec.keyframes_only:
+                    try:
+                        pts = self._pts[k].get(timeout=5.0)
+                    except queue.Empty:
+                        pts = self.info['start'] + n / self.fps
+                    idx = int(round((pts - self.info['start']) * self.fps))
+                else:
+                    idx = n * step
+                n += 1
+                self.delivered[k] += 1
+                self.last_index = max(self.last_index, idx)
+                yield idx, buf
+        finally:
+            pipe.close()
+
+    def stop(self):
+        for proc in self._procs:
+            if proc.poll() is None:
+                proc.kill()
+
+    def wait(self) -> bool:
+        """Reap ffmpeg; False (with its last error lines logged) if it failed"""
+        ok = True
+        for proc in self._procs:
+            code = proc.wait()
+            if code not in (0, -9):
+                ok = False
+                self.logger.error(f"ffmpeg decode of {self.path} exited with {code}: "
+                                  f"{' | '.join(self._stderr.get(proc.pid, [])[-3:])}")
+        return ok
+
+
+def benchmark(video_path: str, spec: FrameSpec = FrameSpec(max_edge=512), step: int = 1, repeat: int = 3):
+    """Frames/sec of VideoCapture + cv2.resize/cvtColor vs. the ffmpeg rawvideo source, same output"""
+    import cv2
+
+    def opencv():
+        cap = cv2.VideoCapture(video_path)
+        n, idx = 0, 0
+        while cap.grab():
+            if idx % step == 0:
+                ok, frame = cap.retrieve()
+                if not ok:
+                    break
+                spec.convert(frame)
+                n += 1
+            idx += 1
+        cap.release()
+        return n
+
+    def ffmpeg():
+        source = FFmpegFrameSource(video_path, [(spec, step)])
+        n = sum(1 for _ in source.frames(0))
+        source.wait()
+        return n
+
+    def cpu_seconds() -> float:
+        # ffmpeg runs in a child process: count it too
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return time.process_time() + children.ru_utime + children.ru_stime
+
+    results = {}
+    for name, run in (('VideoCapture+resize', opencv), ('ffmpeg rawvideo', ffmpeg)):
+        best, cpu, frames = float('inf'), float('inf'), 0
+        for _ in range(repeat):
+            cpu0, start = cpu_seconds(), time.perf_counter()
+            frames = run()
+            best = min(best, time.perf_counter() - start)
+            cpu = min(cpu, cpu_seconds() - cpu0)
+        results[name] = {'frames': frames, 'fps': round(frames / best, 1) if best else 0.0,
+                         'cpu_ms_per_frame': round(1000 * cpu / frames, 3) if frames else 0.0}
+    print(f"Decode of {video_path} to {spec}, every {step}:")
+    for name, r in results.items():
+        print(f"  {name:>20}: {r['fps']:8.1f} frames/sec, {r['cpu_ms_per_frame']:7.3f} CPU ms/frame "
+              f"({r['frames']} frames)")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="VideoCapture vs ffmpeg rawvideo decode benchmark")
+    parser.add_argument("video", nargs="?", default="../captions/videoplayback.mp4")
+    parser.add_argument("--max_edge", type=int, default=512)
+    parser.add_argument("--pix_fmt", default="bgr24", choices=sorted(PIXEL_CHANNELS))
+    parser.add_argument("--step", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.video, FrameSpec(max_edge=args.max_edge, pix_fmt=args.pix_fmt), args.step, args.repeat)
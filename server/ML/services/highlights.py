@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import bisect
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from services.metrics import STAGE_SECONDS, get_metrics
+
+# ffprobe H.264 profile names (without "Constrained") -> libx264 -profile:v
+X264_PROFILES = {'baseline': 'baseline', 'main': 'main', 'high': 'high', 'high 10': 'high10',
+                 'high 4:2:2': 'high422', 'high 4:4:4 predictive': 'high444'}
+
+
+def probe_segment(path: str) -> dict:
+    """
+    Duration, start timestamp, keyframe times (file timestamps) and video codec
+    parameters of a clip; decodes keyframes only
+    """
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+           '-show_entries', 'frame=pts_time,best_effort_timestamp_time:format=duration,start_time'
+           ':stream=codec_name,profile,level,pix_fmt,width,height,avg_frame_rate',
+           '-of', 'json', path]
+    info = json.loads(subprocess.run(cmd, capture_output=True, text=True, check=True).stdout or '{}')
+    fmt = info.get('format', {})
+    start = float(fmt.get('start_time') or 0.0)
+    keyframes = []
+    for frame in info.get('frames', []):
+        t = frame.get('pts_time', frame.get('best_effort_timestamp_time'))
+        if t not in (None, 'N/A'):
+            keyframes.append(float(t))
+    streams = info.get('streams') or [{}]
+    return {'duration': float(fmt.get('duration') or 0.0), 'start': start,
+            'keyframes': sorted(keyframes) or [start], 'codec': streams[0]}
+
+
+class SegmentIndex:
+    """
+    Recently closed segments placed on the wall clock (a segment is closed
+    when it ends, so it starts at mtime - duration). Probes are cached per
+    file and done lazily, off the main loop, and only for segments whose
+    mtime can overlap the range asked for.
+    """
+
+    def __init__(self, max_segments: int = 600, segment_seconds: float = 6.0):
+        self.max_segments = max_segments
+        self.segment_seconds = segment_seconds
+        self._paths = OrderedDict()  # path -> probe result, or None until probed
+        self._lock = threading.Lock()
+
+    def add(self, path: str):
+        with self._lock:
+            self._paths[os.path.abspath(path)] = None
+            while len(self._paths) > self.max_segments:
+                self._paths.popitem(last=False)
+
+    def info(self, path: str) -> dict:
+        path = os.path.abspath(path)
+        with self._lock:
+            info = self._paths.get(path)
+        if info is None:
+            info = probe_segment(path)
+            info['wall_start'] = os.path.getmtime(path) - info['duration']
+            with self._lock:
+                self._paths[path] = info
+        return info
+
+    def covering(self, t0: float, t1: float) -> list:
+        """(path, info) of the indexed segments overlapping wall-clock [t0, t1], in order"""
+        with self._lock:
+            paths = list(self._paths)
+        out = []
+        for path in paths:
+            try:
+                end = os.path.getmtime(path)
+            except OSError:
+                continue
+            # recorders cut on keyframes, so allow a segment up to twice its nominal length
+            if end <= t0 or end - 2 * self.segment_seconds >= t1:
+                continue
+            info = self.info(path)
+            if info['wall_start'] < t1 and info['wall_start'] + info['duration'] > t0:
+                out.append((path, info))
+        return sorted(out, key=lambda item: item[1]['wall_start'])
+
+
+class HighlightJob:
+    __slots__ = ('id', 'output', 't0', 't1', 'status', 'progress', 'error', 'elapsed', 'future')
+
+    def __init__(self, job_id: int, output: str, t0: float = None, t1: float = None):
+        self.id = job_id
+        self.output = output
+        self.t0 = t0
+        self.t1 = t1
+        self.status = 'queued'
+        self.progress = 0.0
+        self.error = None
+        self.elapsed = None
+        self.future = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 'done'
+
+    def __repr__(self):
+        return f"HighlightJob({self.id}, {self.output!r}, {self.status}, {self.progress:.0%})"
+
+
+class HighlightAssembler:
+    """
+    Builds highlight MP4s straight from the source segments.
+
+    A job is one ffmpeg pass over a concat list with per-file in/out points,
+    so the sources are read once and nothing is written but the fast-start
+    output. Stream copy can only start on a keyframe, so by default the start
+    is snapped back to the keyframe at or before it; with `exact=True` the
+    partial GOP before the first keyframe is re-encoded instead and the rest
+    is still copied. Jobs run on a pool of `workers` threads and report
+    progress and errors through callbacks and their HighlightJob.
+    """
+
+    def __init__(self, workers: int = 2, exact: bool = False, index: SegmentIndex = None,
+                 encoder: tuple = ('-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18')):
+        self.logger = logging.getLogger('main')
+        self.exact = exact
+        self.index = index or SegmentIndex()
+        self.encoder = list(encoder)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='highlight')
+        self.jobs = OrderedDict()
+        self._ids = iter(range(1, 1 << 62))
+        self._lock = threading.Lock()
+        get_metrics().gauge('clippy_highlight_jobs', 'Highlight jobs by status', ('status',),
+                            fn=self._job_counts)
+
+    def _job_counts(self) -> dict:
+        with self._lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {(s,): statuses.count(s) for s in ('queued', 'running', 'done', 'failed')}
+
+    def add_segment(self, path: str):
+        """Make a closed segment available for range cuts (cheap; probing happens in the workers)"""
+        self.index.add(path)
+
+    # ── planning ──────────────────────────────────────────────────────────────
+    def plan_range(self, t0: float, t1: float, index: SegmentIndex = None) -> list:
+        """[(path, inpoint, outpoint, info)] in file timestamps for wall-clock [t0, t1]"""
+        parts = []
+        for path, info in (index or self.index).covering(t0, t1):
+            offset = info['start'] - info['wall_start']  # wall clock -> file timestamp
+            inpoint = max(info['start'], t0 + offset)
+            outpoint = min(info['start'] + info['duration'], t1 + offset)
+            parts.append((path, inpoint, outpoint, info))
+        return parts
+
+    def plan_clips(self, paths: list) -> list:
+        """Whole clips back to back"""
+        parts = []
+        for path in paths:
+            info = self.index.info(path)
+            parts.append((os.path.abspath(path), info['start'], info['start'] + info['duration'], info))
+        return parts
+
+    @staticmethod
+    def _snap(keyframes: list, t: float) -> float:
+        i = bisect.bisect_right(keyframes, t + 1e-3)
+        return keyframes[i - 1] if i else keyframes[0]
+
+    # ── running ───────────────────────────────────────────────────────────────
+    def _ffmpeg(self, cmd: list, duration: float, job: HighlightJob, on_progress=None):
+        proc = subprocess.Popen(cmd + ['-progress', 'pipe:1', '-nostats'], stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        stderr = []
+        drain = threading.Thread(target=lambda: stderr.extend(proc.stderr), daemon=True)
+        drain.start()
+        for line in proc.stdout:
+            key, _, value = line.strip().partition('=')
+            if key in ('out_time_us', 'out_time_ms') and value.lstrip('-').isdigit() and duration > 0:
+                job.progress = min(1.0, int(value) / 1e6 / duration)
+                if on_progress:
+                    on_progress(job)
+        code = proc.wait()
+        drain.join(1.0)
+        if code != 0:
+            raise RuntimeError(f"ffmpeg exited with {code}: {''.join(stderr[-5:]).strip()}")
+
+    @staticmethod
+    def _match_source(codec: dict) -> list:
+        """
+        Encoder options that give the re-encoded head the source's H.264
+        profile, level, pixel format, size and rate, so the stream-copied rest
+        decodes under the same constraints; None for sources libx264 can't match
+        """
+        if codec.get('codec_name') != 'h264':
+            return None
+        args = ['-pix_fmt', codec.get('pix_fmt') or 'yuv420p']
+        profile = X264_PROFILES.get((codec.get('profile') or '').lower().replace('constrained ', ''))
+        if profile:
+            args += ['-profile:v', profile]
+        if (codec.get('level') or 0) > 0:
+            args += ['-level:v', f"{codec['level'] / 10:.1f}"]
+        if codec.get('width') and codec.get('height'):
+            args += ['-s', f"{codec['width']}x{codec['height']}"]
+        if codec.get('avg_frame_rate') not in (None, '0/0'):
+            args += ['-r', codec['avg_frame_rate']]
+        return args
+
+    def _encode_head(self, path: str, start: float, end: float, out: str, match: list, job: HighlightJob):
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-ss', f"{start:.3f}", '-i', path,
+               '-t', f"{end - start:.3f}", *self.encoder, *match, '-c:a', 'copy', out]
+        self._ffmpeg(cmd, end - start, job)
+
+    def assemble(self, parts: list, output_path: str, job: HighlightJob = None, on_progress=None) -> bool:
+        """Blocking: write `parts` (from plan_range / plan_clips) to a fast-start MP4"""
+        job = job or HighlightJob(0, output_path)
+        if not parts:
+            raise RuntimeError("no source segments cover the requested range")
+        scratch = None
+        lines = []
+        try:
+            for i, (path, inpoint, outpoint, info) in enumerate(parts):
+                keyframe = self._snap(info['keyframes'], inpoint)
+                match = self._match_source(info.get('codec') or {}) if i == 0 and self.exact else None
+                if match is not None and keyframe < inpoint - 1e-3:
+                    # re-encode only up to the next keyframe, copy from there on
+                    after = [k for k in info['keyframes'] if k > inpoint]
+                    head_end = min(after[0], outpoint) if after else outpoint
+                    scratch = tempfile.mkdtemp(prefix='highlight_')
+                    head = os.path.join(scratch, 'head.mp4')
+                    self._encode_head(path, inpoint, head_end, head, match, job)
+                    lines.append(f"file '{head}'")
+                    if head_end >= outpoint - 1e-3:
+                        continue
+                    inpoint = head_end
+                else:
+                    inpoint = keyframe
+                if i == 0 and job.t0 is not None:
+                    job.t0 = info['wall_start'] + (min(inpoint, parts[0][1]) - info['start'])
+                lines.append(f"file '{path}'")
+                if inpoint > info['start'] + 1e-3:
+                    lines.append(f"inpoint {inpoint:.6f}")
+                if outpoint < info['start'] + info['duration'] - 1e-3:
+                    lines.append(f"outpoint {outpoint:.6f}")
+
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+            tmp = output_path + '.part.mp4'
+            listing = os.path.join(scratch or tempfile.gettempdir(), f"highlight_{os.getpid()}_{job.id}.txt")
+            with open(listing, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            try:
+                cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', listing,
+                       '-map', '0', '-c', 'copy', '-movflags', '+faststart', tmp]
+                if scratch:
+                    # the concat demuxer puts each file's SPS/PPS in-band; avc3 tells
+                    # players they change after the head instead of only reading avcC
+                    cmd[-1:-1] = ['-tag:v', 'avc3']
+                self._ffmpeg(cmd, sum(p[2] - p[1] for p in parts), job, on_progress)
+            finally:
+                os.remove(listing)
+            if not os.path.exists(tmp) or os.path.getsize(tmp) == 0:
+                raise RuntimeError("ffmpeg produced no output")
+            os.replace(tmp, output_path)  # never expose a half-written highlight
+            return True
+        finally:
+            if scratch:
+                for name in os.listdir(scratch):
+                    os.remove(os.path.join(scratch, name))
+                os.rmdir(scratch)
+
+    def _run(self, job: HighlightJob, plan, on_done, on_progress):
+        job.status = 'running'
+        start = time.perf_counter()
+        try:
+            self.assemble(plan(), job.output, job, on_progress)
+            job.status, job.progress = 'done', 1.0
+            self.logger.info(f"🎬 Highlight {job.output} ready in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            job.status, job.error = 'failed', str(e)
+            self.logger.error(f"Highlight {job.output} failed: {e}")
+        job.elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(job.elapsed, stage='highlight')
+        if on_done:
+            try:
+                on_done(job)
+            except Exception as e:
+                self.logger.error(f"Highlight callback for {job.output} failed: {e}")
+        return job
+
+    def _submit(self, job: HighlightJob, plan, on_done, on_progress) -> HighlightJob:
+        with self._lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > 256:
+                self.jobs.popitem(last=False)
+        job.future = self.pool.submit(self._run, job, plan, on_done, on_progress)
+        return job
+
+    def submit_range(self, t0: float, t1: float, output_path: str, on_done=None, on_progress=None,
+                     index: SegmentIndex = None) -> HighlightJob:
+        """Cut wall-clock [t0, t1] from the indexed segments (of `index`, for one of several streams) in the background"""
+        job = HighlightJob(next(self._ids), output_path, t0, t1)
+        return self._submit(job, lambda: self.plan_range(t0, t1, index), on_done, on_progress)
+
+    def submit_clips(self, paths: list, output_path: str, on_done=None, on_progress=None) -> HighlightJob:
+        """Join whole clips in the background"""
+        job = HighlightJob(next(self._ids), output_path)
+        return self._submit(job, lambda: self.plan_clips(paths), on_done, on_progress)
+
+    def concat(self, paths: list, output_path: str) -> bool:
+        """Blocking join of whole clips"""
+        return self.submit_clips(paths, output_path).future.result().ok
+
+    def shutdown(self, wait: bool = True):
+        self.pool.shutdown(wait=wait)
+
+
+_assembler = None
+_assembler_lock = threading.Lock()
+
+
+def get_assembler() -> HighlightAssembler:
+    """Process-wide assembler shared by the live loop and ClipProcessor"""
+    global _assembler
+    if _assembler is None:
+        with _assembler_lock:
+            if _assembler is None:
+                _assembler = HighlightAssembler()
+    return _assembler
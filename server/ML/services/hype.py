@@ -0,0 +1,289 @@
+import math
+import time
+from datetime import datetime
+
+HYPE_KEYWORDS = frozenset({
+    "LUL", "LULW", "KEKW", "OMEGALUL", "ICANT", "POG", "POGGERS", "POGCHAMP", "POGU",
+    "W", "WW", "CLIP", "CLIPIT", "HOLY", "WTF", "🔥", "💀",
+})
+
+
+class RateWindows:
+    """
+    Message counts over several trailing windows from one circular array of
+    per-second buckets. add() is O(#windows); moving to a new second expires
+    exactly one bucket per window, so nothing is ever rescanned.
+    """
+
+    def __init__(self, windows=(5, 20, 60)):
+        self.windows = tuple(sorted(int(w) for w in windows))
+        self.size = self.windows[-1] + 1
+        self.counts = [0] * self.size
+        self.sums = [0] * len(self.windows)
+        self.current = None
+        self.first = None
+
+    def advance(self, second: int):
+        """Move to `second`; returns (count of the second just closed, idle seconds after it)"""
+        if self.current is None:
+            self.current = self.first = second
+            return None, 0
+        steps = second - self.current
+        if steps <= 0:
+            return None, 0
+        closed = self.counts[self.current % self.size]
+        if steps >= self.size:
+            self.counts = [0] * self.size
+            self.sums = [0] * len(self.windows)
+        else:
+            counts, size = self.counts, self.size
+            for s in range(self.current + 1, second + 1):
+                for i, w in enumerate(self.windows):
+                    self.sums[i] -= counts[(s - w) % size]
+                counts[s % size] = 0
+        self.current = second
+        return closed, steps - 1
+
+    def add(self, n: int = 1):
+        self.counts[self.current % self.size] += n
+        for i in range(len(self.sums)):
+            self.sums[i] += n
+
+    def rates(self) -> list:
+        """Messages per second for each window (shorter while the history is short)"""
+        elapsed = self.current - self.first + 1 if self.current is not None else 1
+        return [s / min(w, elapsed) for s, w in zip(self.sums, self.windows)]
+
+
+class Baseline:
+    """Exponentially weighted mean / variance of a per-second count"""
+
+    def __init__(self, alpha: float = 0.05, initial: float = 0.5):
+        self.alpha = alpha
+        self.mean = initial
+        self.var = initial
+        self.samples = 0
+
+    def update(self, value: float, repeat: int = 1, alpha: float = None):
+        if repeat and not self.samples:
+            # seed from the first observation (Poisson-ish variance) instead of the prior
+            self.mean, self.var = value, max(value, self.var)
+        a = self.alpha if alpha is None else alpha
+        for _ in range(min(repeat, 600)):  # long idle gaps decay to ~0 well before 600 steps
+            diff = value - self.mean
+            self.mean += a * diff
+            self.var = (1 - a) * (self.var + a * diff * diff)
+            self.samples += 1
+
+    def z(self, value: float) -> float:
+        return (value - self.mean) / math.sqrt(self.var + 1e-6)
+
+
+class ChannelState:
+    def __init__(self, windows, alpha):
+        self.messages = RateWindows(windows)
+        self.keywords = RateWindows(windows)
+        self.baseline = Baseline(alpha)
+        self.keyword_baseline = Baseline(alpha, initial=0.1)
+        # short-window counts that make a message worth a full evaluation,
+        # refreshed once per second so the per-message path is two int compares
+        self.need = float('inf')
+        self.keyword_need = float('inf')
+        self.in_peak = False
+        self.peak_start = None
+        self.last_peak = None
+        self.peak_rate = 0.0
+        self.reason = None
+
+
+class HypeDetector:
+    """
+    Chat-velocity hype detection, one state per channel.
+
+    Each message is an O(1) bucket increment on a monotonic-clock second. Once
+    a second closes it feeds an EMA baseline (mean and variance) of messages
+    per second and of keyword/emote messages per second. A channel goes hype
+    when the shortest window's rate is `multiplier` times the baseline with a
+    z-score of at least `z_start` and the middle window holds `min_messages`,
+    or when keyword messages burst the same way. It cools down once the short
+    rate falls back under `end_ratio` x baseline for `cooldown` seconds. No
+    channel fires before `warmup` seconds of baseline, and during hype the
+    baseline adapts at `peak_adapt` x its normal speed.
+
+    feed() and tick() return structured 'hype_start' / 'hype_end' events,
+    which are also passed to `on_event` when given.
+    """
+
+    def __init__(self, windows=(5, 20, 60), alpha: float = 0.05, multiplier: float = 2.0,
+                 z_start: float = 3.0, min_messages: int = 10, end_ratio: float = 1.1,
+                 cooldown: float = 10.0, keywords=HYPE_KEYWORDS, keyword_multiplier: float = 3.0,
+                 min_keywords: int = 5, warmup: int = 30, peak_adapt: float = 0.1, on_event=None):
+        self.windows = tuple(sorted(windows))
+        self.alpha = alpha
+        self.multiplier = multiplier
+        self.z_start = z_start
+        self.min_messages = min_messages
+        self.end_ratio = end_ratio
+        self.cooldown = cooldown
+        self.keywords = frozenset(k.upper() for k in keywords)
+        # emoji are often glued to other text, so those are matched as substrings
+        self._glued = tuple(k for k in self.keywords if not k.isascii())
+        self.keyword_multiplier = keyword_multiplier
+        self.min_keywords = min_keywords
+        self.warmup = warmup
+        self.peak_adapt = peak_adapt
+        self.on_event = on_event
+        self.channels = {}
+
+    def _state(self, channel: str) -> ChannelState:
+        state = self.channels.get(channel)
+        if state is None:
+            state = self.channels[channel] = ChannelState(self.windows, self.alpha)
+        return state
+
+    def is_keyword(self, text: str) -> bool:
+        upper = text.upper()
+        return not self.keywords.isdisjoint(upper.split()) or any(k in upper for k in self._glued)
+
+    def _z(self, base: Baseline, rate: float) -> float:
+        # the short rate is a mean of several one-second counts
+        return (rate - base.mean) / math.sqrt(base.var / self.windows[0] + 1e-6)
+
+    def _thresholds(self, state: ChannelState):
+        msgs = state.messages
+        if state.baseline.samples < self.warmup:
+            return
+        span = min(self.windows[0], msgs.current - msgs.first + 1)
+        base, kw = state.baseline, state.keyword_baseline
+        rate = max(self.multiplier * max(base.mean, 0.1),
+                   base.mean + self.z_start * math.sqrt(base.var / self.windows[0] + 1e-6))
+        state.need = max(rate * span, 1)
+        state.keyword_need = max(self.keyword_multiplier * max(kw.mean, 0.05) * span, self.min_keywords - 1)
+
+    def _advance(self, state: ChannelState, second: int) -> bool:
+        """Move the channel clock; True if a second closed"""
+        closed, idle = state.messages.advance(second)
+        kw_closed, kw_idle = state.keywords.advance(second)
+        if closed is None:
+            return False
+        # during hype the baseline only creeps, so a long peak does not become the norm
+        # but a level shift (raid, new audience) is eventually accepted
+        alpha = self.alpha * self.peak_adapt if state.in_peak else None
+        for base, value, gap in ((state.baseline, closed, idle), (state.keyword_baseline, kw_closed, kw_idle)):
+            base.update(value, alpha=alpha)
+            base.update(0, gap, alpha=alpha)
+        self._thresholds(state)
+        return True
+
+    def feed(self, channel: str, text: str = "", now: float = None) -> list:
+        """Count one message; returns any hype events it triggered"""
+        now = time.monotonic() if now is None else now
+        state = self.channels.get(channel) or self._state(channel)
+        second = int(now)
+        closed = second != state.messages.current and self._advance(state, second)
+        state.messages.add()
+        if text and self.is_keyword(text):
+            state.keywords.add()
+        if state.messages.sums[0] > state.need or state.keywords.sums[0] > state.keyword_need:
+            return self._evaluate(channel, state, now)
+        if closed and state.in_peak:
+            return self._evaluate(channel, state, now)
+        return []
+
+    def tick(self, now: float = None) -> list:
+        """Advance every channel's clock (call when chat is quiet so hype can end)"""
+        now = time.monotonic() if now is None else now
+        events = []
+        for channel, state in self.channels.items():
+            if self._advance(state, int(now)) and state.in_peak:
+                events += self._evaluate(channel, state, now)
+        return events
+
+    def _hot(self, state: ChannelState):
+        if state.messages.sums[0] > state.need and state.messages.sums[min(1, len(self.windows) - 1)] >= self.min_messages:
+            return 'rate'
+        if state.keywords.sums[0] > state.keyword_need:
+            return 'keywords'
+        return None
+
+    def _event(self, kind: str, channel: str, state: ChannelState, now: float) -> dict:
+        rates = state.messages.rates()
+        evt = {
+            'type': kind,
+            'timestamp': datetime.now(),
+            'channel': channel,
+            'reason': state.reason,
+            'rates': dict(zip(self.windows, (round(r, 2) for r in rates))),
+            'keyword_rate': round(state.keywords.rates()[0], 2),
+            'baseline': round(state.baseline.mean, 2),
+            'z': round(self._z(state.baseline, rates[0]), 2),
+        }
+        if kind == 'hype_end':
+            evt['duration'] = round(now - state.peak_start, 1)
+            evt['peak_rate'] = round(state.peak_rate, 2)
+        if self.on_event:
+            self.on_event(evt)
+        return evt
+
+    def _evaluate(self, channel: str, state: ChannelState, now: float) -> list:
+        reason = self._hot(state)
+        if reason:
+            state.last_peak = now
+            state.peak_rate = max(state.peak_rate, state.messages.rates()[0])
+            if not state.in_peak:
+                state.in_peak, state.peak_start, state.reason = True, now, reason
+                return [self._event('hype_start', channel, state, now)]
+            return []
+        if (state.in_peak and state.messages.rates()[0] < self.end_ratio * state.baseline.mean
+                and now - state.last_peak >= self.cooldown):
+            evt = self._event('hype_end', channel, state, now)
+            state.in_peak, state.peak_rate, state.reason = False, 0.0, None
+            return [evt]
+        return []
+
+    def in_hype(self, channel: str = None) -> bool:
+        if channel is not None:
+            return channel in self.channels and self.channels[channel].in_peak
+        return any(s.in_peak for s in self.channels.values())
+
+
+if __name__ == "__main__":
+    import os
+    import random
+    from collections import deque
+    from datetime import timedelta
+
+    # synthetic chat: 20 msg/s baseline with a 10 s burst of 150 msg/s every minute
+    rng = random.Random(0)
+    stamps, t = [], 0.0
+    while t < 600:
+        rate = 150 if t % 60 >= 50 else 20
+        t += rng.expovariate(rate)
+        stamps.append(t)
+    texts = [rng.choice(["hello", "LUL", "nice", "POG", "what"]) for _ in stamps]
+
+    # what main.py used to do per message: datetime math plus a flushed print
+    sink = open(os.devnull, 'w')
+    start = time.perf_counter()
+    times, origin = deque(), datetime.now()
+    for s, text in zip(stamps, texts):
+        datetime.now()
+        now = origin + timedelta(seconds=s)
+        print(f"[{now:%H:%M:%S}] {text}", file=sink, flush=True)
+        times.append(now)
+        while times and (now - times[0]).total_seconds() > 20:
+            times.popleft()
+    legacy = time.perf_counter() - start
+
+    detector = HypeDetector()
+    events = []
+    start = time.perf_counter()
+    for s, text in zip(stamps, texts):
+        events += detector.feed("#bench", text, now=s)
+    events += detector.tick(now=stamps[-1] + 30)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(stamps)} messages: deque/datetime/print {legacy * 1e6 / len(stamps):.2f} us/msg, "
+          f"HypeDetector {elapsed * 1e6 / len(stamps):.2f} us/msg")
+    for evt in events:
+        print(f"  {evt['type']:<10} reason={evt['reason']} rates={evt['rates']} z={evt['z']}")
@@ -0,0 +1,292 @@
+import os
+import time
+import queue
+import random
+import asyncio
+import logging
+import threading
+
+TWITCH_HOST = os.getenv("TWITCH_HOST", "irc.chat.twitch.tv")
+TWITCH_PORT = int(os.getenv("TWITCH_PORT", "6667"))
+TWITCH_NICK = os.getenv("TWITCH_NICK", "flaccdo")
+TWITCH_TOKEN = os.getenv("TWITCH_TOKEN", "oauth:5hat2rxorg0y8j0ti7gt13rdtztadj")
+TWITCH_CHANNELS = [c for c in os.getenv("TWITCH_CHANNELS", "#kvinhe").split(",") if c]
+
+_TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+
+def _unescape_tag(value: str) -> str:
+    if '\\' not in value:
+        return value
+    out, i = [], 0
+    while i < len(value):
+        ch = value[i]
+        if ch == '\\' and i + 1 < len(value):
+            out.append(_TAG_ESCAPES.get(value[i + 1], value[i + 1]))
+            i += 2
+            continue
+        if ch != '\\':  # a trailing lone backslash is dropped
+            out.append(ch)
+        i += 1
+    return ''.join(out)
+
+
+class IrcMessage:
+    """One parsed IRC line: IRCv3 tags, prefix, command and params"""
+
+    __slots__ = ('tags', 'prefix', 'command', 'params', 'received')
+
+    def __init__(self, tags: dict, prefix: str, command: str, params: list, received: float = None):
+        self.tags = tags
+        self.prefix = prefix
+        self.command = command
+        self.params = params
+        self.received = time.time() if received is None else received
+
+    @classmethod
+    def parse(cls, line: str, received: float = None):
+        """Parse a line without its CRLF; returns None for empty lines"""
+        tags, prefix = {}, None
+        if line.startswith('@'):
+            raw, _, line = line[1:].partition(' ')
+            for item in raw.split(';'):
+                key, _, value = item.partition('=')
+                tags[key] = _unescape_tag(value)
+            line = line.lstrip(' ')
+        if line.startswith(':'):
+            prefix, _, line = line[1:].partition(' ')
+            line = line.lstrip(' ')
+        head, sep, trailing = line.partition(' :')
+        params = head.split()
+        if not params:
+            return None
+        if sep:
+            params.append(trailing)
+        return cls(tags, prefix, params[0].upper(), params[1:], received)
+
+    @property
+    def nick(self) -> str:
+        return self.tags.get('display-name') or (self.prefix or '').split('!', 1)[0]
+
+    @property
+    def channel(self) -> str:
+        return self.params[0] if self.params else ''
+
+    @property
+    def text(self) -> str:
+        return self.params[-1] if self.params else ''
+
+    def __repr__(self):
+        return f"IrcMessage({self.command} {self.params!r})"
+
+
+class IrcClient:
+    """
+    Asyncio IRC client for Twitch-style chat.
+
+    Lines are framed by the StreamReader (readuntil CRLF), so messages split
+    across TCP reads are reassembled rather than corrupted. Many channels share
+    one connection; the connection is re-established with exponential backoff
+    and jitter when it drops or the server sends RECONNECT, and every joined
+    channel is re-joined. PRIVMSGs are handed to `on_message`, or queued on
+    `messages` for `async for` consumers.
+    """
+
+    def __init__(self, channels=None, host: str = TWITCH_HOST, port: int = TWITCH_PORT,
+                 nick: str = TWITCH_NICK, token: str = TWITCH_TOKEN, on_message=None,
+                 max_queue: int = 10000, backoff: float = 1.0, max_backoff: float = 60.0,
+                 idle_timeout: float = 360.0):
+        self.logger = logging.getLogger('chat')
+        self.host, self.port = host, port
+        self.nick, self.token = nick, token
+        self.channels = {self._norm(c) for c in (channels or TWITCH_CHANNELS)}
+        self.on_message = on_message
+        self.messages = asyncio.Queue(maxsize=max_queue)
+        self.backoff, self.max_backoff = backoff, max_backoff
+        self.idle_timeout = idle_timeout  # Twitch PINGs every ~5 min
+        self.received = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self._writer = None
+        self._stopping = False
+
+    @staticmethod
+    def _norm(channel: str) -> str:
+        channel = channel.strip().lower()
+        return channel if channel.startswith('#') else '#' + channel
+
+    async def _send(self, line: str):
+        if self._writer is not None:
+            self._writer.write((line + '\r\n').encode('utf-8'))
+            await self._writer.drain()
+
+    async def join(self, channel: str):
+        channel = self._norm(channel)
+        self.channels.add(channel)
+        await self._send(f"JOIN {channel}")
+
+    async def part(self, channel: str):
+        channel = self._norm(channel)
+        self.channels.discard(channel)
+        await self._send(f"PART {channel}")
+
+    async def _handshake(self):
+        await self._send("CAP REQ :twitch.tv/tags twitch.tv/commands")
+        if self.token:
+            await self._send(f"PASS {self.token}")
+        await self._send(f"NICK {self.nick}")
+        if self.channels:
+            await self._send("JOIN " + ",".join(sorted(self.channels)))
+
+    def _deliver(self, msg: IrcMessage):
+        self.received += 1
+        if self.on_message is not None:
+            self.on_message(msg)
+            return
+        try:
+            self.messages.put_nowait(msg)
+        except asyncio.QueueFull:
+            # a stalled consumer must not stall the socket; keep the newest chat
+            self.messages.get_nowait()
+            self.messages.put_nowait(msg)
+            self.dropped += 1
+
+    async def _session(self, reader: asyncio.StreamReader) -> bool:
+        """Read until the connection ends; True if the server asked us to reconnect"""
+        skipping = False
+        while not self._stopping:
+            try:
+                raw = await asyncio.wait_for(reader.readuntil(b'\n'), self.idle_timeout)
+            except asyncio.IncompleteReadError:
+                return False
+            except asyncio.LimitOverrunError as e:
+                # an over-long line: drop what is buffered and the rest of it
+                await reader.readexactly(e.consumed)
+                skipping = True
+                continue
+            if skipping:
+                skipping = False
+                continue
+            msg = IrcMessage.parse(raw.decode('utf-8', errors='replace').rstrip('\r\n'))
+            if msg is None:
+                continue
+            if msg.command == 'PRIVMSG':
+                self._deliver(msg)
+            elif msg.command == 'PING':
+                await self._send(f"PONG :{msg.text or 'tmi.twitch.tv'}")
+            elif msg.command == 'RECONNECT':
+                return True
+            elif msg.command == 'NOTICE' and 'authentication failed' in msg.text.lower():
+                self.logger.error(f"IRC login failed: {msg.text}")
+                return False
+        return False
+
+    async def run(self):
+        """Connect and keep reading until stop(); reconnects on any failure"""
+        delay = self.backoff
+        while not self._stopping:
+            try:
+                reader, self._writer = await asyncio.open_connection(self.host, self.port, limit=1 << 16)
+                await self._handshake()
+                self.logger.info(f"Connected to {', '.join(sorted(self.channels))} on {self.host}:{self.port}")
+                delay = self.backoff
+                asked = await self._session(reader)
+                if asked:
+                    self.logger.info("Server requested reconnect")
+                    delay = 0
+            except (OSError, asyncio.TimeoutError) as e:
+                self.logger.warning(f"IRC connection error: {e}")
+            finally:
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+            if self._stopping:
+                break
+            self.reconnects += 1
+            wait = delay * (1 + random.random()) if delay else 0
+            self.logger.info(f"Reconnecting in {wait:.1f}s")
+            await asyncio.sleep(wait)
+            delay = min(self.max_backoff, max(delay * 2, self.backoff))
+
+    def stop(self):
+        self._stopping = True
+        if self._writer is not None:
+            self._writer.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> IrcMessage:
+        return await self.messages.get()
+
+
+class ChatStream:
+    """
+    Runs an IrcClient on its own event-loop thread and exposes chat as a
+    blocking iterator, so synchronous hype detection never touches the socket.
+    """
+
+    def __init__(self, channels=None, max_queue: int = 10000, **client_kwargs):
+        self.logger = logging.getLogger('chat')
+        self._q = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.client = IrcClient(channels, on_message=self._put, **client_kwargs)
+        self._loop = asyncio.new_event_loop()
+        self._thread = None
+        self._task = None
+
+    def _put(self, msg: IrcMessage):
+        try:
+            self._q.put_nowait(msg)
+        except queue.Full:
+            try:
+                self._q.get_nowait()
+            except queue.Empty:
+                pass
+            self._q.put_nowait(msg)
+            self.dropped += 1
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._task = self._loop.create_task(self.client.run())
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # end-of-stream marker; never block on a full queue no one may be reading
+            self._put(None)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="irc")
+        self._thread.start()
+        return self
+
+    def join(self, channel: str):
+        asyncio.run_coroutine_threadsafe(self.client.join(channel), self._loop)
+
+    def part(self, channel: str):
+        asyncio.run_coroutine_threadsafe(self.client.part(channel), self._loop)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def get(self, timeout: float = None):
+        """Next PRIVMSG, or None on timeout / after stop()"""
+        try:
+            return self._q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def __iter__(self):
+        while True:
+            msg = self._q.get()
+            if msg is None:
+                return
+            yield msg
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self.client.stop)
+        if self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
@@ -0,0 +1,92 @@
+import cv2
+import numpy as np
+
+
+def thumbnails(frames: list, size=(32, 18)) -> np.ndarray:
+    """(N, h, w) float32 grayscale thumbnails in [0, 1]"""
+    out = np.empty((len(frames), size[1], size[0]), dtype=np.float32)
+    for i, frame in enumerate(frames):
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        out[i] = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return out / 255.0
+
+
+def histograms(thumbs: np.ndarray, bins: int = 16) -> np.ndarray:
+    """Normalised (N, bins) intensity histograms of a thumbnail stack, in one bincount"""
+    n = len(thumbs)
+    q = np.minimum((thumbs.reshape(n, -1) * bins).astype(np.int64), bins - 1)
+    q += np.arange(n, dtype=np.int64)[:, None] * bins
+    counts = np.bincount(q.ravel(), minlength=n * bins).reshape(n, bins)
+    return counts / float(thumbs[0].size) if n else counts.astype(np.float64)
+
+
+class KeyframeSelector:
+    """
+    Picks the frames worth describing from a stream of candidates.
+
+    Every candidate is scored against the last keyframe, either by mean absolute
+    difference of downscaled grayscale thumbnails ('diff') or by L1 distance of
+    their intensity histograms ('hist'). A candidate becomes a keyframe when its
+    score reaches `threshold` and at least `min_gap` seconds passed since the
+    previous keyframe, or unconditionally after `max_gap` seconds. Candidates
+    are scored in chunks so the comparison is one NumPy expression per chunk.
+    """
+
+    def __init__(self, threshold: float = 0.12, min_gap: float = 0.5, max_gap: float = 5.0,
+                 method: str = 'diff', thumb_size=(32, 18), chunk: int = 8):
+        if method not in ('diff', 'hist'):
+            raise ValueError(f"Unknown keyframe method {method!r}")
+        self.threshold = threshold
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.method = method
+        self.thumb_size = thumb_size
+        self.chunk = max(1, chunk)
+        self.candidates = 0
+        self.selected = 0
+
+    def _features(self, frames: list) -> np.ndarray:
+        thumbs = thumbnails(frames, self.thumb_size)
+        return histograms(thumbs) if self.method == 'hist' else thumbs
+
+    def _scores(self, features: np.ndarray, ref: np.ndarray) -> np.ndarray:
+        axes = tuple(range(1, features.ndim))
+        diff = np.abs(features - ref[None])
+        # histogram L1 distance is in [0, 2]; halve it so both methods share a threshold scale
+        return diff.sum(axis=axes) / 2 if self.method == 'hist' else diff.mean(axis=axes)
+
+    def _select_chunk(self, chunk: list, fps: float, state: dict):
+        features = self._features([frame for _, frame in chunk])
+        times = np.array([idx / fps for idx, _ in chunk], dtype=np.float64)
+        i = 0
+        while i < len(chunk):
+            if state['ref'] is None:
+                pick = i
+                score = 1.0
+            else:
+                scores = self._scores(features[i:], state['ref'])
+                gaps = times[i:] - state['t']
+                eligible = ((scores >= self.threshold) & (gaps >= self.min_gap)) | (gaps >= self.max_gap)
+                hits = np.flatnonzero(eligible)
+                if not len(hits):
+                    return
+                pick = i + int(hits[0])
+                score = float(scores[hits[0]])
+            state['ref'], state['t'] = features[pick], times[pick]
+            self.selected += 1
+            idx, frame = chunk[pick]
+            yield idx, frame, score
+            i = pick + 1
+
+    def select(self, frames, fps: float):
+        """Yield (frame_idx, frame, score) keyframes from an iterable of (frame_idx, frame)"""
+        state = {'ref': None, 't': 0.0}
+        chunk = []
+        for item in frames:
+            self.candidates += 1
+            chunk.append(item)
+            if len(chunk) == self.chunk:
+                yield from self._select_chunk(chunk, fps, state)
+                chunk = []
+        if chunk:
+            yield from self._select_chunk(chunk, fps, state)
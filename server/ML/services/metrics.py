@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 disables the /metrics endpoint
+METRICS_TRACE = os.getenv("METRICS_TRACE")          # JSON-lines file of per-clip spans
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple, key: tuple, extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, key)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, '')) for n in self.labels)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, n: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def render(self) -> list:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labels, k)} {v:g}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Set directly, or computed at scrape time by `fn` (a number, or {label tuple: number})"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list:
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                return []
+            items = value.items() if isinstance(value, dict) else [((), value)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labels, k)} {v:g}" for k, v in items if v is not None]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (+Inf last), then sum
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[i] += 1
+            state[-1] += value
+
+    def render(self) -> list:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, state in items:
+            total = 0
+            for bound, n in zip(self.buckets + (float('inf'),), state):
+                total += n
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {state[-1]:g}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {total}")
+        return lines
+
+
+class Metrics:
+    """
+    Process-wide metric registry rendered in the Prometheus text format.
+
+    Pool processes keep their own registry; drain() hands over what they
+    counted since the previous call and merge() adds it to the parent's, so
+    the parent's /metrics covers work done in every process.
+    """
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+        self._drained = {}
+
+    def _get(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels=(), fn=None) -> Gauge:
+        gauge = self._get(Gauge, name, help, labels)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            body = metric.render()
+            if body:
+                lines += metric.header() + body
+        return '\n'.join(lines) + '\n'
+
+    def drain(self) -> dict:
+        """Counter and histogram increments since the last drain, as plain data"""
+        out = {}
+        with self._lock:
+            metrics = [m for m in self._metrics.values() if not isinstance(m, Gauge)]
+        for metric in metrics:
+            with metric._lock:
+                current = {k: (list(v) if isinstance(v, list) else v) for k, v in metric._values.items()}
+            previous = self._drained.get(metric.name, {})
+            delta = []
+            for key, value in current.items():
+                old = previous.get(key)
+                if isinstance(value, list):
+                    diff = [a - b for a, b in zip(value, old)] if old else value
+                    if any(diff):
+                        delta.append((key, diff))
+                elif value != (old or 0):
+                    delta.append((key, value - (old or 0)))
+            self._drained[metric.name] = current
+            if delta:
+                out[metric.name] = delta
+        return out
+
+    def merge(self, delta: dict):
+        for name, items in delta.items():
+            with self._lock:
+                metric = self._metrics.get(name)
+            if metric is None:
+                continue
+            with metric._lock:
+                for key, value in items:
+                    key = tuple(key)
+                    if isinstance(value, list):
+                        state = metric._values.setdefault(key, [0] * (len(value) - 1) + [0.0])
+                        for i, v in enumerate(value):
+                            state[i] += v
+                    else:
+                        metric._values[key] = metric._values.get(key, 0) + value
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+# ── pipeline metrics ─────────────────────────────────────────────────────────
+STAGE_SECONDS = _metrics.histogram(
+    'clippy_stage_seconds', 'Wall time per pipeline stage call', ('stage',))
+FRAMES = _metrics.counter(
+    'clippy_frames_total', 'Frames decoded / retrieved by the frame bus', ('kind',))
+CACHE_LOOKUPS = _metrics.counter(
+    'clippy_cache_lookups_total', 'Cache lookups by cache and result', ('cache', 'result'))
+CLIPS = _metrics.counter(
+    'clippy_clips_total', 'Clips through the pipeline by outcome', ('outcome',))
+CHAT_MESSAGES = _metrics.counter(
+    'clippy_chat_messages_total', 'Chat messages received', ('channel',))
+CLIP_LAG = _metrics.gauge(
+    'clippy_clip_lag_seconds', 'How far the last analysed clip ended behind live')
+
+
+@contextmanager
+def timed(stage: str):
+    """Observe the duration of the block under clippy_stage_seconds{stage=...}"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+class _Tracer:
+    """Appends one JSON line per finished span; opened lazily from $METRICS_TRACE"""
+
+    def __init__(self):
+        self._file = None
+        self._path = None
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        path = os.getenv("METRICS_TRACE", METRICS_TRACE)
+        if not path:
+            return
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._file is None or self._path != path:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._file = open(path, 'a', encoding='utf-8')
+                self._path = path
+            self._file.write(line)
+            self._file.flush()
+
+
+_tracer = _Tracer()
+
+
+@contextmanager
+def span(stage: str, clip_id: str = None, **attrs):
+    """timed() plus, when tracing is on, a trace record tied to the clip id"""
+    wall, start = time.time(), time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = repr(e)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        record = {'clip_id': clip_id, 'stage': stage, 'start': round(wall, 4), 'duration': round(elapsed, 6),
+                  'pid': os.getpid(), 'thread': threading.current_thread().name}
+        if attrs:
+            record.update(attrs)
+        if error:
+            record['error'] = error
+        _tracer.write(record)
+
+
+def _make_handler(metrics: Metrics):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0].rstrip('/') != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def serve(port: int = METRICS_PORT, host: str = "127.0.0.1"):
+    """Serve GET /metrics in a background thread; returns the server (None if port is 0)"""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _make_handler(_metrics))
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics').start()
+    logging.getLogger('main').info(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
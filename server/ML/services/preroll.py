@@ -0,0 +1,238 @@
+import os
+import mmap
+import time
+import logging
+import threading
+import subprocess
+
+import numpy as np
+
+TS_PACKET = 188
+# PIDs ffmpeg's mpegts muxer assigns: PAT, PMT, and the first (video) stream
+PAT_PID, PMT_PID, VIDEO_PID = 0x0000, 0x1000, 0x0100
+# expected ingest bitrate (bits/s); slots are sized for twice it, for bursts
+PREROLL_BITRATE = float(os.getenv("PREROLL_BITRATE", "6000000"))
+
+
+class PacketRingBuffer:
+    """
+    Rolling, memory-mapped buffer of the last N minutes of *encoded* stream.
+
+    ffmpeg remuxes the source to MPEG-TS (-c copy, no decode) and the packets are
+    written into fixed-size slots of a file-backed mmap. A new slot starts on
+    the first video keyframe after `slot_seconds` of wall-clock time (or when
+    a slot fills up, or after `max_slot_seconds` without a keyframe); the
+    oldest slot is overwritten once the ring is full, so memory/disk use is
+    slots * slot_bytes no matter how long the stream runs (slot_bytes defaults
+    to twice `bitrate` worth of a slot). Any [start, end] window still in the
+    ring can be remuxed to MP4 by piping the slots to ffmpeg; the cut is
+    widened back to the nearest slot that opens on a keyframe, so it always
+    starts decodable.
+
+    Times are wall-clock arrival times of the packets. StreamIngest feeds the
+    ring from its own ffmpeg, so they match StreamIngest.wall_time().
+    """
+
+    def __init__(self, path: str, minutes: float = 5.0, slot_seconds: float = 1.0,
+                 slot_bytes: int = None, max_slot_seconds: float = 10.0, bitrate: float = PREROLL_BITRATE):
+        self.logger = logging.getLogger('main')
+        self.path = path
+        self.slot_seconds = slot_seconds
+        self.max_slot_seconds = max(max_slot_seconds, slot_seconds)
+        slot_bytes = slot_bytes or max(64 * 1024, int(2 * bitrate / 8 * slot_seconds))
+        self.slot_bytes = slot_bytes - slot_bytes % TS_PACKET
+        self.slots = max(2, int(minutes * 60 / slot_seconds))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.truncate(self.slots * self.slot_bytes)
+        self._file = open(path, 'r+b')
+        self.mm = mmap.mmap(self._file.fileno(), self.slots * self.slot_bytes)
+        # per-slot index; start < 0 marks an empty slot
+        self.start = np.full(self.slots, -1.0, dtype=np.float64)
+        self.end = np.full(self.slots, -1.0, dtype=np.float64)
+        self.length = np.zeros(self.slots, dtype=np.int64)
+        self.key = np.zeros(self.slots, dtype=bool)  # slot opens on a video keyframe
+        self.head = 0  # slot currently being filled
+        self._psi = {}  # latest PAT / PMT packet, replayed in front of every cut
+        self.lock = threading.Lock()
+        self._proc = None
+        self._thread = None
+
+    # ── writing ───────────────────────────────────────────────────────────────
+    def _advance(self, now: float, key: bool):
+        self.head = (self.head + 1) % self.slots
+        self.start[self.head] = now
+        self.end[self.head] = now
+        self.length[self.head] = 0
+        self.key[self.head] = key
+
+    @staticmethod
+    def _scan(view) -> tuple:
+        """Packet indices of video keyframes, and the PSI packets, in whole TS packets"""
+        pkts = np.frombuffer(view, dtype=np.uint8).reshape(-1, TS_PACKET)
+        pid = ((pkts[:, 1].astype(np.uint16) & 0x1f) << 8) | pkts[:, 2]
+        adaptation = (pkts[:, 3] & 0x20) != 0
+        # random_access_indicator; ffmpeg sets it on the first packet of every key frame
+        rai = adaptation & (pkts[:, 4] > 0) & ((pkts[:, 5] & 0x40) != 0)
+        keys = np.flatnonzero(rai & (pid == VIDEO_PID))
+        psi = np.flatnonzero((pid == PAT_PID) | (pid == PMT_PID))
+        return keys, [(int(pid[i]), int(i)) for i in psi]
+
+    def _append(self, view, now: float):
+        while len(view):
+            room = self.slot_bytes - self.length[self.head]
+            if room <= 0:
+                self._advance(now, key=False)
+                continue
+            n = min(room, len(view))
+            offset = self.head * self.slot_bytes + self.length[self.head]
+            self.mm[offset:offset + n] = view[:n]
+            self.length[self.head] += n
+            self.end[self.head] = now
+            view = view[n:]
+
+    def write(self, data, now: float = None):
+        """Append whole TS packets stamped with wall-clock time `now`"""
+        now = time.time() if now is None else now
+        view = memoryview(data).cast('B')
+        keys, psi = self._scan(view)
+        with self.lock:
+            for pid, i in psi:
+                self._psi[pid] = bytes(view[i * TS_PACKET:(i + 1) * TS_PACKET])
+            if self.start[self.head] < 0:
+                self.start[self.head] = now
+                self.key[self.head] = True  # the stream's own start is decodable
+            elif now - self.start[self.head] >= self.max_slot_seconds:
+                self._advance(now, key=False)  # no keyframe in sight (audio-only, huge GOP)
+            cut = 0
+            for k in keys:
+                at = int(k) * TS_PACKET
+                if self.length[self.head] + at - cut > 0 and now - self.start[self.head] >= self.slot_seconds:
+                    self._append(view[cut:at], now)
+                    self._advance(now, key=True)
+                    cut = at
+                elif at == cut and self.length[self.head] == 0:
+                    self.key[self.head] = True
+            self._append(view[cut:], now)
+
+    def start_capture(self, url: str):
+        """Tail `url` with a stream-copy ffmpeg and fill the ring in the background"""
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-i', url,
+               '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy', '-flush_packets', '1', '-f', 'mpegts', 'pipe:1']
+        self._proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        self._thread = threading.Thread(target=self.capture, args=(self._proc.stdout,), daemon=True)
+        self._thread.start()
+        self.logger.info(
+            f"⏪ Pre-roll buffer on {url}: {self.slots} x {self.slot_bytes // 1024} KB slots "
+            f"(~{self.slots * self.slot_seconds / 60:.1f} min) in {self.path}"
+        )
+        return self
+
+    def capture(self, stream):
+        """Fill the ring from an MPEG-TS pipe until EOF (blocks; run it on a thread)"""
+        chunk = bytearray(TS_PACKET * 348)  # ~64 KB, packet aligned
+        view = memoryview(chunk)
+        filled = 0
+        while True:
+            # stamp packets as they arrive rather than once a whole chunk has filled
+            n = stream.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+            whole = filled - filled % TS_PACKET
+            if whole:
+                self.write(view[:whole])
+                view[:filled - whole] = view[whole:filled]
+                filled -= whole
+        self.logger.info("Pre-roll capture ended")
+
+    # ── reading ───────────────────────────────────────────────────────────────
+    def span(self) -> tuple:
+        """(oldest, newest) wall-clock time currently held"""
+        with self.lock:
+            used = self.start >= 0
+            if not used.any():
+                return (0.0, 0.0)
+            return float(self.start[used].min()), float(self.end[used].max())
+
+    def _slots_for(self, t0: float, t1: float) -> list:
+        order = [(self.head + 1 + i) % self.slots for i in range(self.slots)]  # oldest first
+        order = [s for s in order if self.start[s] >= 0]
+        hit = [i for i, s in enumerate(order) if self.end[s] >= t0 and self.start[s] <= t1]
+        if not hit:
+            return []
+        first = hit[0]
+        # widen back to a slot opening on a keyframe, or the cut starts undecodable
+        while first > 0 and not self.key[order[first]]:
+            first -= 1
+        return order[first:hit[-1] + 1]
+
+    def extract(self, t0: float, t1: float, output_path: str):
+        """
+        Remux the [t0, t1] wall-clock window to a fast-start MP4 without
+        re-encoding. Returns the wall-clock time the clip really starts at
+        (the keyframe at or before t0), or None if nothing was extracted.
+        """
+        with self.lock:
+            slots = [(s, float(self.start[s]), int(self.length[s])) for s in self._slots_for(t0, t1)]
+            start = slots[0][1] if slots else None
+            head = b''.join(self._psi[pid] for pid in (PAT_PID, PMT_PID) if pid in self._psi)
+        if not slots:
+            self.logger.error(f"Pre-roll buffer has nothing for {t0:.1f}-{t1:.1f}")
+            return None
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'mpegts', '-i', 'pipe:0',
+               '-c', 'copy', '-movflags', '+faststart', output_path]
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        recycled = False
+        try:
+            # the program tables first, so the demuxer can use the keyframe right behind them
+            proc.stdin.write(head)
+            for slot, slot_start, length in slots:
+                # copy one slot at a time under the lock and write it outside, so a
+                # slow ffmpeg never holds up capture; a slot the ring has reused
+                # since the snapshot holds newer packets and ends the cut
+                with self.lock:
+                    recycled = self.start[slot] != slot_start
+                    if not recycled:
+                        offset = slot * self.slot_bytes
+                        data = bytes(self.mm[offset:offset + length])
+                if recycled:
+                    break
+                proc.stdin.write(data)
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        if recycled:
+            proc.kill()
+            proc.wait()
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            self.logger.error(f"Pre-roll buffer overwrote {t0:.1f}-{t1:.1f} while extracting {output_path}")
+            return None
+        ok = proc.wait() == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0
+        if ok:
+            self.logger.info(f"✂️ Extracted {t1 - start:.1f}s from pre-roll buffer to {output_path}")
+        else:
+            self.logger.error(f"Pre-roll extraction failed for {output_path}")
+        return start if ok else None
+
+    def extract_later(self, t0: float, t1: float, output_path: str, on_done=None):
+        """
+        Extract once the buffer has caught up to t1 (post-roll), without
+        blocking the caller; on_done(path, start) gets extract()'s result.
+        """
+        def _job():
+            delay = t1 - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            start = self.extract(t0, t1, output_path)
+            if on_done:
+                on_done(output_path, start)
+        threading.Thread(target=_job, daemon=True).start()
+
+    def close(self):
+        if self._proc:
+            self._proc.kill()
+        self.mm.close()
+        self._file.close()
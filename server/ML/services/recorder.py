@@ -0,0 +1,82 @@
+import os
+import time
+import logging
+import subprocess
+
+RTMP_URL = os.getenv("RTMP_URL", "rtmp://localhost:1935/live/{key}")
+
+
+class SegmentRecorder:
+    """
+    Records a live source into `segment_seconds` MP4 segments in `clips_dir`
+    (the same stream-copy ffmpeg segmenter run.sh starts), with a CSV
+    segment list for ClipWatcher. A recorder whose ffmpeg exits - the
+    streamer went offline, the RTMP server restarted - is started again by
+    `check()`, waiting `restart_delay` seconds, doubled after every quick
+    failure up to `max_delay`.
+    """
+
+    def __init__(self, url: str, clips_dir: str, segment_seconds: float = 6.0,
+                 restart_delay: float = 5.0, max_delay: float = 60.0):
+        self.logger = logging.getLogger('main')
+        self.url = url
+        self.clips_dir = clips_dir
+        self.segment_seconds = segment_seconds
+        self.segment_list = os.path.join(clips_dir, 'segments.csv')
+        self.restart_delay = restart_delay
+        self.max_delay = max_delay
+        self.restarts = 0
+        self._delay = restart_delay
+        self._proc = None
+        self._log = None
+        self._started = 0.0
+        self._exited = None
+
+    def start(self):
+        os.makedirs(self.clips_dir, exist_ok=True)
+        if self._log is None:
+            self._log = open(os.path.join(self.clips_dir, 'ffmpeg.log'), 'ab')
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'warning', '-nostdin', '-i', self.url,
+               '-c', 'copy', '-f', 'segment', '-segment_time', f"{self.segment_seconds:g}",
+               '-reset_timestamps', '1', '-strftime', '1',
+               '-segment_list', self.segment_list, '-segment_list_type', 'csv',
+               os.path.join(self.clips_dir, 'clip_%Y%m%d_%H%M%S.mp4')]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=self._log)
+        self._started = time.monotonic()
+        self._exited = None
+        self.logger.info(f"🎥 Recording {self.url} to {self.clips_dir}")
+        return self
+
+    @property
+    def running(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def check(self) -> bool:
+        """Restart ffmpeg once it has been down for the current delay; True while recording"""
+        if self._proc is None or self.running:
+            return self._proc is not None
+        now = time.monotonic()
+        if self._exited is None:
+            self._exited = now
+            uptime = now - self._started
+            if uptime > self.max_delay:  # it had been up a while: not a crash loop
+                self._delay = self.restart_delay
+            self.logger.warning(f"Recorder for {self.url} exited with {self._proc.returncode} "
+                                f"after {uptime:.0f}s; retrying in {self._delay:.0f}s")
+        if now - self._exited >= self._delay:
+            self.restarts += 1
+            self._delay = min(self._delay * 2, self.max_delay)
+            self.start()
+        return self.running
+
+    def stop(self):
+        proc, self._proc = self._proc, None
+        if proc is not None and proc.poll() is None:
+            proc.terminate()  # lets the segment muxer close the current segment
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
@@ -0,0 +1,361 @@
+import re
+import json
+import time
+import base64
+import random
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+
+import cv2
+import numpy as np
+
+from services.metrics import CACHE_LOOKUPS, STAGE_SECONDS
+
+SCENE_MODEL = "internvl2.5-latest"
+SCENE_PROMPT = "这张照片上发生了什么？请用英语说出来，字数控制在10个字以内。"
+BATCH_PROMPT = (
+    "这是直播中按时间顺序排列的{n}张照片。请用英语分别说出每张照片上发生了什么，"
+    "每条字数控制在10个字以内。只返回一个包含{n}个字符串的JSON数组。"
+)
+
+
+def dhash(frame: np.ndarray, size: int = 8) -> int:
+    """64-bit difference hash; near-identical frames land within a few bits"""
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def nearest(keys, key: int, max_distance: int):
+    """The hash among `keys` closest to `key`, if within `max_distance` bits"""
+    best, best_d = None, max_distance + 1
+    for h in keys:
+        d = bin(h ^ key).count('1')
+        if d < best_d:
+            best, best_d = h, d
+            if d == 0:
+                break
+    return best
+
+
+class PerceptualCache:
+    """LRU of frame hash -> description, matched by Hamming distance"""
+
+    def __init__(self, capacity: int = 256, max_distance: int = 6):
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: int):
+        with self._lock:
+            best = nearest(self._items, key, self.max_distance)
+            if best is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache='scene', result='miss')
+                return None
+            self._items.move_to_end(best)
+            self.hits += 1
+            CACHE_LOOKUPS.inc(cache='scene', result='hit')
+            return self._items[best]
+
+    def put(self, key: int, value: str):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second with bursts up to `burst`"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def downscale(frame: np.ndarray, max_edge: int = None) -> np.ndarray:
+    """Shrink so the longest side is at most `max_edge` (never upscales)"""
+    h, w = frame.shape[:2]
+    if not max_edge or max(h, w) <= max_edge:
+        return frame
+    scale = max_edge / max(h, w)
+    return cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def encode_jpeg(frame: np.ndarray, quality: int = 85, max_edge: int = None) -> str:
+    frame = downscale(frame, max_edge)
+    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return "data:image/jpeg;base64," + base64.b64encode(buffer).decode('utf-8')
+
+
+def parse_batch(text: str, n: int):
+    """Pull n descriptions out of a multi-image answer; None if it does not have exactly n"""
+    match = re.search(r"\[.*\]", text or "", re.S)
+    if match:
+        try:
+            items = json.loads(match.group(0))
+            if isinstance(items, list) and len(items) == n:
+                return [str(item).strip() for item in items]
+        except ValueError:
+            pass
+    # fall back to one numbered / bulleted line per frame
+    lines = [re.sub(r"^\s*(?:\d+[.):]|[-*•])\s*", "", l).strip() for l in (text or "").splitlines()]
+    lines = [l for l in lines if l]
+    return lines if len(lines) == n else None
+
+
+class SceneClient:
+    """
+    Vision-LLM scene descriptions with one pooled async HTTP client.
+
+    Requests are paced by a token bucket, capped by a semaphore, retried with
+    exponential backoff and jitter, and frames whose perceptual hash is close to
+    one already described are answered from an LRU cache - or, while that
+    description is still being fetched, wait for the request in flight instead
+    of sending their own. Frames are downscaled to `max_edge` before encoding,
+    and describe_batch() packs several into one multi-image request. The client owns its own event loop thread, so
+    synchronous analyzer threads can share it.
+    """
+
+    def __init__(self, base_url: str, api_key: str, model: str = SCENE_MODEL, prompt: str = SCENE_PROMPT,
+                 rate: float = 4.0, burst: int = 4, concurrency: int = 4, max_retries: int = 3,
+                 timeout: float = 30.0, cache_size: int = 256, cache_distance: int = 6,
+                 max_edge: int = 512, quality: int = 80):
+        self.logger = logging.getLogger('intern')
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.prompt = prompt
+        self.rate, self.burst = rate, burst
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_edge = max_edge
+        self.quality = quality
+        self.cache = PerceptualCache(cache_size, cache_distance)
+        self._inflight = {}  # frame hash -> Future of its description; event loop only
+        self.deduped = 0
+        self.requests = 0
+        self.failures = 0
+        self.images = 0
+        self.upload_bytes = 0
+        self.latencies = deque(maxlen=1024)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._ready = asyncio.run_coroutine_threadsafe(self._setup(), self._loop)
+        self._ready.result()
+
+    async def _setup(self):
+        import httpx
+        from openai import AsyncOpenAI
+        http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            timeout=self.timeout,
+        )
+        # retries are ours (with jitter and the shared rate limit), not the SDK's
+        self.client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, http_client=http, max_retries=0)
+        self.bucket = TokenBucket(self.rate, self.burst)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    # ── async API ─────────────────────────────────────────────────────────────
+    async def _request(self, content: list) -> str:
+        delay = 0.5
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            async with self.semaphore:
+                start = time.perf_counter()
+                try:
+                    rsp = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[{"role": "user", "content": content}],
+                    )
+                    elapsed = time.perf_counter() - start
+                    self.latencies.append(elapsed)
+                    STAGE_SECONDS.observe(elapsed, stage='llm')
+                    self.requests += 1
+                    return rsp.choices[0].message.content
+                except Exception as e:
+                    status = getattr(e, 'status_code', None)
+                    retryable = status is None or status == 429 or status >= 500
+                    if not retryable or attempt == self.max_retries:
+                        self.failures += 1
+                        raise
+                    self.logger.warning(f"Scene request failed ({e}), retry {attempt + 1}/{self.max_retries}")
+            await asyncio.sleep(delay * (1 + random.random()))
+            delay *= 2
+
+    def _images(self, frames: list) -> list:
+        urls = [encode_jpeg(f, self.quality, self.max_edge) for f in frames]
+        self.images += len(urls)
+        self.upload_bytes += sum(len(u) for u in urls)
+        return [{"type": "image_url", "image_url": {"url": u}} for u in urls]
+
+    def _join(self, key: int):
+        """Future of the request in flight for a near-identical frame, if any"""
+        match = nearest(self._inflight, key, self.cache.max_distance)
+        if match is None:
+            return None
+        self.deduped += 1
+        return self._inflight[match]
+
+    def _claim(self, key: int) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        return fut
+
+    def _settle(self, key: int, fut: asyncio.Future, text: str = None, error: BaseException = None):
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+        if isinstance(error, asyncio.CancelledError):
+            fut.cancel()
+        elif error is not None:
+            fut.set_exception(error)
+            fut.exception()  # frames waiting on it re-raise it; no one else has to look
+        else:
+            self.cache.put(key, text)
+            fut.set_result(text)
+
+    async def _await_joined(self, frame: np.ndarray, pending: asyncio.Future) -> str:
+        """
+        Wait for a request another caller owns. If that caller is cancelled
+        (its clip hit the deadline) the request is dropped with it, and this
+        frame is described again rather than losing its description.
+        """
+        try:
+            return await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise  # this waiter itself was cancelled
+        return await self.describe(frame)
+
+    async def _describe_uncached(self, frame: np.ndarray, key: int, fut: asyncio.Future = None) -> str:
+        fut = fut or self._claim(key)
+        try:
+            text = await self._request([{"type": "text", "text": self.prompt}] + self._images([frame]))
+        except BaseException as e:
+            self._settle(key, fut, error=e)
+            raise
+        self._settle(key, fut, text)
+        return text
+
+    async def describe(self, frame: np.ndarray) -> str:
+        key = dhash(frame)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        pending = self._join(key)
+        if pending is not None:
+            return await self._await_joined(frame, pending)
+        return await self._describe_uncached(frame, key)
+
+    async def describe_batch(self, frames: list) -> list:
+        """
+        Describe several frames with a single multi-image request. Cached frames,
+        and frames near-identical to one already in flight (in this batch or
+        another request), are left out of the request; if the answer cannot be
+        split into one description per frame, the misses are described one by
+        one instead.
+        """
+        keys = [dhash(f) for f in frames]
+        out = [self.cache.get(k) for k in keys]
+        waiting, claimed = {}, {}
+        for i, text in enumerate(out):
+            if text is None:
+                pending = self._join(keys[i])
+                if pending is not None:
+                    waiting[i] = pending
+                else:
+                    claimed[i] = self._claim(keys[i])
+        misses = list(claimed)
+        if len(misses) == 1:
+            i = misses[0]
+            out[i] = await self._describe_uncached(frames[i], keys[i], claimed[i])
+        elif misses:
+            content = [{"type": "text", "text": BATCH_PROMPT.format(n=len(misses))}]
+            content += self._images([frames[i] for i in misses])
+            try:
+                texts = parse_batch(await self._request(content), len(misses))
+            except BaseException as e:
+                for i in misses:
+                    self._settle(keys[i], claimed[i], error=e)
+                raise
+            if texts is None:
+                self.logger.warning(f"Could not split a {len(misses)}-image answer, describing frames singly")
+                texts = await asyncio.gather(*(self._describe_uncached(frames[i], keys[i], claimed[i])
+                                               for i in misses))
+            else:
+                for i, text in zip(misses, texts):
+                    self._settle(keys[i], claimed[i], text)
+            for i, text in zip(misses, texts):
+                out[i] = text
+        for i, pending in waiting.items():
+            out[i] = await self._await_joined(frames[i], pending)
+        return out
+
+    async def describe_many(self, frames: list) -> list:
+        """Descriptions in input order; failed frames come back as exceptions"""
+        return await asyncio.gather(*(self.describe(f) for f in frames), return_exceptions=True)
+
+    # ── sync API for worker threads ───────────────────────────────────────────
+    def submit(self, frame: np.ndarray):
+        """Schedule one description; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(self.describe(frame), self._loop)
+
+    def submit_batch(self, frames: list):
+        """Schedule one multi-image request; the Future resolves to a list of descriptions"""
+        return asyncio.run_coroutine_threadsafe(self.describe_batch(frames), self._loop)
+
+    def describe_frames(self, frames: list) -> list:
+        return asyncio.run_coroutine_threadsafe(self.describe_many(frames), self._loop).result()
+
+    def stats(self) -> dict:
+        lat = sorted(self.latencies)
+        pct = lambda p: lat[min(len(lat) - 1, int(p * len(lat)))] if lat else 0.0
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "images": self.images,
+            "upload_kb": round(self.upload_bytes / 1024, 1),
+            "cache_hits": self.cache.hits,
+            "cache_hit_rate": round(self.cache.hit_rate, 3),
+            "deduped": self.deduped,
+            "latency_p50": round(pct(0.50), 4),
+            "latency_p95": round(pct(0.95), 4),
+        }
+
+    def close(self):
+        async def _close():
+            await self.client.close()
+        asyncio.run_coroutine_threadsafe(_close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,177 @@
+import os
+import time
+import logging
+from collections import deque
+
+from services.metrics import CLIPS, CLIP_LAG, get_metrics
+
+
+class AnalysisPlan:
+    """Which analyzers run on a clip, and how densely emotion is sampled"""
+
+    __slots__ = ('level', 'emotion_every', 'scene', 'transcript')
+
+    def __init__(self, level: int = 0, emotion_every: int = 10, scene: bool = True, transcript: bool = True):
+        self.level = level
+        self.emotion_every = emotion_every
+        self.scene = scene
+        self.transcript = transcript
+
+    def __repr__(self):
+        return (f"AnalysisPlan(level={self.level}, emotion_every={self.emotion_every}, "
+                f"scene={self.scene}, transcript={self.transcript})")
+
+
+FULL_PLAN = AnalysisPlan()
+# each level sheds a bit more work; one past the last, clips outside hype are skipped
+DEGRADATION = (
+    FULL_PLAN,
+    AnalysisPlan(1, emotion_every=30),
+    AnalysisPlan(2, emotion_every=30, scene=False),
+    AnalysisPlan(3, emotion_every=30, scene=False, transcript=False),
+)
+HYPE_ONLY = len(DEGRADATION)
+
+
+class _Scheduled:
+    __slots__ = ('path', 'clip_id', 'live_end', 'plan', 'future', 'status')
+
+    def __init__(self, path: str, clip_id: str, live_end: float):
+        self.path = path
+        self.clip_id = clip_id
+        self.live_end = live_end
+        self.plan = None
+        self.future = None
+        self.status = 'running'
+
+
+class ClipScheduler:
+    """
+    Admits segments into a ClipExecutor so the pipeline stays near live.
+
+    Every clip gets a deadline of `budget` seconds after it ended live (its
+    file's mtime); analyzers still running then are cancelled. At most
+    `max_backlog` clips are outstanding - when full, the oldest clip that has
+    not started yet is dropped in favour of the new one. How far behind live
+    clips finish sets a degradation level: above `high` x budget the level
+    rises (at most once per segment), below `low` x budget for `recover`
+    clips in a row it falls. Levels lower the emotion sample rate, then drop
+    scene descriptions, then transcripts, and finally skip clips that are not
+    in a hype moment. With `metrics=False` the process-wide gauges are left
+    to the caller (one scheduler per stream reports under a stream label).
+    Transcripts are fed to the stream's `transcriber` in segment order.
+    """
+
+    def __init__(self, executor, segment_seconds: float = 6.0, budget: float = None, max_backlog: int = None,
+                 high: float = 0.75, low: float = 0.4, recover: int = 3, in_hype=None,
+                 metrics: bool = True, transcriber=None):
+        self.logger = logging.getLogger('main')
+        self.executor = executor
+        self.segment_seconds = segment_seconds
+        self.budget = budget if budget is not None else 2 * segment_seconds
+        self.max_backlog = max_backlog or executor.workers + 2
+        self.high = high
+        self.low = low
+        self.recover = recover
+        self.in_hype = in_hype or (lambda: False)
+        self.transcriber = transcriber
+        self.level = 0
+        self.last_lag = 0.0
+        self.queue = deque()
+        self._calm = 0
+        self._changed = 0.0
+        if metrics:
+            get_metrics().gauge('clippy_degradation_level', 'Current load-shedding level of the clip scheduler',
+                                fn=lambda: self.level)
+            get_metrics().gauge('clippy_clip_backlog', 'Clips submitted but not finished', fn=self.outstanding)
+
+    def outstanding(self) -> int:
+        return sum(1 for item in self.queue if item.status == 'running')
+
+    def _lag(self, now: float) -> float:
+        # how late the last clip finished, or the oldest unfinished one already is;
+        # with nothing in flight the pipeline has caught up
+        oldest = next((item for item in self.queue if item.status == 'running'), None)
+        return max(self.last_lag, now - oldest.live_end) if oldest else 0.0
+
+    def lag(self, now: float = None) -> float:
+        """Seconds behind live: the last finished clip, or the oldest one still in analysis"""
+        return self._lag(time.time() if now is None else now)
+
+    def _adjust(self, now: float):
+        lag = self._lag(now)
+        backlog = self.outstanding()
+        if lag > self.high * self.budget or backlog > self.executor.workers:
+            self._calm = 0
+            if self.level < HYPE_ONLY and now - self._changed >= self.segment_seconds:
+                self.level += 1
+                self._changed = now
+                self.logger.warning(f"Falling behind ({lag:.1f}s, {backlog} queued): degradation level {self.level}")
+        elif lag < self.low * self.budget and backlog < self.executor.workers:
+            self._calm += 1
+            if self.level and self._calm >= self.recover:
+                self.level -= 1
+                self._calm = 0
+                self._changed = now
+                self.logger.info(f"Caught up ({lag:.1f}s behind): degradation level {self.level}")
+        else:
+            self._calm = 0
+
+    def _shed_oldest(self) -> bool:
+        for item in self.queue:
+            if item.status == 'running' and item.future is not None and item.future.cancel():
+                item.status = 'shed'
+                CLIPS.inc(outcome='shed')
+                self.logger.warning(f"Backlog full: dropped {item.clip_id} before it started")
+                return True
+        return False
+
+    def submit(self, path: str, clip_id: str, analyze: bool = True, live_end: float = None):
+        """
+        Queue a closed segment; returns its AnalysisPlan, or None if it is not
+        analysed. analyze=False only keeps its place in segment order; a
+        `live_end` overrides the file's mtime as the base of the deadline.
+        """
+        now = time.time()
+        item = _Scheduled(path, clip_id, os.path.getmtime(path) if live_end is None else live_end)
+        self.queue.append(item)
+        if not analyze:
+            item.status = 'gated'
+            return None
+        self._adjust(now)
+        if self.level >= HYPE_ONLY and not self.in_hype():
+            item.status = 'skipped'
+            CLIPS.inc(outcome='skipped')
+            self.logger.info(f"Overloaded: skipping {clip_id} outside a hype moment")
+            return None
+        if self.outstanding() > self.max_backlog and not self._shed_oldest():
+            item.status = 'shed'
+            CLIPS.inc(outcome='shed')
+            self.logger.warning(f"Backlog full: dropped {clip_id}")
+            return None
+        item.plan = DEGRADATION[min(self.level, len(DEGRADATION) - 1)]
+        item.future = self.executor.submit(path, clip_id, plan=item.plan, deadline=item.live_end + self.budget,
+                                           transcriber=self.transcriber)
+        return item.plan
+
+    def finished(self):
+        """
+        Yield (path, clip_id, plan, completed) in segment order for clips that
+        are done; plan is None if not analysed, and `completed` holds the parts
+        that ran to the end in time ('transcript' if its transcript did)
+        """
+        while self.queue:
+            item = self.queue[0]
+            if item.status == 'running' and not self.executor.is_done(item.clip_id):
+                return
+            self.queue.popleft()
+            completed = frozenset()
+            if item.future is not None:
+                completed = self.executor.completed(item.clip_id)
+                self.executor.wait(item.clip_id, 0)
+            if item.status != 'running':
+                yield item.path, item.clip_id, None, completed
+                continue
+            self.last_lag = time.time() - item.live_end
+            CLIP_LAG.set(self.last_lag)
+            yield item.path, item.clip_id, item.plan, completed
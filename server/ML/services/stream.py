@@ -0,0 +1,265 @@
+import os
+import time
+import logging
+import threading
+import subprocess
+
+import numpy as np
+
+AUDIO_RATE = 16000  # what Whisper expects
+
+
+def _read_exact_into(stream, view) -> bool:
+    """Fill a writable memoryview from a pipe; False on EOF"""
+    filled = 0
+    while filled < len(view):
+        n = stream.readinto(view[filled:])
+        if not n:
+            return False
+        filled += n
+    return True
+
+
+class FrameRing:
+    """
+    Preallocated circular buffer of decoded frames indexed by stream time.
+    The decoder fills a scratch frame outside the lock; commit() copies it
+    into the ring under the lock, so window() never sees a half-written frame.
+    """
+
+    def __init__(self, capacity: int, height: int, width: int, channels: int = 3):
+        self.capacity = capacity
+        self.frames = np.zeros((capacity, height, width, channels), dtype=np.uint8)
+        self.times = np.full(capacity, -1.0, dtype=np.float64)
+        self.walls = np.zeros(capacity, dtype=np.float64)  # wall-clock arrival of each frame
+        self.count = 0  # total frames ever written
+        self.lock = threading.Lock()
+        self._scratch = np.zeros((height, width, channels), dtype=np.uint8)
+
+    def slot(self) -> np.ndarray:
+        """Buffer the next frame should be decoded into (then commit() it)"""
+        return self._scratch
+
+    def commit(self, t: float, wall: float = None):
+        with self.lock:
+            i = self.count % self.capacity
+            self.frames[i] = self._scratch
+            self.times[i] = t
+            self.walls[i] = time.time() if wall is None else wall
+            self.count += 1
+
+    def wall_at(self, t: float):
+        """Arrival time of the buffered frame nearest `t`, shifted to `t`; None if empty"""
+        with self.lock:
+            if not self.count:
+                return None
+            valid = self.times >= 0
+            i = int(np.argmin(np.where(valid, np.abs(self.times - t), np.inf)))
+            return float(self.walls[i] + (t - self.times[i]))
+
+    @property
+    def latest_time(self) -> float:
+        return self.times[(self.count - 1) % self.capacity] if self.count else 0.0
+
+    def window(self, t0: float, t1: float, step: int = 1) -> list:
+        """Copies of (frame_no, time, frame) with t0 <= time < t1, oldest first"""
+        with self.lock:
+            first = max(0, self.count - self.capacity)
+            out = []
+            for n in range(first, self.count, step):
+                t = self.times[n % self.capacity]
+                if t0 <= t < t1:
+                    out.append((n, t, self.frames[n % self.capacity].copy()))
+            return out
+
+
+class AudioRing:
+    """Circular float32 PCM buffer (16 kHz mono) indexed by stream time"""
+
+    def __init__(self, seconds: float, rate: int = AUDIO_RATE):
+        self.rate = rate
+        self.capacity = int(seconds * rate)
+        self.samples = np.zeros(self.capacity, dtype=np.float32)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def write(self, pcm: np.ndarray):
+        with self.lock:
+            n = len(pcm)
+            if n >= self.capacity:
+                pcm, n = pcm[-self.capacity:], self.capacity
+            start = self.count % self.capacity
+            first = min(n, self.capacity - start)
+            self.samples[start:start + first] = pcm[:first]
+            self.samples[:n - first] = pcm[first:]
+            self.count += n
+
+    @property
+    def latest_time(self) -> float:
+        return self.count / self.rate
+
+    def window(self, t0: float, t1: float) -> np.ndarray:
+        with self.lock:
+            lo = max(int(t0 * self.rate), self.count - self.capacity, 0)
+            hi = min(int(t1 * self.rate), self.count)
+            if hi <= lo:
+                return np.zeros(0, dtype=np.float32)
+            idx = np.arange(lo, hi) % self.capacity
+            return self.samples[idx]
+
+
+class WindowFrames:
+    """FrameBus-subscription look-alike over frames cut from the ring"""
+
+    def __init__(self, frames: list, fps: float):
+        self.fps = fps
+        self._frames = frames
+
+    def __iter__(self):
+        for n, _, frame in self._frames:
+            yield n, frame
+
+    def __len__(self):
+        return len(self._frames)
+
+
+def has_audio(url: str) -> bool:
+    """Whether the source has an audio stream (assumed, if ffprobe cannot tell)"""
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'a', '-show_entries', 'stream=index', '-of', 'csv=p=0', url]
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return True
+    return out.returncode != 0 or bool(out.stdout.strip())
+
+
+class StreamIngest:
+    """
+    Reads decoded frames and PCM audio straight from an ffmpeg-readable source
+    (rtmp://localhost:1935/live/<key>, a file, a pipe) into ring buffers.
+
+    One ffmpeg demuxes the source once and writes both outputs - raw frames
+    on stdout, PCM on a second pipe - so video and audio share one clock and
+    one connection to the server. Frames are scaled and decimated by ffmpeg
+    itself, so the ring only ever holds what the analyzers use. For local
+    testing, pass a file with realtime=True and ffmpeg paces it with -re
+    like a live stream.
+
+    Given a PacketRingBuffer as `preroll`, the same ffmpeg also remuxes the
+    source to MPEG-TS for it, so highlights are cut from the packets that
+    were analysed, stamped on the same arrival clock as wall_time().
+    """
+
+    def __init__(self, url: str, width: int = 640, height: int = 360, fps: float = 10.0,
+                 buffer_seconds: float = 120.0, realtime: bool = False, preroll=None):
+        self.logger = logging.getLogger('main')
+        self.url = url
+        self.width, self.height, self.fps = width, height, fps
+        self.realtime = realtime
+        self.preroll = preroll
+        self.frames = FrameRing(int(buffer_seconds * fps), height, width)
+        self.audio = AudioRing(buffer_seconds)
+        self.started_at = None
+        self.started_wall = None
+        self._proc = None
+        self._threads = []
+        self.finished = threading.Event()
+
+    def start(self):
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin']
+        if self.realtime:
+            cmd.append('-re')
+        cmd += ['-i', self.url,
+                # fit the source inside width x height and pad the rest, so faces
+                # keep their proportions whatever the source's aspect ratio
+                '-map', '0:v:0', '-vf', f'fps={self.fps},scale={self.width}:{self.height}'
+                ':force_original_aspect_ratio=decrease,'
+                f'pad={self.width}:{self.height}:(ow-iw)/2:(oh-ih)/2,setsar=1',
+                '-pix_fmt', 'bgr24', '-f', 'rawvideo', 'pipe:1']
+        readers, fds = [], []
+        if has_audio(self.url):
+            # the second output goes to a pipe of its own, inherited by ffmpeg as pipe:<fd>
+            read_fd, write_fd = os.pipe()
+            fds.append(write_fd)
+            cmd += ['-map', '0:a:0', '-ac', '1', '-ar', str(AUDIO_RATE), '-f', 's16le', f'pipe:{write_fd}']
+            readers.append((self._read_audio, os.fdopen(read_fd, 'rb', buffering=0)))
+        else:
+            self.logger.warning(f"{self.url} has no audio; transcripts will be empty")
+        if self.preroll is not None:
+            read_fd, write_fd = os.pipe()
+            fds.append(write_fd)
+            cmd += ['-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy', '-flush_packets', '1',
+                    '-f', 'mpegts', f'pipe:{write_fd}']
+            readers.append((self._read_packets, os.fdopen(read_fd, 'rb', buffering=0)))
+        self._proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0,
+                                      pass_fds=fds)
+        for fd in fds:
+            os.close(fd)  # ffmpeg holds the write ends now; EOF reaches us when it exits
+        self.started_at = time.monotonic()
+        self.started_wall = time.time()
+        for target, stream in [(self._read_video, self._proc.stdout)] + readers:
+            t = threading.Thread(target=target, args=(stream,), daemon=True)
+            t.start()
+            self._threads.append(t)
+        self.logger.info(f"📡 Streaming ingest from {self.url} ({self.width}x{self.height}@{self.fps}fps)")
+        return self
+
+    def _read_video(self, stream):
+        n = 0
+        try:
+            while True:
+                slot = self.frames.slot()
+                if not _read_exact_into(stream, memoryview(slot).cast('B')):
+                    break
+                self.frames.commit(n / self.fps)
+                n += 1
+        finally:
+            self.logger.info(f"Video ingest ended after {n} frames")
+            self.finished.set()
+
+    def _read_audio(self, stream):
+        chunk = bytearray(AUDIO_RATE // 10 * 2)  # 100 ms of s16le
+        view = memoryview(chunk)
+        try:
+            while _read_exact_into(stream, view):
+                pcm = np.frombuffer(chunk, dtype=np.int16).astype(np.float32) / 32768.0
+                self.audio.write(pcm)
+        finally:
+            stream.close()
+
+    def _read_packets(self, stream):
+        try:
+            self.preroll.capture(stream)
+        finally:
+            stream.close()
+
+    @property
+    def live_time(self) -> float:
+        """Stream time of the newest frame in the ring"""
+        return self.frames.latest_time
+
+    def wall_time(self, stream_time: float) -> float:
+        """
+        Map a stream timestamp to wall-clock time (for the pre-roll buffer
+        index) through the arrival time of the nearest buffered frame, so it
+        holds when ingest stalls, bursts or reads a file faster than realtime.
+        """
+        wall = self.frames.wall_at(stream_time)
+        if wall is None:
+            return (self.started_wall or time.time()) + stream_time
+        return wall
+
+    def lag(self) -> float:
+        """Seconds the ingest is behind wall clock (0 when reading a file as fast as possible)"""
+        if self.started_at is None:
+            return 0.0
+        return max(0.0, (time.monotonic() - self.started_at) - self.live_time)
+
+    def window(self, t0: float, t1: float, step: int = 1) -> WindowFrames:
+        # frame numbers stay on the ingest clock, so idx / fps is stream time
+        return WindowFrames(self.frames.window(t0, t1, step), self.fps)
+
+    def stop(self):
+        if self._proc is not None:
+            self._proc.kill()
+        self.finished.set()
@@ -1,32 +1,239 @@
-import whisper
 import os
 import logging
+import threading
+import subprocess
 from datetime import datetime
 
+import numpy as np
 
-def transcribe_video(video_path, event_q=None):
-    logger = logging.getLogger('transcript')
-    model = whisper.load_model("base")
-    result = model.transcribe(video_path)
-    
-    # Process segments with timestamps if available
-    if "segments" in result:
-        for segment in result["segments"]:
-            timestamp = str(int(segment["start"]))  # Get timestamp in seconds
+from services.models import get_registry
+from services.metrics import timed
+
+AUDIO_RATE = 16000
+
+
+def extract_audio(video_path: str) -> np.ndarray:
+    """Decode only the audio track, straight to 16 kHz mono float32"""
+    cmd = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', video_path,
+           '-vn', '-ac', '1', '-ar', str(AUDIO_RATE), '-f', 's16le', 'pipe:1']
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    return np.frombuffer(out, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def speech_ratio(audio: np.ndarray, frame_ms: int = 30, threshold_db: float = -40.0) -> float:
+    """Fraction of short frames whose RMS energy is above `threshold_db` dBFS"""
+    frame = AUDIO_RATE * frame_ms // 1000
+    n = len(audio) // frame
+    if n == 0:
+        return 0.0
+    frames = audio[:n * frame].reshape(n, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1) + 1e-12)
+    return float(np.mean(20 * np.log10(rms) > threshold_db))
+
+
+class IncrementalTranscriber:
+    """
+    Stateful Whisper transcription over consecutive audio chunks.
+
+    Each chunk is transcribed together with the last `overlap` seconds of the
+    previous one, with the previous text as the prompt, so words cut at a
+    segment boundary are recovered. Segments are stamped with absolute stream
+    time and only emitted once (anything ending before what was already emitted
+    is dropped). With `vad` on, chunks that are mostly silence skip Whisper.
+
+    One transcriber belongs to one stream and must be fed its chunks in
+    order; a chunk that starts before the previous one ended, or more than
+    `max_gap` seconds after it, resets the context. It pickles without its
+    lock and registry, so its state can travel to a pool process and back
+    (see ClipExecutor).
+    """
+
+    def __init__(self, overlap: float = 1.5, max_window: float = 30.0, vad: bool = True,
+                 vad_threshold_db: float = -40.0, min_speech: float = 0.1, prompt_chars: int = 200,
+                 max_gap: float = 30.0, registry=None):
+        self.logger = logging.getLogger('transcript')
+        self.registry = registry or get_registry()
+        self.overlap = overlap
+        self.max_window = max_window
+        self.vad = vad
+        self.vad_threshold_db = vad_threshold_db
+        self.min_speech = min_speech
+        self.prompt_chars = prompt_chars
+        self.max_gap = max_gap
+        self.windows = 0
+        self.skipped = 0
+        self.resets = 0
+        self._reset()
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('lock', 'registry', 'logger'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger('transcript')
+        self.registry = get_registry()
+        self.lock = threading.Lock()
+
+    def _reset(self):
+        self.prompt, self.last_text = "", ""
+        self.last_end = float('-inf')
+        self.next_start = None  # where the next chunk is expected to begin
+        self._tail, self._tail_start = np.zeros(0, dtype=np.float32), None
+
+    def reset(self):
+        with self.lock:
+            self._reset()
+
+    def restore(self, other: 'IncrementalTranscriber'):
+        """Take over the context of a copy that was fed elsewhere (a pool process)"""
+        with self.lock:
+            state = other.__getstate__()
+            state.pop('lock', None)
+            self.__dict__.update(state)
+
+    def _window(self, audio: np.ndarray, start: float) -> tuple:
+        """(window, window_start) to transcribe for the chunk; keeps its tail for the next one"""
+        expected, self.next_start = self.next_start, start + len(audio) / AUDIO_RATE
+        if expected is not None and not -1.0 < start - expected <= self.max_gap:
+            # time ran backwards (new stream, new VOD) or jumped: old context would drop segments
+            self.logger.info(f"Transcript context reset: chunk at {start:.1f}s, expected {expected:.1f}s")
+            self.resets += 1
+            self._reset()
+            self.next_start = start + len(audio) / AUDIO_RATE
+        tail_end = None if self._tail_start is None else self._tail_start + len(self._tail) / AUDIO_RATE
+        if tail_end is not None and abs(tail_end - start) < 1.0:  # segment mtimes jitter
+            window = np.concatenate([self._tail, audio])
+        else:  # first chunk, or a gap in the stream: no stitching possible
+            window = audio
+        window = window[-int(self.max_window * AUDIO_RATE):]
+        window_start = start + len(audio) / AUDIO_RATE - len(window) / AUDIO_RATE
+
+        keep = int(self.overlap * AUDIO_RATE)
+        self._tail = window[-keep:].copy() if keep else np.zeros(0, dtype=np.float32)
+        self._tail_start = window_start + (len(window) - len(self._tail)) / AUDIO_RATE
+        return window, window_start
+
+    def advance(self, audio: np.ndarray, start: float, segments: list):
+        """
+        Take a chunk that was transcribed before (replayed from the cache) into
+        the context as if it had been fed: its audio tail and its `segments`
+        (stream-time start / end / text) become what the next chunk stitches to.
+        """
+        with self.lock:
+            self._window(audio, start)
+            for segment in segments:
+                self.last_end = max(self.last_end, segment["end"])
+                self.last_text = segment["text"]
+                self.prompt = (self.prompt + " " + segment["text"])[-self.prompt_chars:]
+
+    def feed(self, audio: np.ndarray, start: float) -> list:
+        """Transcribe a chunk that begins at stream time `start`; returns new segments"""
+        with self.lock:
+            window, window_start = self._window(audio, start)
+            self.windows += 1
+            if len(window) < AUDIO_RATE // 4:
+                return []
+            if self.vad and speech_ratio(audio, threshold_db=self.vad_threshold_db) < self.min_speech:
+                self.skipped += 1
+                self.logger.debug(f"Skipping silent window at {start:.1f}s")
+                return []
+
+            with timed('transcribe'):
+                result = self.registry.transcribe(
+                    window,
+                    initial_prompt=self.prompt[-self.prompt_chars:] or None,
+                    condition_on_previous_text=False,
+                )
+            return self._stitch(result.get("segments", []), window_start)
+
+    def _stitch(self, segments: list, window_start: float) -> list:
+        out = []
+        for segment in segments:
             text = segment["text"].strip()
-            
-            if event_q:
-                event_q.put({
-                    "type": "transcript",
-                    "timestamp": datetime.now(),
-                    "text": text,
-                    "video_timestamp": timestamp
-                })
-            else:
-                logger.info(f"Timestamp: {timestamp}s")
-                logger.info(f"Transcript: {text}")
-    
-    return result["text"]
+            seg_start = window_start + segment["start"]
+            seg_end = window_start + segment["end"]
+            if not text or seg_end <= self.last_end + 0.1:
+                continue
+            # overlaps what we already emitted: only keep it if it says something new
+            if seg_start < self.last_end and text.lower() in self.last_text.lower():
+                continue
+            out.append({"start": seg_start, "end": seg_end, "text": text})
+            self.last_end = seg_end
+            self.last_text = text
+            self.prompt = (self.prompt + " " + text)[-self.prompt_chars:]
+        return out
+
+
+def transcribe_audio(audio, start: float, event_q=None, transcriber=None, clip_start: float = None) -> str:
+    """
+    Feed one chunk to the stream's transcriber and publish `transcript`
+    events; without one the chunk is transcribed on its own, with no context.
+    """
+    logger = logging.getLogger('transcript')
+    transcriber = transcriber or IncrementalTranscriber()
+    clip_start = start if clip_start is None else clip_start
+    segments = transcriber.feed(audio, start)
+    for segment in segments:
+        timestamp = str(int(max(0.0, segment["start"] - clip_start)))  # seconds into the clip
+        if event_q:
+            event_q.put({
+                "type": "transcript",
+                "timestamp": datetime.now(),
+                "text": segment["text"],
+                "video_timestamp": timestamp,
+                "stream_time": segment["start"],
+                "stream_end": segment["end"],
+                # where it is in the clip, so a cached copy can be placed wherever the clip recurs
+                "clip_time": segment["start"] - clip_start,
+                "clip_end": segment["end"] - clip_start,
+            })
+        else:
+            logger.info(f"Timestamp: {timestamp}s")
+            logger.info(f"Transcript: {segment['text']}")
+    return " ".join(s["text"] for s in segments)
+
+
+def _clip_start(video_path, audio) -> float:
+    # segments are closed when they end, so the clip began one duration before its mtime
+    return os.path.getmtime(video_path) - len(audio) / AUDIO_RATE
+
+
+def replay_transcript(video_path, events: list, event_q, transcriber=None, start: float = None) -> list:
+    """
+    Publish a clip's cached `transcript` events at the clip's current place in
+    the stream (`start`, by default from its mtime like transcribe_video) and
+    take it into the transcriber's context, all without running Whisper.
+    """
+    audio = extract_audio(video_path)
+    if start is None:
+        start = _clip_start(video_path, audio)
+    segments = []
+    for evt in events:
+        segment = {"start": start + evt["clip_time"], "end": start + evt["clip_end"], "text": evt["text"]}
+        segments.append(segment)
+        event_q.put(dict(evt, timestamp=datetime.now(), stream_time=segment["start"], stream_end=segment["end"]))
+    if transcriber is not None:
+        transcriber.advance(audio, start, segments)
+    return segments
+
+
+def transcribe_video(video_path, event_q=None, transcriber=None, start: float = None, cancel=None):
+    """
+    Transcribe a clip from its audio track only. `start` is the clip's position
+    in the stream; by default it is taken from the file's mtime (segments are
+    closed when they end), so consecutive segments stitch together. If the
+    `cancel` event is set once the audio is extracted, Whisper is not run.
+    """
+    audio = extract_audio(video_path)
+    if cancel is not None and cancel.is_set():
+        return ""
+    if start is None:
+        start = _clip_start(video_path, audio)
+    return transcribe_audio(audio, start, event_q, transcriber)
 
 
 if __name__ == "__main__":
@@ -36,6 +243,5 @@ if __name__ == "__main__":
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     video_path = "videos/IMG_2227.mp4"  # Change this to your video file path
-    transcript = transcribe_video(video_path)
+    transcript = transcribe_video(video_path, transcriber=IncrementalTranscriber(vad=False), start=0.0)
     logging.getLogger('transcript').info(transcript)
-
@@ -0,0 +1,150 @@
+import os
+import math
+import logging
+import subprocess
+from collections import deque
+
+import numpy as np
+
+from services.hype import Baseline
+from services.metrics import CLIPS, timed
+
+TRIAGE_AUDIO_RATE = 8000
+TRIAGE_THUMB = (64, 36)
+
+
+def _spawn(cmd: list) -> subprocess.Popen:
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+
+
+def segment_signals(path: str, prev_thumb: np.ndarray = None, frame_ms: int = 100) -> dict:
+    """
+    Loudness and motion of a segment without running any model: the audio is
+    decoded at 8 kHz mono, and only keyframes are decoded (straight to 64x36
+    grayscale). Both ffmpeg processes run at once. Motion is the mean absolute
+    difference between consecutive keyframes in percent, starting from
+    `prev_thumb` (the previous segment's last keyframe) when given.
+    """
+    w, h = TRIAGE_THUMB
+    audio = _spawn(['ffmpeg', '-loglevel', 'error', '-i', path, '-vn', '-ac', '1',
+                    '-ar', str(TRIAGE_AUDIO_RATE), '-f', 's16le', 'pipe:1'])
+    video = _spawn(['ffmpeg', '-loglevel', 'error', '-skip_frame', 'nokey', '-i', path, '-an',
+                    '-vf', f'scale={w}:{h},format=gray', '-f', 'rawvideo', 'pipe:1'])
+    raw_audio, raw_video = audio.communicate()[0], video.communicate()[0]
+
+    samples = np.frombuffer(raw_audio, dtype=np.int16).astype(np.float32) / 32768.0
+    frame = TRIAGE_AUDIO_RATE * frame_ms // 1000
+    n = len(samples) // frame
+    if n:
+        rms = np.sqrt(np.mean(samples[:n * frame].reshape(n, frame) ** 2, axis=1) + 1e-12)
+        loud_db, peak_db = float(20 * np.log10(np.mean(rms))), float(20 * np.log10(rms.max()))
+    else:
+        loud_db = peak_db = -120.0
+
+    thumbs = np.frombuffer(raw_video, dtype=np.uint8)
+    thumbs = thumbs[:len(thumbs) // (w * h) * w * h].reshape(-1, h, w)
+    if prev_thumb is not None and len(thumbs):
+        thumbs = np.concatenate([prev_thumb[None], thumbs])
+    if len(thumbs) >= 2:
+        diffs = np.abs(np.diff(thumbs.astype(np.int16), axis=0)).mean(axis=(1, 2))
+        motion = float(diffs.max() / 2.55)
+    else:
+        motion = 0.0
+    return {
+        'loud_db': round(loud_db, 1),
+        'peak_db': round(peak_db, 1),
+        'motion': round(motion, 2),
+        'keyframes': len(thumbs),
+        'last_thumb': thumbs[-1].copy() if len(thumbs) else prev_thumb,
+    }
+
+
+class SegmentTriage:
+    """
+    Cheap first tier that decides which segments get the expensive analyzers.
+
+    Every segment is scored on chat hype (`in_hype`), loudness spikes and
+    motion spikes, each against an EMA baseline of this stream. A flagged
+    segment is analysed together with the `lookback` segments before it (held
+    back until then) and the `follow` segments after it. Segments nobody
+    flags are released unanalysed, in order, once they fall out of the
+    lookback window.
+    """
+
+    def __init__(self, lookback: int = 1, follow: int = 1, z_loud: float = 3.0, z_motion: float = 3.0,
+                 min_peak_db: float = -30.0, min_motion: float = 3.0, min_spread: float = 2.0,
+                 alpha: float = 0.1, warmup: int = 5, in_hype=None):
+        self.logger = logging.getLogger('main')
+        self.lookback = lookback
+        self.follow = follow
+        self.z_loud = z_loud
+        self.z_motion = z_motion
+        self.min_peak_db = min_peak_db
+        self.min_motion = min_motion
+        self.min_spread = min_spread
+        self.warmup = warmup
+        self.in_hype = in_hype or (lambda: False)
+        # dB and percent are not counts: start from a few units of spread
+        self.loudness = Baseline(alpha, initial=9.0)
+        self.motion = Baseline(alpha, initial=4.0)
+        self.held = deque()
+        self._following = 0
+        self._thumb = None
+        self.flagged = 0
+        self.skipped = 0
+
+    def _z(self, base: Baseline, value: float) -> float:
+        # a steady stream drives the variance to ~0; a floor keeps noise from reading as spikes
+        return (value - base.mean) / max(math.sqrt(base.var), self.min_spread)
+
+    def reasons(self, signals: dict) -> list:
+        out = []
+        if self.in_hype():
+            out.append('chat')
+        if self.loudness.samples >= self.warmup:
+            if signals['peak_db'] > self.min_peak_db and self._z(self.loudness, signals['peak_db']) > self.z_loud:
+                out.append('loud')
+            if signals['motion'] > self.min_motion and self._z(self.motion, signals['motion']) > self.z_motion:
+                out.append('motion')
+        return out
+
+    def assess(self, path: str) -> dict:
+        with timed('triage'):
+            signals = segment_signals(path, self._thumb)
+        self._thumb = signals.pop('last_thumb')
+        signals['reasons'] = self.reasons(signals)
+        # spikes are judged against the stream before them
+        self.loudness.update(signals['peak_db'])
+        self.motion.update(signals['motion'])
+        return signals
+
+    def push(self, path: str, clip_id: str) -> list:
+        """
+        Score a new segment; returns [(path, clip_id, analyze, live_end), ...]
+        in segment order. Lookback segments share the trigger's live_end so
+        they get its deadline rather than their own, already older one.
+        """
+        try:
+            signals = self.assess(path)
+        except Exception as e:
+            self.logger.error(f"Triage failed on {clip_id}, analysing it: {e}")
+            signals = {'reasons': ['error']}
+        live_end = os.path.getmtime(path)
+        if signals['reasons'] or self._following > 0:
+            if signals['reasons']:
+                self.logger.info(f"Triage flagged {clip_id}: {', '.join(signals['reasons'])} {signals}")
+                self._following = self.follow
+            else:
+                self._following -= 1
+            out = [(p, c, True, live_end) for p, c in self.held] + [(path, clip_id, True, live_end)]
+            self.held.clear()
+            self.flagged += len(out)
+            return out
+        self.held.append((path, clip_id))
+        out = []
+        while len(self.held) > self.lookback:
+            p, c = self.held.popleft()
+            out.append((p, c, False, None))
+            self.skipped += 1
+            CLIPS.inc(outcome='gated')
+        return out
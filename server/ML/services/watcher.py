@@ -0,0 +1,249 @@
+import os
+import time
+import queue
+import select
+import struct
+import fnmatch
+import logging
+import threading
+import ctypes
+import ctypes.util
+from collections import OrderedDict
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+class BoundedSet:
+    """Insertion-ordered set that forgets its oldest entries past `maxlen`"""
+
+    def __init__(self, maxlen: int = 4096):
+        self.maxlen = maxlen
+        self._items = OrderedDict()
+
+    def add(self, item):
+        self._items[item] = None
+        self._items.move_to_end(item)
+        while len(self._items) > self.maxlen:
+            self._items.popitem(last=False)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class _Inotify:
+    """Minimal ctypes binding to Linux inotify"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def read(self, timeout: float):
+        """Yield (mask, name) for every event available within `timeout` seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors='ignore')
+            offset += length
+            yield mask, name
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ClipWatcher:
+    """
+    Emits finished ffmpeg segments from `clips_dir` as soon as they are closed.
+
+    Completion is taken from, in order of preference:
+      * the segment muxer's list file (`-segment_list x.csv`), whose lines are
+        only written once a segment is complete
+      * inotify IN_CLOSE_WRITE / IN_MOVED_TO on the directory
+      * polling: a segment is finished once a newer segment exists, or once it
+        has been idle for `settle` seconds (the last segment of a stream)
+    """
+
+    def __init__(self, clips_dir: str, pattern: str = '*.mp4', segment_list: str = None,
+                 max_seen: int = 4096, poll_interval: float = 0.5, settle: float = 8.0,
+                 use_inotify: bool = True, ready: queue.Queue = None):
+        self.logger = logging.getLogger('main')
+        self.clips_dir = clips_dir
+        self.pattern = pattern
+        self.segment_list = segment_list
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.seen = BoundedSet(max_seen)
+        self.segment_times = OrderedDict()  # path -> (start, end) from the segment list
+        self._max_times = max_seen
+        self._list_offset = 0
+        self._ready = ready if ready is not None else queue.Queue()  # may be shared by several watchers
+        self._stop = threading.Event()
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError) as e:
+                self.logger.warning(f"inotify unavailable, falling back to polling: {e}")
+        self._thread = None
+
+    # ── public API ────────────────────────────────────────────────────────────
+    def start(self):
+        os.makedirs(self.clips_dir, exist_ok=True)
+        if self._inotify:
+            watches = {os.path.abspath(self.clips_dir): IN_CLOSE_WRITE | IN_MOVED_TO}
+            if self.segment_list:
+                # ffmpeg appends to the list in place, so listen for writes too
+                list_dir = os.path.dirname(os.path.abspath(self.segment_list))
+                watches[list_dir] = watches.get(list_dir, IN_CLOSE_WRITE | IN_MOVED_TO) | IN_MODIFY
+            for path, mask in watches.items():
+                self._inotify.add_watch(path, mask)
+            if not self.segment_list:
+                # segments that closed before we started watching; their close
+                # events are gone, so the newest counts once it stops growing
+                self._poll_directory(closed_if_stable=True)
+        target = self._run_inotify if self._inotify else self._run_polling
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+        mode = 'inotify' if self._inotify else 'polling'
+        source = f"segment list {self.segment_list}" if self.segment_list else "close events"
+        self.logger.info(f"Watching {self.clips_dir} ({mode}, completion from {source})")
+        return self
+
+    def get(self, timeout: float = None):
+        """Next finished clip path, or None if nothing finished within `timeout`"""
+        try:
+            return self._ready.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(1.0)
+        if self._inotify:
+            self._inotify.close()
+
+    # ── helpers ───────────────────────────────────────────────────────────────
+    def _matches(self, name: str) -> bool:
+        return fnmatch.fnmatch(name, self.pattern)
+
+    def _emit(self, path: str):
+        path = os.path.join(self.clips_dir, os.path.basename(path))
+        if path in self.seen:
+            return
+        self.seen.add(path)
+        try:
+            if os.path.getsize(path) == 0:
+                return
+        except OSError:
+            return
+        self._ready.put(path)
+
+    def _read_segment_list(self):
+        """Emit every segment appended to the list file since the last read"""
+        try:
+            size = os.path.getsize(self.segment_list)
+        except OSError:
+            return
+        if size < self._list_offset:  # ffmpeg restarted and truncated the list
+            self._list_offset = 0
+        with open(self.segment_list, 'r', errors='ignore') as f:
+            f.seek(self._list_offset)
+            chunk = f.read()
+        # only consume complete lines
+        complete = chunk[:chunk.rfind('\n') + 1]
+        self._list_offset += len(complete.encode())
+        for line in complete.splitlines():
+            parts = line.strip().split(',')
+            if not parts or not self._matches(os.path.basename(parts[0])):
+                continue
+            path = os.path.join(self.clips_dir, os.path.basename(parts[0]))
+            if len(parts) >= 3:
+                try:
+                    self.segment_times[path] = (float(parts[1]), float(parts[2]))
+                    while len(self.segment_times) > self._max_times:
+                        self.segment_times.popitem(last=False)
+                except ValueError:
+                    pass
+            self._emit(path)
+
+    def _run_inotify(self):
+        list_name = os.path.basename(self.segment_list) if self.segment_list else None
+        if list_name:
+            self._read_segment_list()
+        while not self._stop.is_set():
+            try:
+                for mask, name in self._inotify.read(self.poll_interval):
+                    if list_name:
+                        if name == list_name:
+                            self._read_segment_list()
+                    elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and self._matches(name):
+                        self._emit(os.path.join(self.clips_dir, name))
+            except Exception as e:
+                self.logger.error(f"Watcher error: {e}")
+                time.sleep(self.poll_interval)
+
+    def _run_polling(self):
+        while not self._stop.is_set():
+            try:
+                if self.segment_list:
+                    self._read_segment_list()
+                else:
+                    self._poll_directory()
+            except Exception as e:
+                self.logger.error(f"Watcher error: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def _unchanged(self, path: str) -> bool:
+        """Whether a file's size and mtime hold still for one poll interval"""
+        try:
+            before = os.stat(path)
+            self._stop.wait(self.poll_interval)
+            after = os.stat(path)
+        except OSError:
+            return False
+        return (before.st_size, before.st_mtime) == (after.st_size, after.st_mtime)
+
+    def _poll_directory(self, closed_if_stable: bool = False):
+        entries = []
+        with os.scandir(self.clips_dir) as it:
+            for entry in it:
+                if entry.is_file() and self._matches(entry.name):
+                    path = os.path.join(self.clips_dir, entry.name)
+                    if path not in self.seen:
+                        entries.append((entry.stat().st_mtime, path))
+        if not entries:
+            return
+        entries.sort()
+        now = time.time()
+        # the segment muxer writes one file at a time: everything but the newest is closed
+        for mtime, path in entries[:-1]:
+            self._emit(path)
+        mtime, newest = entries[-1]
+        if now - mtime >= self.settle or (closed_if_stable and self._unchanged(newest)):
+            self._emit(newest)
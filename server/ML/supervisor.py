@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+supervisor.py - the viral clip detector for many channels in one process
+Run with:  python supervisor.py --config streams.json
+
+streams.json lists one entry per streamer:
+
+    {"streams": [
+        {"name": "kvinhe", "stream_key": "ok", "channel": "#kvinhe", "output_dir": "output/kvinhe"},
+        {"name": "guest", "stream_key": "g1", "channel": "#guest", "output_dir": "output/guest",
+         "clips_dir": "media/guest", "record": false}
+    ]}
+
+Each stream is recorded into its own segment directory (media/<name> unless
+`clips_dir` is given; `"record": false` only watches it, for an external
+segmenter) and has its own ClipProcessor, hype state, triage baselines,
+degradation level and transcript. The models, the analyzer workers, the
+highlight and caption pools and the chat connection are shared: analysis
+slots go to the stream with the fewest clips in flight (see FairShare), and
+how far each stream is behind live is exported as clippy_stream_lag_seconds.
+"""
+import os
+import re
+import json
+import queue
+import time
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+from main import SEGMENT_SECONDS, loggers
+from services.clip_processor import ClipProcessor
+from services.models import get_registry
+from services.executor import ClipExecutor, FairShare, EXECUTOR_MODES
+from services.scheduler import ClipScheduler
+from services.transcript import IncrementalTranscriber
+from services.triage import SegmentTriage
+from services.watcher import ClipWatcher
+from services.recorder import RTMP_URL, SegmentRecorder
+from services.highlights import HighlightAssembler, SegmentIndex
+from services.captions import Captioner, TranscriptLog
+from services.analyzers import analyzer_versions
+from services.analysis_cache import get_cache
+from services.metrics import CLIPS, get_metrics
+from services.metrics import serve as serve_metrics
+
+_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+class StreamConfig:
+    """One (stream key, chat channel, output dir) entry of the supervisor config"""
+
+    __slots__ = ('name', 'stream_key', 'channel', 'output_dir', 'clips_dir', 'url', 'record')
+
+    def __init__(self, name: str, stream_key: str = None, channel: str = None, output_dir: str = None,
+                 clips_dir: str = None, url: str = None, record: bool = True):
+        if not _NAME.match(name or ''):
+            raise ValueError(f"Stream name {name!r} must be letters, digits, '-' or '_'")
+        self.name = name
+        self.stream_key = stream_key or name
+        self.channel = channel
+        self.output_dir = output_dir or os.path.join('output', name)
+        self.clips_dir = clips_dir or os.path.join('media', name)
+        self.url = url or RTMP_URL.format(key=self.stream_key)
+        self.record = record
+
+    @classmethod
+    def from_dict(cls, entry: dict):
+        unknown = set(entry) - set(cls.__slots__)
+        if unknown:
+            raise ValueError(f"Unknown stream settings {sorted(unknown)} in {entry}")
+        return cls(**entry)
+
+    def __repr__(self):
+        return f"StreamConfig({self.name!r}, channel={self.channel!r}, clips_dir={self.clips_dir!r})"
+
+
+def load_config(path: str) -> list:
+    """StreamConfigs from a JSON file: {"streams": [...]} or a bare list"""
+    with open(path) as f:
+        data = json.load(f)
+    entries = data.get('streams', []) if isinstance(data, dict) else data
+    configs = [StreamConfig.from_dict(entry) for entry in entries]
+    if not configs:
+        raise ValueError(f"No streams in {path}")
+    for field in ('name', 'clips_dir', 'output_dir'):
+        values = [os.path.abspath(getattr(c, field)) if field != 'name' else c.name for c in configs]
+        if len(set(values)) != len(values):
+            raise ValueError(f"Every stream needs its own {field}")
+    return configs
+
+
+class Stream:
+    """
+    Per-stream state: the clip processor and hype moment, segment index,
+    transcript and its transcriber context, triage and scheduler. New segments are checked and triaged
+    on the shared intake pool, one at a time per stream so triage sees them
+    in order; what it admits comes back to the supervisor loop.
+    """
+
+    def __init__(self, config: StreamConfig, lane, budget: float = None, max_backlog: int = None,
+                 triage: bool = True, lookback: int = 1, captions: bool = False):
+        self.config = config
+        self.name = config.name
+        self.processor = ClipProcessor()
+        self.index = SegmentIndex(segment_seconds=SEGMENT_SECONDS)
+        self.transcripts = TranscriptLog() if captions else None
+        # the executor feeds this stream's clips to it one after another, in segment order
+        self.transcriber = IncrementalTranscriber()
+        in_hype = lambda: self.processor.in_hype_moment  # noqa: E731
+        self.scheduler = ClipScheduler(lane, segment_seconds=SEGMENT_SECONDS, budget=budget,
+                                       max_backlog=max_backlog, in_hype=in_hype, metrics=False,
+                                       transcriber=self.transcriber)
+        self.gate = SegmentTriage(lookback=lookback, in_hype=in_hype) if triage else None
+        self.recorder = SegmentRecorder(config.url, config.clips_dir, SEGMENT_SECONDS) if config.record else None
+        self.watcher = None
+        self.viral = 0
+        self._intake = deque()
+        self._draining = False
+        self._lock = threading.Lock()
+
+    def start(self, ready: queue.Queue):
+        os.makedirs(self.config.output_dir, exist_ok=True)
+        segment_list = None
+        if self.recorder is not None:
+            self.recorder.start()
+            segment_list = self.recorder.segment_list
+        self.watcher = ClipWatcher(self.config.clips_dir, segment_list=segment_list, ready=ready).start()
+        return self
+
+    def clip_id(self, path: str) -> str:
+        # segment names repeat across streams; the prefix also routes analyzer events back here
+        return f"{self.name}/{os.path.basename(path)}"
+
+    def intake(self, path: str, pool: ThreadPoolExecutor, admitted: queue.Queue):
+        with self._lock:
+            self._intake.append(path)
+            if self._draining:
+                return
+            self._draining = True
+        pool.submit(self._drain, admitted)
+
+    def _drain(self, admitted: queue.Queue):
+        logger = loggers['main']
+        while True:
+            with self._lock:
+                if not self._intake:
+                    self._draining = False
+                    return
+                path = self._intake.popleft()
+            clip_id = self.clip_id(path)
+            try:
+                if not main.is_video_file_complete_and_valid(path):
+                    logger.warning(f"Skipping invalid/incomplete clip: {clip_id}")
+                    CLIPS.inc(outcome='invalid')
+                    continue
+                self.index.add(path)
+                admitted.put((self, self.gate.push(path, clip_id) if self.gate else [(path, clip_id, True, None)]))
+            except Exception as e:
+                logger.error(f"Intake of {clip_id} failed: {e}")
+
+    def stop(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.recorder is not None:
+            self.recorder.stop()
+
+
+class _Router:
+    """Stands in for the ClipProcessor of a shared ClipExecutor: events go to the stream in their clip id"""
+
+    def __init__(self, streams: dict):
+        self.streams = streams
+
+    def add_event(self, clip_id: str, evt: dict):
+        stream = self.streams.get(clip_id.split('/', 1)[0])
+        if stream is None:
+            return
+        stream.processor.add_event(clip_id, evt)
+        if stream.transcripts is not None:
+            stream.transcripts.add_event(evt)
+
+
+class Supervisor:
+    """
+    Runs every configured stream on one set of models and worker pools.
+
+    One watcher per stream feeds a shared queue; intake (validity check and
+    triage) runs on `intake_workers` threads; admitted segments go through
+    the stream's ClipScheduler into a FairShare of one ClipExecutor, and
+    finished clips are judged by the stream's processor, strictly in its
+    segment order. Each stream's transcripts run through its own
+    IncrementalTranscriber in segment order, up to `transcript_workers`
+    streams at once. Viral clips are cut from that stream's segments into its
+    output directory by the shared HighlightAssembler.
+    """
+
+    def __init__(self, configs: list, executor_mode: str = 'thread', workers: int = 4, warmup: bool = True,
+                 budget: float = None, max_backlog: int = None, triage: bool = True, lookback: int = 1,
+                 exact_cuts: bool = False, highlight_workers: int = 2, captions: bool = False,
+                 intake_workers: int = 4, transcript_workers: int = 1, report_every: float = 30.0):
+        self.logger = loggers['main']
+        self.executor_mode = executor_mode
+        self.warmup = warmup
+        self.report_every = report_every
+        self.executor = ClipExecutor(executor_mode, workers=workers, warmup=warmup,
+                                     transcript_workers=transcript_workers)
+        self.share = FairShare(self.executor)
+        self.streams = {c.name: Stream(c, self.share.lane(c.name), budget=budget, max_backlog=max_backlog,
+                                       triage=triage, lookback=lookback, captions=captions)
+                        for c in configs}
+        self._by_dir = {os.path.abspath(s.config.clips_dir): s for s in self.streams.values()}
+        self.assembler = HighlightAssembler(workers=highlight_workers, exact=exact_cuts)
+        self.captioner = Captioner() if captions else None
+        self.intake_pool = ThreadPoolExecutor(max_workers=intake_workers, thread_name_prefix='intake')
+        self.ready = queue.Queue()
+        self.admitted = queue.Queue()
+        metrics = get_metrics()
+        metrics.gauge('clippy_stream_lag_seconds', 'How far each stream\'s analysis is behind live', ('stream',),
+                      fn=lambda: {(n,): s.scheduler.lag() for n, s in self.streams.items()})
+        metrics.gauge('clippy_stream_degradation_level', 'Load-shedding level of each stream', ('stream',),
+                      fn=lambda: {(n,): s.scheduler.level for n, s in self.streams.items()})
+        metrics.gauge('clippy_stream_backlog', 'Clips submitted but not finished, per stream', ('stream',),
+                      fn=lambda: {(n,): s.scheduler.outstanding() for n, s in self.streams.items()})
+        metrics.gauge('clippy_stream_hype_active', '1 while a stream is in a hype moment', ('stream',),
+                      fn=lambda: {(n,): int(s.processor.in_hype_moment) for n, s in self.streams.items()})
+
+    def start(self):
+        # one model set for every stream (pool processes load their own in their initializer)
+        if self.executor_mode == 'thread':
+            get_registry().load(warmup=self.warmup)
+        cache = get_cache()
+        if cache is not None:
+            cache.prune_versions(analyzer_versions())
+        self.executor.start(_Router(self.streams))
+        routes = {s.config.channel: (s.processor, s.config.clips_dir)
+                  for s in self.streams.values() if s.config.channel}
+        if routes:
+            threading.Thread(target=main.chat_worker, args=(None, None), kwargs={'routes': routes},
+                             daemon=True).start()
+        for stream in self.streams.values():
+            stream.start(self.ready)
+        self.logger.info(f"Supervising {len(self.streams)} streams on {self.executor.workers} "
+                         f"{self.executor_mode} workers: {', '.join(self.streams)}")
+        return self
+
+    def _finish(self, stream: Stream):
+        for clip, clip_id, plan, completed in stream.scheduler.finished():
+            if plan is None:  # not flagged by triage, or shed under load
+                continue
+            if stream.transcripts is not None and 'transcript' in completed:
+                stream.transcripts.cover(os.path.getmtime(clip) - SEGMENT_SECONDS, os.path.getmtime(clip))
+            is_viral, desc, peak_time = main.finalize_clip(clip, stream.processor, clip_id,
+                                                           flagged=stream.gate is not None)
+            if is_viral:
+                stream.viral += 1
+                main.handle_viral_clip(self.assembler, stream.processor, clip, clip_id, desc, peak_time,
+                                       captioner=self.captioner, output_dir=stream.config.output_dir,
+                                       index=stream.index, transcripts=stream.transcripts)
+
+    def report(self):
+        waiting = self.share.backlog()
+        parts = []
+        for name, stream in self.streams.items():
+            recording = '' if stream.recorder is None or stream.recorder.running else ', not recording'
+            parts.append(f"{name} {stream.scheduler.lag():.1f}s behind (level {stream.scheduler.level}, "
+                         f"{waiting.get(name, 0)} waiting, {stream.viral} viral{recording})")
+        self.logger.info("Streams: " + "; ".join(parts))
+
+    def step(self, timeout: float = 0.2):
+        """One pass of the supervisor loop"""
+        try:
+            path = self.ready.get(timeout=timeout)
+        except queue.Empty:
+            path = None
+        while path:
+            stream = self._by_dir.get(os.path.dirname(os.path.abspath(path)))
+            if stream is not None:
+                stream.intake(path, self.intake_pool, self.admitted)
+            try:
+                path = self.ready.get_nowait()
+            except queue.Empty:
+                path = None
+        while True:
+            try:
+                stream, admitted = self.admitted.get_nowait()
+            except queue.Empty:
+                break
+            for clip, clip_id, analyze, live_end in admitted:
+                plan = stream.scheduler.submit(clip, clip_id, analyze=analyze, live_end=live_end)
+                if plan is not None:
+                    self.logger.info(f"Processing {clip_id} ({plan})")
+        for stream in self.streams.values():
+            if stream.recorder is not None:
+                stream.recorder.check()
+            self._finish(stream)
+
+    def run(self):
+        last_report = time.monotonic()
+        try:
+            while True:
+                try:
+                    self.step()
+                    if time.monotonic() - last_report >= self.report_every:
+                        last_report = time.monotonic()
+                        self.report()
+                except KeyboardInterrupt:
+                    raise
+                except Exception as e:
+                    self.logger.error(f"Error in supervisor loop: {e}")
+        except KeyboardInterrupt:
+            print("\n[Supervisor] Shutting down...")
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        for stream in self.streams.values():
+            stream.stop()
+        self.intake_pool.shutdown(wait=False, cancel_futures=True)
+        self.executor.shutdown()
+        self.assembler.shutdown(wait=False)
+        if self.captioner is not None:
+            self.captioner.shutdown(wait=False)
+        cache = get_cache()
+        if cache is not None:
+            cache.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Viral Clip Detector for many streams")
+    parser.add_argument("--config", required=True, help="JSON file listing the streams (see module docstring)")
+    parser.add_argument("--executor", choices=EXECUTOR_MODES, default="thread",
+                        help="Run clip analyzers on threads or on a process pool (one model set per process)")
+    parser.add_argument("--workers", type=int, default=4, help="Segments analysed concurrently, across all streams")
+    parser.add_argument("--intake_workers", type=int, default=4, help="Threads validating and triaging new segments")
+    parser.add_argument("--transcript_workers", type=int, default=1,
+                        help="Streams transcribed at once (each stream's clips are always transcribed in order)")
+    parser.add_argument("--no_warmup", action="store_true", help="Skip the dummy inference that warms models")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="Seconds after a segment ends live by which its analysis must finish")
+    parser.add_argument("--max_backlog", type=int, default=None,
+                        help="Most segments of one stream queued or in analysis before its oldest is dropped")
+    parser.add_argument("--no_triage", action="store_true", help="Run every analyzer on every segment")
+    parser.add_argument("--lookback", type=int, default=1, help="Segments before a flagged one analysed with it")
+    parser.add_argument("--exact_cuts", action="store_true", help="Start highlights exactly on the peak window")
+    parser.add_argument("--highlight_workers", type=int, default=2, help="Highlights assembled in parallel")
+    parser.add_argument("--captions", action="store_true", help="Burn captions into finished highlights")
+    parser.add_argument("--report_every", type=float, default=30.0, help="Seconds between per-stream status lines")
+    parser.add_argument("--cache_path", default="cache/analysis.sqlite", help="SQLite file for cached analyzer results")
+    parser.add_argument("--no_cache", action="store_true", help="Always re-run every analyzer")
+    parser.add_argument("--metrics_port", type=int, default=int(os.getenv("METRICS_PORT", "9108")),
+                        help="Serve Prometheus metrics on http://127.0.0.1:<port>/metrics (0 disables)")
+    args = parser.parse_args()
+    try:
+        configs = load_config(args.config)
+    except (OSError, ValueError, TypeError) as e:
+        parser.error(f"--config: {e}")
+    # through the environment so spawned pool processes see the same setting
+    os.environ["ANALYSIS_CACHE"] = "off" if args.no_cache else args.cache_path
+    serve_metrics(args.metrics_port)
+    Supervisor(configs, executor_mode=args.executor, workers=args.workers, warmup=not args.no_warmup,
+               budget=args.budget, max_backlog=args.max_backlog, triage=not args.no_triage,
+               lookback=args.lookback, exact_cuts=args.exact_cuts, highlight_workers=args.highlight_workers,
+               captions=args.captions, intake_workers=args.intake_workers,
+               transcript_workers=args.transcript_workers, report_every=args.report_every).start().run()
@@ -0,0 +1,89 @@
+"""Per-stream transcript chains of ClipExecutor, driven the way the supervisor does"""
+import os
+import time
+import random
+
+import numpy as np
+
+import services.executor as executor
+import services.transcript as transcript
+from services.executor import ClipExecutor, FairShare
+from services.scheduler import ClipScheduler
+from services.transcript import AUDIO_RATE, IncrementalTranscriber
+
+SEGMENT = 6.0
+CLIPS = 8
+
+
+class FakeWhisper:
+    """Stands in for the registry: one segment in the last clip's worth of each window, at a random pace"""
+
+    def __init__(self, stream: str, seed: int):
+        self.stream = stream
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    def transcribe(self, window, **kwargs):
+        time.sleep(self.rng.uniform(0, 0.05))
+        self.calls += 1
+        n = len(window) / AUDIO_RATE
+        return {"segments": [{"start": n - 5.5, "end": n - 0.5, "text": f"{self.stream} {self.calls}"}]}
+
+
+class Collector:
+    def __init__(self):
+        self.events = []
+
+    def add_event(self, clip_id, evt):
+        self.events.append((clip_id, evt))
+
+
+def test_interleaved_streams_keep_their_own_transcripts(tmp_path, monkeypatch):
+    monkeypatch.setenv("ANALYSIS_CACHE", "off")
+    monkeypatch.setattr(transcript, "extract_audio", lambda path: np.full(int(SEGMENT * AUDIO_RATE), 0.5, np.float32))
+    pace = random.Random(7)
+
+    def analyze_clip(path, clip_id, timeout, event_q, plan, deadline):
+        time.sleep(pace.uniform(0, 0.03))
+        executor._ClipEvents(event_q, clip_id).put({'type': 'done', 'part': 'analysis'})
+        return clip_id
+    monkeypatch.setattr(executor, "analyze_clip", analyze_clip)
+
+    pool = ClipExecutor('thread', workers=2, transcript_workers=2, timeout=30)
+    collector = Collector()
+    pool.start(collector)
+    share = FairShare(pool)
+    whisper = {s: FakeWhisper(s, seed) for seed, s in enumerate('ab')}
+    transcribers = {s: IncrementalTranscriber(vad=False, registry=whisper[s]) for s in 'ab'}
+    # a backlog deep enough that no clip is shed: every one must reach its transcriber
+    schedulers = {s: ClipScheduler(share.lane(s), segment_seconds=SEGMENT, budget=30, max_backlog=CLIPS,
+                                   metrics=False, transcriber=transcribers[s]) for s in 'ab'}
+    try:
+        # both streams' segments arrive interleaved, each closing SEGMENT seconds after the last
+        for i in range(CLIPS):
+            for s in 'ab':
+                path = tmp_path / f"{s}{i}.mp4"
+                path.touch()
+                os.utime(path, (time.time(), 1000 + SEGMENT * (i + 1)))
+                schedulers[s].submit(str(path), f"{s}/{i}", live_end=time.time())
+
+        finished = {s: [] for s in 'ab'}
+        end = time.time() + 10
+        while any(len(f) < CLIPS for f in finished.values()) and time.time() < end:
+            for s in 'ab':
+                finished[s] += [(clip_id, completed) for _, clip_id, _, completed in schedulers[s].finished()]
+            time.sleep(0.01)
+    finally:
+        pool.shutdown()
+
+    for s in 'ab':
+        assert [clip_id for clip_id, _ in finished[s]] == [f"{s}/{i}" for i in range(CLIPS)]
+        assert all('transcript' in completed for _, completed in finished[s])
+        segments = [evt for clip_id, evt in collector.events
+                    if clip_id.startswith(s + '/') and evt['type'] == 'transcript']
+        # one segment per clip, in order on the stream's timeline, all from this stream's Whisper
+        assert [round(evt['stream_time'] - 1000, 1) for evt in segments] == [SEGMENT * i + 0.5 for i in range(CLIPS)]
+        assert all(evt['text'].startswith(s + ' ') for evt in segments)
+        # every clip was stitched to the one before it
+        assert transcribers[s].resets == 0
+        assert whisper[s].calls == CLIPS
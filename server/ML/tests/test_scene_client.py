@@ -0,0 +1,124 @@
+"""SceneClient against the local mock of the chat-completions API (bench/mock_openai.py)"""
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+from bench.mock_openai import serve  # noqa: E402
+from services.scene_client import SceneClient  # noqa: E402
+
+
+def frame(seed: int) -> np.ndarray:
+    """A smooth random picture; distinct seeds give distinct perceptual hashes"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 200, (9, 16, 3), dtype=np.uint8)
+    return np.repeat(np.repeat(small, 20, axis=0), 20, axis=1)
+
+
+@pytest.fixture
+def mock():
+    servers = []
+
+    def start(**kwargs):
+        server, state, base_url = serve(**kwargs)
+        servers.append(server)
+        return state, base_url
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture
+def client_for():
+    clients = []
+
+    def make(base_url: str, **kwargs):
+        client = SceneClient(base_url, "mock-key", **kwargs)
+        clients.append(client)
+        return client
+    yield make
+    for client in clients:
+        client.close()
+
+
+def test_cache_hit_skips_the_request(mock, client_for):
+    state, base_url = mock(latency=0.0)
+    client = client_for(base_url)
+    first = client.submit(frame(1)).result()
+    # a brighter copy hashes the same and is answered from the cache
+    again = client.submit(frame(1) + 1).result()
+    assert first == again
+    assert state.snapshot()["requests"] == 1
+    assert client.stats()["cache_hits"] == 1
+
+
+def test_near_duplicates_in_flight_share_one_request(mock, client_for):
+    state, base_url = mock(latency=0.3)
+    client = client_for(base_url)
+    futures = [client.submit(frame(2) + i) for i in range(4)]
+    texts = [f.result() for f in futures]
+    assert len(set(texts)) == 1
+    assert state.snapshot()["requests"] == 1
+    assert client.deduped == 3
+
+
+def test_batch_leaves_out_frames_already_in_flight(mock, client_for):
+    state, base_url = mock(latency=0.3)
+    client = client_for(base_url)
+    single = client.submit(frame(3))
+    batch = client.submit_batch([frame(3) + 1, frame(4), frame(4) + 2, frame(5)]).result()
+    assert batch[0] == single.result()
+    assert batch[1] == batch[2]
+    assert len(set(batch)) == 3
+    snapshot = state.snapshot()
+    assert snapshot["requests"] == 2
+    assert snapshot["images"] == 3  # frame 3 once, then frames 4 and 5 in one request
+
+
+def test_rate_limit_paces_requests(mock, client_for):
+    state, base_url = mock(latency=0.0)
+    client = client_for(base_url, rate=10.0, burst=1)
+    start = time.perf_counter()
+    client.describe_frames([frame(10 + i) for i in range(6)])
+    # one token up front, then one every 1 / rate seconds
+    assert time.perf_counter() - start >= 0.45
+    assert state.snapshot()["requests"] == 6
+
+
+def test_retries_a_rate_limited_request(mock, client_for):
+    state, base_url = mock(latency=0.0, fail_first=2)
+    client = client_for(base_url, max_retries=3)
+    text = client.submit(frame(20)).result()
+    assert text.startswith("scene ")
+    assert state.snapshot()["requests"] == 3
+    assert client.failures == 0
+
+
+def test_gives_up_after_max_retries_and_fails_the_waiters(mock, client_for):
+    state, base_url = mock(latency=0.2, fail_rate=1.0)
+    client = client_for(base_url, max_retries=1)
+    futures = [client.submit(frame(30)), client.submit(frame(30) + 1)]
+    for fut in futures:
+        with pytest.raises(Exception):
+            fut.result()
+    assert state.snapshot()["requests"] == 2  # one attempt and one retry, shared by both frames
+    assert client.failures == 1
+    # nothing is left in flight: the next request goes out again
+    state.fail_rate = 0.0
+    assert client.submit(frame(30)).result().startswith("scene ")
+
+
+def test_cancelled_owner_does_not_fail_the_joined_frame(mock, client_for):
+    state, base_url = mock(latency=0.3)
+    client = client_for(base_url)
+    owner = client.submit(frame(40))
+    time.sleep(0.05)  # the owner's request is in flight before the near-duplicate joins it
+    joined = client.submit(frame(40) + 1)
+    time.sleep(0.05)
+    owner.cancel()  # e.g. its clip hit the deadline
+    assert joined.result(timeout=5).startswith("scene ")
+    assert owner.cancelled()
+    assert client.deduped == 1
@@ -1,34 +1,39 @@
-import whisperx
-import os
-import subprocess
-
-# Step 1: Transcribe video
-input_video = "videoplayback.mp4"
-srt_file = "captions.srt"
-output_video = "videoplayback_captioned.mp4"
+"""
+Burn captions into finished clips.
 
-print("🔁 Transcribing with WhisperX...")
-model = whisperx.load_model("large-v3", device="cuda")
-result = model.transcribe(input_video)
+    python app.py clip.mp4 [more.mp4 ...] [--output_dir DIR] [--workers 2]
 
-print("📝 Writing SRT file...")
-whisperx.utils.write_srt(result["segments"], srt_file)
+Clips are transcribed on CPU with an int8 Whisper (CAPTION_WHISPER, default
+"small") in a process pool, then captioned by a bounded pool of ffmpeg
+workers. Without --output_dir each clip is replaced by its captioned version.
+The live pipeline (server/ML/main.py --captions) uses the same service but
+takes the captions from its own transcript where it has one.
+"""
+import os
+import sys
+import logging
+import argparse
 
-# Step 2: Burn SRT into video using ffmpeg
-print("🎬 Burning subtitles into video with FFmpeg...")
-ffmpeg_command = [
-    "ffmpeg",
-    "-i", input_video,
-    "-vf", f"subtitles={srt_file}",
-    "-c:a", "copy",
-    output_video
-]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ML'))
 
-subprocess.run(ffmpeg_command, check=True)
+from services.captions import CAPTION_WHISPER, Captioner  # noqa: E402
 
-# Step 3: Replace the original video with captioned version
-print("🔄 Replacing original video...")
-os.remove(input_video)
-os.rename(output_video, input_video)
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Burn captions into video clips")
+    parser.add_argument("clips", nargs="+", help="Video files to caption")
+    parser.add_argument("--output_dir", default=None, help="Write captioned copies here instead of in place")
+    parser.add_argument("--workers", type=int, default=2, help="Clips burned in parallel")
+    parser.add_argument("--transcribe_workers", type=int, default=1, help="Whisper processes")
+    parser.add_argument("--whisper", default=CAPTION_WHISPER, help="Whisper model size")
+    args = parser.parse_args()
 
-print("✅ Done! Original video replaced with captioned version.")
+    captioner = Captioner(workers=args.workers, transcribe_workers=args.transcribe_workers,
+                          whisper_size=args.whisper)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    futures = [captioner.submit(clip, output_path=os.path.join(args.output_dir, os.path.basename(clip))
+                                if args.output_dir else None) for clip in args.clips]
+    for clip, future in zip(args.clips, futures):
+        print(f"✅ {clip} → {future.result()}")
+    captioner.shutdown()
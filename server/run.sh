@@ -34,6 +34,7 @@ if [[ "$1" == "--buffer" ]]; then
   nohup ffmpeg -i "$STREAM_URL" \
     -c copy -f segment -segment_time 6 \
     -reset_timestamps 1 -strftime 1 \
+    -segment_list media/segments.csv -segment_list_type csv \
     media/clip_%Y%m%d_%H%M%S.mp4 > ffmpeg.log 2>&1 &
 
   echo "🎥 Recording segments to ./media/ with timestamp names"